@@ -30,6 +30,7 @@ from builtins import object
 from past.builtins import basestring
 
 import collections
+import copy
 import csv
 from datetime import datetime
 from dicom.dataset import Dataset, FileDataset
@@ -39,7 +40,10 @@ import fnmatch
 import getpass
 import glob
 import gzip
+import hashlib
+import json
 from lxml import etree
+import logging
 import nibabel as nib
 import numpy as np
 from pyxnat import Interface
@@ -48,17 +52,21 @@ import os
 import random
 import re
 import shutil
+import socket
 import subprocess
 import tempfile
+import threading
 import time
 import xlrd
 import xml.etree.cElementTree as ET
 import yaml
 import zipfile
 
+from . import queue_layout
+from . import zip_stream
 from .task import (JOB_FAILED, JOB_RUNNING, JOB_PENDING, READY_TO_UPLOAD,
                    NEEDS_QA, RERUN, REPROC, FAILED_NEEDS_REPROC, BAD_QA_STATUS)
-from .errors import (XnatUtilsError, XnatAccessError,
+from .errors import (XnatUtilsError, XnatUploadError, XnatAccessError,
                      XnatAuthentificationError)
 from .dax_settings import (DAX_Settings, DAX_Netrc, DEFAULT_DATATYPE,
                            DEFAULT_FS_DATATYPE)
@@ -74,6 +82,16 @@ __all__ = ["InterfaceTemp", "AssessorHandler", "SpiderProcessHandler",
            "CachedImageSession", "CachedImageScan", "CachedImageAssessor",
            "CachedResource"]
 DAX_SETTINGS = DAX_Settings()
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Number of compiled type matchers kept in memory (least recently used out)
+MATCHER_CACHE_SIZE = 256
+_MATCHER_CACHE = collections.OrderedDict()
+_MATCHER_LOCK = threading.Lock()
+# Seconds waited before retrying a failed upload (doubled after each failure)
+UPLOAD_RETRY_DELAY = 2
+UPLOAD_RETRY_MAX_DELAY = 300
+UPLOAD_JOURNAL = '.%s_upload.json'
 NS = {'xnat': 'http://nrg.wustl.edu/xnat',
       'proc': 'http://nrg.wustl.edu/proc',
       'fs': 'http://nrg.wustl.edu/fs',
@@ -162,6 +180,13 @@ xnat:imagesessiondata/id,xnat:imagesessiondata/label,{pstype}/procstatus,\
 {pstype}/proctype,{pstype}/validation/status,{pstype}/procversion,\
 {pstype}/jobstartdate,{pstype}/memused,{pstype}/walltimeused,\
 {pstype}/jobid,{pstype}/jobnode,{pstype}/out/file/label'''
+ASSESSOR_MOD_PROJ_POST_URI = '''?project={project}&xsiType={atype}&\
+columns=ID,label,{atype}/meta/last_modified'''
+# Maximum number of IDs in one filtered query
+IDS_CHUNK_SIZE = 100
+# Projects referenced by a REST uri (path or query string)
+URI_PROJECT_RE = re.compile(
+    r'(?:/projects/|[?&]project=|/share/project=)([^/?&]+)')
 EXPERIMENT_POST_URI = '''?columns=ID,URI,subject_label,subject_ID,modality,\
 project,date,xsiType,label,xnat:subjectdata/meta/last_modified'''
 
@@ -178,16 +203,23 @@ class InterfaceTemp(Interface):
     Using netrc to get username password if not given.
     """
     def __init__(self, xnat_host=None, xnat_user=None, xnat_pass=None,
-                 temp_dir=None):
+                 temp_dir=None, cache_requests=True):
         """Entry point for the InterfaceTemp class.
 
         :param xnat_host: XNAT Host url
         :param xnat_user: XNAT User ID
         :param xnat_pass: XNAT Password
         :param temp_dir: Directory to write the Cache to
+        :param cache_requests: keep the json listings in memory so the same
+                               GET request is sent only once
         :return: None
 
         """
+        # Requests cache (uri: json listing)
+        self.cache_requests = cache_requests
+        self._requests_cache = dict()
+        self.cache_hits = 0
+        self.cache_misses = 0
         # Host
         self.host = xnat_host
         self.user = xnat_user
@@ -231,10 +263,75 @@ class InterfaceTemp(Interface):
 
         :return: None
         """
+        self.report_cache()
         self._exec('/data/JSESSION', method='DELETE')
         if os.path.exists(self.temp_dir):
             shutil.rmtree(self.temp_dir)
 
+    def _get_json(self, uri):
+        """Get the json listing for a uri, sent only once if cached.
+
+        A copy is returned since the callers edit the listing.
+
+        :param uri: uri to query
+        :return: list of dictionaries
+        """
+        if not self.cache_requests:
+            return super(InterfaceTemp, self)._get_json(uri)
+
+        if uri in self._requests_cache:
+            self.cache_hits += 1
+        else:
+            self.cache_misses += 1
+            self._requests_cache[uri] = super(InterfaceTemp,
+                                              self)._get_json(uri)
+        return copy.deepcopy(self._requests_cache[uri])
+
+    def _exec(self, uri, method='GET', *args, **kwargs):
+        """Send a request to XNAT, clearing the cache for any write.
+
+        :param uri: uri for the request
+        :param method: HTTP method (GET/PUT/POST/DELETE)
+        :return: content returned by XNAT
+        """
+        if method != 'GET':
+            self.invalidate_cache(uri)
+        return super(InterfaceTemp, self)._exec(uri, method, *args, **kwargs)
+
+    def invalidate_cache(self, uri=None):
+        """Remove the cached listings that a write on uri can change.
+
+        The listings of the project of the uri and the listings not tied
+         to a project are removed. Everything is removed if uri is None or
+         if no project is found in uri.
+
+        :param uri: uri written to
+        :return: None
+        """
+        # The cache is created in __init__ before the first request
+        if not getattr(self, '_requests_cache', None):
+            return
+        projects = set(URI_PROJECT_RE.findall(uri)) if uri else set()
+        if not projects:
+            self._requests_cache.clear()
+            return
+
+        for key in list(self._requests_cache.keys()):
+            key_projects = set(URI_PROJECT_RE.findall(key))
+            if not key_projects or key_projects & projects:
+                del self._requests_cache[key]
+
+    def report_cache(self):
+        """Log the hit rate of the requests cache.
+
+        :return: None
+        """
+        total = self.cache_hits + self.cache_misses
+        if self.cache_requests and total > 0:
+            msg = 'XNAT requests cache: %s hits for %s listings (%.1f%%)'
+            LOGGER.info(msg % (str(self.cache_hits), str(total),
+                               100.0 * self.cache_hits / total))
+
     def authenticate(self):
         """Authenticate to XNAT.
 
@@ -418,11 +515,11 @@ Wrong label.'
             raise XnatUtilsError(err)
 
         # Create the upload directory
-        self.directory = os.path.join(DAX_SETTINGS.get_results_dir(),
-                                      self.assr_handler.assessor_label)
+        self.directory = queue_layout.get_path(
+            DAX_SETTINGS.get_results_dir(), self.assr_handler.assessor_label)
         # if the folder already exists : remove it
         if not os.path.exists(self.directory):
-            os.mkdir(self.directory)
+            os.makedirs(self.directory)
         else:
             # Remove files in directories
             clean_directory(self.directory)
@@ -695,17 +792,18 @@ def get_proctype(spider, suffix=None):
 ###############################################################################
 #                     2) Query XNAT and Access XNAT obj                       #
 ###############################################################################
-def get_interface(host=None, user=None, pwd=None):
+def get_interface(host=None, user=None, pwd=None, cache_requests=True):
     """
     Opens a connection to XNAT.
 
     :param host: URL to connect to XNAT
     :param user: XNAT username
     :param pwd: XNAT password
+    :param cache_requests: send identical GET listings only once
     :return: InterfaceTemp object which extends functionaly of pyxnat.Interface
 
     """
-    return InterfaceTemp(host, user, pwd)
+    return InterfaceTemp(host, user, pwd, cache_requests=cache_requests)
 
 
 def list_projects(intf):
@@ -944,10 +1042,24 @@ def list_project_scans(intf, projectid, include_shared=True):
     :param include_shared: include the shared data in this project
     :return: List of all the scans for the project
     """
-    scans_dict = dict()
-
     # Get the sessions list to get the modality:
     session_list = list_sessions(intf, projectid)
+    return get_project_scans(intf, projectid, session_list, include_shared)
+
+
+def get_project_scans(intf, projectid, session_list, include_shared=True,
+                      session_ids=None):
+    """
+    List the scans of a project using a sessions list already queried.
+
+    :param intf: pyxnat.Interface object
+    :param projectid: ID of a project on XNAT
+    :param session_list: list of sessions from list_sessions for the project
+    :param include_shared: include the shared data in this project
+    :param session_ids: only query the scans of those sessions (IDs)
+    :return: List of the scans for the project
+    """
+    scans_dict = dict()
     sess_id2mod = dict((sess['session_id'], [sess['handedness'],
                         sess['gender'], sess['yob'], sess['age'],
                         sess['last_modified'], sess['last_updated']])
@@ -955,100 +1067,72 @@ def list_project_scans(intf, projectid, include_shared=True):
 
     post_uri = SE_ARCHIVE_URI
     post_uri += SCAN_PROJ_POST_URI.format(project=projectid)
-    scan_list = intf._get_json(post_uri)
-
-    pfix = 'xnat:imagescandata'
-    for scan in scan_list:
-        key = '%s-x-%s' % (scan['ID'], scan['%s/id' % pfix])
-        if scans_dict.get(key):
-            res = '%s/file/label' % pfix
-            scans_dict[key]['resources'].append(scan[res])
-        else:
-            snew = {}
-            snew['scan_id'] = scan['%s/id' % pfix]
-            snew['scan_label'] = scan['%s/id' % pfix]
-            snew['scan_quality'] = scan['%s/quality' % pfix]
-            snew['scan_note'] = scan['%s/note' % pfix]
-            snew['scan_frames'] = scan['%s/frames' % pfix]
-            snew['scan_description'] = scan['%s/series_description' % pfix]
-            snew['scan_type'] = scan['%s/type' % pfix]
-            snew['ID'] = scan['%s/id' % pfix]
-            snew['label'] = scan['%s/id' % pfix]
-            snew['quality'] = scan['%s/quality' % pfix]
-            snew['note'] = scan['%s/note' % pfix]
-            snew['frames'] = scan['%s/frames' % pfix]
-            snew['series_description'] = scan['%s/series_description' % pfix]
-            snew['type'] = scan['%s/type' % pfix]
-            snew['project_id'] = projectid
-            snew['project_label'] = projectid
-            snew['subject_id'] = scan['xnat:imagesessiondata/subject_id']
-            snew['subject_label'] = scan['subject_label']
-            snew['session_type'] = scan['xsiType'].split('xnat:')[1]\
-                                                  .split('Session')[0]\
-                                                  .upper()
-            snew['session_id'] = scan['ID']
-            snew['session_label'] = scan['label']
-            snew['session_uri'] = scan['URI']
-            snew['handedness'] = sess_id2mod[scan['ID']][0]
-            snew['gender'] = sess_id2mod[scan['ID']][1]
-            snew['yob'] = sess_id2mod[scan['ID']][2]
-            snew['age'] = sess_id2mod[scan['ID']][3]
-            snew['last_modified'] = sess_id2mod[scan['ID']][4]
-            snew['last_updated'] = sess_id2mod[scan['ID']][5]
-            snew['resources'] = [scan['%s/file/label' % pfix]]
-            # make a dictionary of dictionaries
-            scans_dict[key] = (snew)
+    for scan in get_json_by_ids(intf, post_uri, session_ids):
+        _add_project_scan(scans_dict, scan, projectid, sess_id2mod)
 
     if include_shared:
         post_uri = SE_ARCHIVE_URI
         post_uri += SCAN_PROJ_INCLUDED_POST_URI.format(project=projectid)
-        scan_list = intf._get_json(post_uri)
-
-        for scan in scan_list:
-            key = '%s-x-%s' % (scan['ID'], scan['%s/id' % pfix])
-            if scans_dict.get(key):
-                res = '%s/file/label' % pfix
-                scans_dict[key]['resources'].append(scan[res])
-            else:
-                snew = {}
-                snew['scan_id'] = scan['%s/id' % pfix]
-                snew['scan_label'] = scan['%s/id' % pfix]
-                snew['scan_quality'] = scan['%s/quality' % pfix]
-                snew['scan_note'] = scan['%s/note' % pfix]
-                snew['scan_frames'] = scan['%s/frames' % pfix]
-                snew['scan_description'] = scan['%s/series_description' % pfix]
-                snew['scan_type'] = scan['%s/type' % pfix]
-                snew['ID'] = scan['%s/id' % pfix]
-                snew['label'] = scan['%s/id' % pfix]
-                snew['quality'] = scan['%s/quality' % pfix]
-                snew['note'] = scan['%s/note' % pfix]
-                snew['frames'] = scan['%s/frames' % pfix]
-                snew['series_description'] = scan['%s/series_description'
-                                                  % pfix]
-                snew['type'] = scan['%s/type' % pfix]
-                snew['project_id'] = projectid
-                snew['project_label'] = projectid
-                snew['subject_id'] = scan['xnat:imagesessiondata/subject_id']
-                snew['subject_label'] = scan['subject_label']
-                snew['session_type'] = scan['xsiType'].split('xnat:')[1]\
-                                                      .split('Session')[0]\
-                                                      .upper()
-                snew['session_id'] = scan['ID']
-                snew['session_label'] = scan['label']
-                snew['session_uri'] = scan['URI']
-                snew['handedness'] = sess_id2mod[scan['ID']][0]
-                snew['gender'] = sess_id2mod[scan['ID']][1]
-                snew['yob'] = sess_id2mod[scan['ID']][2]
-                snew['age'] = sess_id2mod[scan['ID']][3]
-                snew['last_modified'] = sess_id2mod[scan['ID']][4]
-                snew['last_updated'] = sess_id2mod[scan['ID']][5]
-                snew['resources'] = [scan['%s/file/label' % pfix]]
-                # make a dictionary of dictionaries
-                scans_dict[key] = (snew)
+        for scan in get_json_by_ids(intf, post_uri, session_ids):
+            _add_project_scan(scans_dict, scan, projectid, sess_id2mod)
 
     return sorted(list(scans_dict.values()), key=lambda k: k['session_label'])
 
 
+def _add_project_scan(scans_dict, scan, projectid, sess_id2mod):
+    """
+    Add a row of the project scans query to the scans dictionary.
+
+    One row is returned by XNAT for each resource of a scan.
+
+    :param scans_dict: dictionary of scans (key: sessionID-x-scanID)
+    :param scan: row returned by XNAT
+    :param projectid: ID of a project on XNAT
+    :param sess_id2mod: dictionary of session information by session ID
+    :return: None
+    """
+    pfix = 'xnat:imagescandata'
+    key = '%s-x-%s' % (scan['ID'], scan['%s/id' % pfix])
+    if scans_dict.get(key):
+        res = '%s/file/label' % pfix
+        scans_dict[key]['resources'].append(scan[res])
+    else:
+        snew = {}
+        snew['scan_id'] = scan['%s/id' % pfix]
+        snew['scan_label'] = scan['%s/id' % pfix]
+        snew['scan_quality'] = scan['%s/quality' % pfix]
+        snew['scan_note'] = scan['%s/note' % pfix]
+        snew['scan_frames'] = scan['%s/frames' % pfix]
+        snew['scan_description'] = scan['%s/series_description' % pfix]
+        snew['scan_type'] = scan['%s/type' % pfix]
+        snew['ID'] = scan['%s/id' % pfix]
+        snew['label'] = scan['%s/id' % pfix]
+        snew['quality'] = scan['%s/quality' % pfix]
+        snew['note'] = scan['%s/note' % pfix]
+        snew['frames'] = scan['%s/frames' % pfix]
+        snew['series_description'] = scan['%s/series_description' % pfix]
+        snew['type'] = scan['%s/type' % pfix]
+        snew['project_id'] = projectid
+        snew['project_label'] = projectid
+        snew['subject_id'] = scan['xnat:imagesessiondata/subject_id']
+        snew['subject_label'] = scan['subject_label']
+        snew['session_type'] = scan['xsiType'].split('xnat:')[1]\
+                                              .split('Session')[0]\
+                                              .upper()
+        snew['session_id'] = scan['ID']
+        snew['session_label'] = scan['label']
+        snew['session_uri'] = scan['URI']
+        snew['handedness'] = sess_id2mod[scan['ID']][0]
+        snew['gender'] = sess_id2mod[scan['ID']][1]
+        snew['yob'] = sess_id2mod[scan['ID']][2]
+        snew['age'] = sess_id2mod[scan['ID']][3]
+        snew['last_modified'] = sess_id2mod[scan['ID']][4]
+        snew['last_updated'] = sess_id2mod[scan['ID']][5]
+        snew['resources'] = [scan['%s/file/label' % pfix]]
+        # make a dictionary of dictionaries
+        scans_dict[key] = (snew)
+
+
 def list_scan_resources(intf, projectid, subjectid, sessionid, scanid):
     """
     Gets a list of all of the resources for a scan associated to a
@@ -1150,10 +1234,22 @@ def list_project_assessors(intf, projectid):
     :param projectid: ID of a project on XNAT
     :return: List of all the assessors for the project
     """
-    assessors_dict = dict()
-
     # Get the sessions list to get the different variables needed:
     session_list = list_sessions(intf, projectid)
+    return get_project_assessors(intf, projectid, session_list)
+
+
+def get_project_assessors(intf, projectid, session_list, assessor_ids=None):
+    """
+    List the assessors of a project using a sessions list already queried.
+
+    :param intf: pyxnat.Interface object
+    :param projectid: ID of a project on XNAT
+    :param session_list: list of sessions from list_sessions for the project
+    :param assessor_ids: only query those assessors (IDs)
+    :return: List of the assessors for the project
+    """
+    assessors_dict = dict()
     sess_id2mod = dict((sess['session_id'], [sess['subject_label'],
                         sess['type'], sess['handedness'], sess['gender'],
                         sess['yob'], sess['age'], sess['last_modified'],
@@ -1164,7 +1260,7 @@ def list_project_assessors(intf, projectid):
         post_uri = SE_ARCHIVE_URI
         post_uri += ASSESSOR_FS_PROJ_POST_URI.format(
             project=projectid, fstype=DEFAULT_FS_DATATYPE)
-        assessor_list = intf._get_json(post_uri)
+        assessor_list = get_json_by_ids(intf, post_uri, assessor_ids)
 
         pfix = DEFAULT_FS_DATATYPE.lower()
         for asse in assessor_list:
@@ -1218,7 +1314,7 @@ def list_project_assessors(intf, projectid):
         post_uri = SE_ARCHIVE_URI
         post_uri += ASSESSOR_PR_PROJ_POST_URI.format(project=projectid,
                                                      pstype=DEFAULT_DATATYPE)
-        assessor_list = intf._get_json(post_uri)
+        assessor_list = get_json_by_ids(intf, post_uri, assessor_ids)
 
         pfix = DEFAULT_DATATYPE.lower()
         for asse in assessor_list:
@@ -1265,6 +1361,58 @@ def list_project_assessors(intf, projectid):
     return sorted(list(assessors_dict.values()), key=lambda k: k['label'])
 
 
+def list_project_assessors_modified(intf, projectid):
+    """
+    List the last modified date of every assessor of a project.
+
+    Much lighter than list_project_assessors: one row per assessor and no
+     resources, used to know which assessors changed since a previous query.
+
+    :param intf: pyxnat.Interface object
+    :param projectid: ID of a project on XNAT
+    :return: dictionary of assessor ID: last_modified
+    """
+    modified = dict()
+    datatypes = list()
+    if has_fs_datatypes(intf):
+        datatypes.append(DEFAULT_FS_DATATYPE)
+    if has_genproc_datatypes(intf):
+        datatypes.append(DEFAULT_DATATYPE)
+
+    for datatype in datatypes:
+        post_uri = SE_ARCHIVE_URI
+        post_uri += ASSESSOR_MOD_PROJ_POST_URI.format(project=projectid,
+                                                      atype=datatype)
+        pfix = datatype.lower()
+        for asse in intf._get_json(post_uri):
+            modified[asse['ID']] = asse.get('%s/meta/last_modified' % pfix)
+
+    return modified
+
+
+def get_json_by_ids(intf, post_uri, ids=None, chunk_size=IDS_CHUNK_SIZE):
+    """
+    Get a json listing from XNAT, restricted to a list of IDs if given.
+
+    The IDs are sent by chunks to keep the URI short.
+
+    :param intf: pyxnat.Interface object
+    :param post_uri: uri to query (with the query string)
+    :param ids: list of IDs to filter the listing on, None for everything
+    :param chunk_size: number of IDs per request
+    :return: list of rows returned by XNAT
+    """
+    if ids is None:
+        return intf._get_json(post_uri)
+
+    ids = list(ids)
+    rows = list()
+    for index in range(0, len(ids), chunk_size):
+        id_str = ','.join(ids[index:index + chunk_size])
+        rows.extend(intf._get_json('%s&ID=%s' % (post_uri, id_str)))
+    return rows
+
+
 def list_assessor_out_resources(intf, projectid, subjectid, sessionid,
                                 assessorid):
     """
@@ -1531,11 +1679,8 @@ def is_cscan_good_type(cscan, types_list, full_regex=False):
     :return: True if type is in the list, False if not.
 
     """
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(cscan.info()['type']):
-            return True
-    return False
+    matcher = get_matcher(types_list, full_regex)
+    return matcher.match(cscan.info()['type']) is not None
 
 
 def is_scan_unusable(scan_obj):
@@ -1559,11 +1704,9 @@ def is_scan_good_type(scan_obj, types_list, full_regex=False):
     :return: True if scan is in type list, False if not.
 
     """
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(scan_obj.attrs.get('xnat:imageScanData/type')):
-            return True
-    return False
+    matcher = get_matcher(types_list, full_regex)
+    scan_type = scan_obj.attrs.get('xnat:imageScanData/type')
+    return matcher.match(scan_type) is not None
 
 
 def has_resource(cobj, resource_label):
@@ -1576,9 +1719,8 @@ def has_resource(cobj, resource_label):
              False if not.
 
     """
-    res_list = [res for res in cobj.get_resources()
-                if res['label'] == resource_label]
-    if len(res_list) > 0 and res_list[0]['file_count'] > 0:
+    cres = cobj.get_resource(resource_label)
+    if cres is not None and cres.info()['file_count'] > 0:
         return True
     return False
 
@@ -1608,11 +1750,11 @@ def get_cassr_on_same_session(cobj, proctype, is_scan_proc=False):
                                      obj_info['subject_label'],
                                      obj_info['session_label'],
                                      proctype])
-        cassr_list = [cassr for cassr in cobj.parent().assessors()
-                      if cassr.info()['label'] == assr_label]
+        cassr = cobj.parent().get_assessor(assr_label)
+        if cassr is not None:
+            cassr_list.append(cassr)
     elif isinstance(cobj, CachedImageSession):
-        cassr_list = [cassr for cassr in cobj.assessors()
-                      if cassr.info()['proctype'] == proctype]
+        cassr_list = cobj.get_assessors_by_proctype(proctype)
     return cassr_list
 
 
@@ -1664,12 +1806,11 @@ def is_assessor_same_scan_unusable(cscan, proctype):
                              scan_info['subject_label'],
                              scan_info['session_label'],
                              scan_info['ID'], proctype])
-    assr_list = [cassr.info() for cassr in cscan.parent().assessors()
-                 if cassr.info()['label'] == assr_label]
-    if not assr_list:
+    cassr = cscan.parent().get_assessor(assr_label)
+    if cassr is None:
         return 0
     else:
-        return is_bad_qa(assr_list[0]['qcstatus'])
+        return is_bad_qa(cassr.info()['qcstatus'])
 
 
 def is_cassessor_good_type(cassr, types_list, full_regex=False):
@@ -1683,12 +1824,8 @@ def is_cassessor_good_type(cassr, types_list, full_regex=False):
     :return: True if proctype is in the list, False if not.
 
     """
-    assr_info = cassr.info()
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(assr_info['proctype']):
-            return True
-    return False
+    matcher = get_matcher(types_list, full_regex)
+    return matcher.match(cassr.info()['proctype']) is not None
 
 
 def is_cassessor_usable(cassr):
@@ -1715,11 +1852,8 @@ def is_assessor_good_type(assessor_obj, types_list, full_regex=False):
     """
     atype = assessor_obj.attrs.get('xsiType')
     proctype = assessor_obj.attrs.get('%s/proctype' % atype)
-    for exp in types_list:
-        regex = extract_exp(exp, full_regex)
-        if regex.match(proctype):
-            return True
-    return False
+    matcher = get_matcher(types_list, full_regex)
+    return matcher.match(proctype) is not None
 
 
 def is_assessor_usable(assessor_obj):
@@ -1754,7 +1888,7 @@ def is_bad_qa(qcstatus):
     return 1
 
 
-def get_good_cscans(csess, scantypes, needs_qc=True):
+def get_good_cscans(csess, scantypes, needs_qc=True, full_regex=False):
     """
     Given a CachedImageSession, get the list of all of the usable
      CachedImageScan objects in the session
@@ -1762,13 +1896,14 @@ def get_good_cscans(csess, scantypes, needs_qc=True):
     :param csess: CachedImageSession object from XnatUtils
     :param scantypes: List of scantypes to filter for
     :param needs_qc: if we are looking for assessor with qc that passed
+    :param full_regex: use full regex expression
     :return: List of CachedImageScan objects that fit the scantypes and that
      are usable
 
     """
     cscans_list = list()
     for cscan in csess.scans():
-        if is_cscan_good_type(cscan, scantypes) and \
+        if is_cscan_good_type(cscan, scantypes, full_regex) and \
            (not needs_qc or not is_cscan_unusable(cscan)):
             cscans_list.append(cscan)
     return cscans_list
@@ -1793,7 +1928,7 @@ def get_good_scans(session_obj, scantypes, needs_qc=True):
     return scans
 
 
-def get_good_cassr(csess, proctypes, needs_qc=True):
+def get_good_cassr(csess, proctypes, needs_qc=True, full_regex=False):
     """
     Get all the assessors in the session and filter out the ones that are
      usable and that have the proctype(s) specified
@@ -1801,6 +1936,7 @@ def get_good_cassr(csess, proctypes, needs_qc=True):
     :param csess: CachedImageSession object from XnatUtils
     :param proctypes: List of proctypes to filter for
     :param needs_qc: if we are looking for assessor with qc that passed
+    :param full_regex: use full regex expression
     :return: List of CachedImageAssessor objects that are usable and have
      one of the proctype(s) specified.
 
@@ -1808,7 +1944,7 @@ def get_good_cassr(csess, proctypes, needs_qc=True):
     cassr_list = list()
     for cassr in csess.assessors():
         usable_status = is_cassessor_usable(cassr)
-        if is_cassessor_good_type(cassr, proctypes) and \
+        if is_cassessor_good_type(cassr, proctypes, full_regex) and \
            (not needs_qc or usable_status == 1) and \
            cassr.info()['procstatus'] != 'NEED_INPUTS':
             cassr_list.append(cassr)
@@ -2213,7 +2349,11 @@ def upload_file_to_obj(filepath, resource_obj, remove=False, removeall=False,
                 print("WARNING: upload_file_to_obj in XnatUtils: resource %s \
 already exists." % filename)
                 return False
-        resource_obj.file(str(filename)).put(str(filepath), overwrite=True, params={"event_reason": "DAX uploading file"})
+        retry_upload(lambda: resource_obj.file(str(filename)).put(
+            str(filepath), overwrite=True,
+            params={"event_reason": "DAX uploading file"}),
+            'upload of %s' % filepath,
+            errors=(XnatUploadError, DatabaseError, socket.error))
         return True
 
 
@@ -2308,6 +2448,11 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
     """
     Upload all of the files in a folder based on the pyxnat EObject passed
 
+    The folder is zipped on the fly and streamed to XNAT (see zip_stream.py):
+     no zip is written on the disk. The large folders are uploaded in parts
+     and an interrupted upload resumes from the last part uploaded (see
+     upload_folder_parts).
+
     :param directory: Full path of the directory to upload
     :param resource_obj: pyxnat EObject to upload the data to
     :param resource_label: label of where you want the contents of the
@@ -2324,7 +2469,9 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
         raise XnatUtilsError(err % ('upload_folder_to_obj', directory))
 
     if resource_obj.exists():
-        if removeall:
+        if removeall and is_upload_resumed(directory):
+            LOGGER.info('resuming the upload of %s' % directory)
+        elif removeall:
             resource_obj.delete()
         elif not remove:
             # check if any files already exists on XNAT, if yes return FALSE
@@ -2334,19 +2481,235 @@ def upload_folder_to_obj(directory, resource_obj, resource_label, remove=False,
 %s already found on XNAT. No upload. Use remove/removeall." % fpath)
                     return False
 
-    fzip = '%s.zip' % resource_label
-    initdir = os.getcwd()
-    # Zip all the files in the directory
-    os.chdir(directory)
-    os.system('zip -r %s * > /dev/null' % fzip)
+    if not resource_obj.exists():
+        resource_obj.create()
     # upload
-    resource_obj.put_zip(os.path.join(directory, fzip), overwrite=True,
-                         extract=extract)
-    # return to the initial directory:
-    os.chdir(initdir)
+    upload_folder_parts(resource_obj._intf, resource_obj._uri, directory,
+                        resource_label, extract=extract)
     return True
 
 
+class UploadJournal(object):
+    """
+    Parts of a folder already uploaded to XNAT
+
+    The journal is a json file next to the folder, in the assessor folder:
+     it is removed with the assessor folder once uploaded.
+    """
+    def __init__(self, directory):
+        """
+        Entry point for the UploadJournal class
+
+        :param directory: folder uploaded
+        :return: None
+        """
+        self.path = os.path.join(
+            os.path.dirname(os.path.abspath(directory)),
+            UPLOAD_JOURNAL % os.path.basename(os.path.abspath(directory)))
+        self.parts = list()
+        if os.path.isfile(self.path):
+            try:
+                with open(self.path) as fjournal:
+                    self.parts = json.load(fjournal).get('parts', list())
+            except (IOError, ValueError) as err:
+                LOGGER.warn('cannot read %s: %s' % (self.path, str(err)))
+
+    def is_done(self, part_id):
+        """
+        Check if a part was uploaded
+
+        :param part_id: ID of the part (see get_part_id)
+        :return: True if the part was uploaded
+        """
+        return part_id in self.parts
+
+    def set_done(self, part_id):
+        """
+        Record that a part was uploaded
+
+        The journal is written to a temporary file then renamed, so an
+         interrupted write never leaves a truncated journal.
+
+        :param part_id: ID of the part (see get_part_id)
+        :return: None
+        """
+        self.parts.append(part_id)
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as fjournal:
+            json.dump({'parts': self.parts}, fjournal)
+        os.rename(tmp_path, self.path)
+
+    def remove(self):
+        """
+        Remove the journal once all the parts are uploaded
+
+        :return: None
+        """
+        self.parts = list()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def get_upload_parts(files, part_size):
+    """
+    Split the files of a folder into parts of bounded size
+
+    A file larger than part_size is a part on its own (a file can not be
+     split in several uploads to XNAT).
+
+    :param files: list of (path of the file, name in the zip)
+    :param part_size: maximum size of a part in bytes
+    :return: list of parts (list of (path of the file, name in the zip))
+    """
+    parts = list()
+    part = list()
+    size = 0
+    for fpath, name in files:
+        fsize = os.path.getsize(fpath)
+        if part and size + fsize > part_size:
+            parts.append(part)
+            part = list()
+            size = 0
+        part.append((fpath, name))
+        size += fsize
+    if part:
+        parts.append(part)
+    return parts
+
+
+def get_part_id(part):
+    """
+    Get the ID of a part: md5 of the names, sizes and modification times of
+     its files, so a part changes when one of its files changes.
+
+    :param part: list of (path of the file, name in the zip)
+    :return: ID of the part
+    """
+    md5 = hashlib.md5()
+    for fpath, name in part:
+        fstat = os.stat(fpath)
+        md5.update(('%s %d %d\n' % (name, fstat.st_size,
+                                     int(fstat.st_mtime))).encode('utf-8'))
+    return md5.hexdigest()
+
+
+def is_upload_resumed(directory, files=None, part_size=None):
+    """
+    Check if a part of a folder was already uploaded by an interrupted upload
+
+    :param directory: folder to upload
+    :param files: list of (path of the file, name in the zip) to upload (all
+     the files of the folder if None)
+    :param part_size: maximum size of a part in bytes (upload_part_size in
+     the settings if None)
+    :return: True if the journal of the folder has one of its parts
+    """
+    journal = UploadJournal(directory)
+    if not journal.parts:
+        return False
+    if files is None:
+        files = zip_stream.list_zip_files(directory)
+    if not part_size:
+        part_size = DAX_SETTINGS.get_upload_part_size() * 1024 * 1024
+    return any(journal.is_done(get_part_id(part))
+               for part in get_upload_parts(files, part_size))
+
+
+def retry_upload(upload_func, what, retries=None, errors=(XnatUploadError,)):
+    """
+    Call an upload function, retrying with an exponential backoff
+
+    The XnatUploadError with a HTTP status below 500 (refused by XNAT) are
+     not retried.
+
+    :param upload_func: function uploading the data
+    :param what: description of the upload for the logs
+    :param retries: number of retries (upload_retries in the settings if
+     None)
+    :param errors: exceptions retried
+    :return: value returned by upload_func
+    """
+    if retries is None:
+        retries = DAX_SETTINGS.get_upload_retries()
+    delay = UPLOAD_RETRY_DELAY
+    for attempt in range(retries + 1):
+        try:
+            return upload_func()
+        except errors as err:
+            status = getattr(err, 'status', None)
+            if attempt == retries or (status is not None and status < 500):
+                raise
+            LOGGER.warn('%s failed (%s), retry %s/%s in %s seconds'
+                        % (what, str(err), str(attempt + 1), str(retries),
+                           str(delay)))
+            time.sleep(delay)
+            delay = min(delay * 2, UPLOAD_RETRY_MAX_DELAY)
+
+
+def upload_folder_parts(intf, resource_uri, directory, resource_label,
+                        files=None, extract=True, part_size=None,
+                        retries=None, timeout=None):
+    """
+    Upload a folder to a resource in parts, resuming an interrupted upload
+
+    The files are split into parts of at most part_size bytes, each part is
+     uploaded as a zip streamed to XNAT and extracted in the resource (see
+     zip_stream.py). The parts uploaded are recorded in the journal of the
+     folder (see UploadJournal): when the upload is interrupted, the next
+     upload of the same folder only sends the parts not recorded. A part
+     that failed is retried with an exponential backoff.
+
+    :param intf: pyxnat.Interface object
+    :param resource_uri: uri of the resource
+    :param directory: folder to upload
+    :param resource_label: label of the resource
+    :param files: list of (path of the file, name in the zip) to upload (all
+     the files of the folder if None)
+    :param extract: extract the files of the zips in the resource (the
+     folder is uploaded in one part if False)
+    :param part_size: maximum size of a part in bytes (upload_part_size in
+     the settings if None)
+    :param retries: number of retries of a part (upload_retries in the
+     settings if None)
+    :param timeout: seconds without progress before the upload of a part
+     fails and is retried (upload_timeout in the settings if None)
+    :return: number of bytes sent
+    """
+    if files is None:
+        files = zip_stream.list_zip_files(directory)
+    if not part_size:
+        part_size = DAX_SETTINGS.get_upload_part_size() * 1024 * 1024
+    if not timeout:
+        timeout = DAX_SETTINGS.get_upload_timeout()
+    if extract:
+        parts = get_upload_parts(files, part_size)
+    else:
+        # The zip is kept on XNAT: one zip for the whole folder
+        parts = [files]
+    journal = UploadJournal(directory)
+    sent = 0
+    for index, part in enumerate(parts):
+        part_id = get_part_id(part)
+        if journal.is_done(part_id):
+            LOGGER.debug('    part %s/%s of %s already uploaded'
+                         % (str(index + 1), str(len(parts)), resource_label))
+            continue
+        zip_name = '%s.zip' % resource_label
+        if len(parts) > 1:
+            zip_name = '%s_part%d.zip' % (resource_label, index + 1)
+        sent += retry_upload(
+            lambda: zip_stream.put_folder_zip(intf, resource_uri, directory,
+                                              zip_name, extract, files=part,
+                                              timeout=timeout),
+            'upload of part %s/%s of %s' % (str(index + 1), str(len(parts)),
+                                            resource_label),
+            retries)
+        if len(parts) > 1:
+            journal.set_done(part_id)
+    journal.remove()
+    return sent
+
+
 def upload_folder(directory, project_id=None, subject_id=None, session_id=None,
                   scan_id=None, assessor_id=None, resource=None, remove=False,
                   removeall=False, extract=True):
@@ -2493,13 +2856,11 @@ def filter_list_dicts_regex(list_dicts, key, expressions, nor=False,
 found, <type 'str'> or <type 'list'> required." % type(expressions)
         raise XnatUtilsError(err)
 
-    for exp in expressions:
-        regex = extract_exp(exp, full_regex)
-        if nor:
-            flist = [d for d in flist if not regex.match(d[key])]
-        else:
-            flist.extend([d for d in list_dicts
-                          if regex.match(d[key])])
+    matcher = get_matcher(expressions, full_regex)
+    if nor:
+        flist = [d for d in flist if not matcher.match(d[key])]
+    else:
+        flist = [d for d in list_dicts if matcher.match(d[key])]
     return flist
 
 
@@ -2510,9 +2871,77 @@ def extract_exp(expression, full_regex=False):
     :param full_regex: using full regex
     :return: regex Object from re package
     """
-    if not full_regex:
-        exp = fnmatch.translate(expression)
-    return re.compile(exp)
+    return get_matcher([expression], full_regex)
+
+
+def get_matcher(expressions, full_regex=False):
+    """Get the compiled regex matching any of the expressions.
+
+    The expressions are combined in one regex compiled once and kept in a
+     bounded cache (least recently used out, see MATCHER_CACHE_SIZE).
+
+    :param expressions: list of expressions (fnmatch or regex)
+    :param full_regex: expressions are full regex instead of fnmatch
+    :return: object with a match(string) method like a regex Object
+    """
+    key = (tuple(expressions), bool(full_regex))
+    with _MATCHER_LOCK:
+        matcher = _MATCHER_CACHE.pop(key, None)
+        if matcher is None:
+            matcher = compile_matcher(key[0], full_regex)
+        _MATCHER_CACHE[key] = matcher
+        while len(_MATCHER_CACHE) > MATCHER_CACHE_SIZE:
+            _MATCHER_CACHE.popitem(last=False)
+    return matcher
+
+
+def compile_matcher(expressions, full_regex=False):
+    """Compile the expressions in one regex (alternatives).
+
+    :param expressions: list of expressions (fnmatch or regex)
+    :param full_regex: expressions are full regex instead of fnmatch
+    :return: object with a match(string) method like a regex Object
+    """
+    if full_regex:
+        patterns = list(expressions)
+    else:
+        patterns = [fnmatch.translate(exp) for exp in expressions]
+
+    if len(patterns) == 1:
+        return re.compile(patterns[0])
+    if not patterns:
+        # Nothing to match
+        return re.compile(r'(?!)')
+    try:
+        return re.compile('|'.join(['(?:%s)' % pat for pat in patterns]))
+    except re.error:
+        # e.g: global flags (?i) in a full regex can't be combined
+        return AnyMatcher([re.compile(pat) for pat in patterns])
+
+
+class AnyMatcher(object):
+    """ Match a string against a list of regex Objects (OR) """
+    def __init__(self, regex_list):
+        """
+        Entry point for the AnyMatcher class
+
+        :param regex_list: list of regex Objects
+        :return: None
+        """
+        self.regex_list = regex_list
+
+    def match(self, string):
+        """
+        Match the string with the first regex that matches it
+
+        :param string: string to match
+        :return: match Object, None if no regex matches
+        """
+        for regex in self.regex_list:
+            match = regex.match(string)
+            if match is not None:
+                return match
+        return None
 
 
 def clean_directory(directory):
@@ -2825,13 +3254,70 @@ class CachedImageSession(object):
         self.subject = subj
         self.xnat = xnat  # cache for later usage
         self.session = sess
+        self._reset_indexes()
 
     def reload(self):
+        """
+        Download the XML of the session again and reset the indexes
+
+        :return: None
+
+        """
         xpath = E_XPATH.format(project=self.project,
                                subject=self.subject,
                                session=self.session)
         xml_str = self.xnat.select(xpath).get()
         self.sess_element = ET.fromstring(xml_str)
+        self._reset_indexes()
+
+    def _reset_indexes(self):
+        """
+        Drop the cached objects and indexes (built again on first access)
+
+        :return: None
+
+        """
+        self._info = None
+        self._scans = None
+        self._assessors = None
+        self._resources = None
+        self._scan_index = None
+        self._scantype_index = None
+        self._assr_index = None
+        self._proctype_index = None
+
+    def _load_scans(self):
+        """
+        Wrap the scan elements once and index them by ID and type
+
+        :return: None
+
+        """
+        self._scans = []
+        scan_elements = self.sess_element.find('xnat:scans', NS)
+        if scan_elements:
+            for scan in scan_elements:
+                self._scans.append(CachedImageScan(scan, self))
+
+        self._scan_index = index_by(self._scans, lambda c: c.label())
+        self._scantype_index = group_by(self._scans, lambda c: c.get('type'))
+
+    def _load_assessors(self):
+        """
+        Wrap the assessor elements once and index them by label and proctype
+
+        :return: None
+
+        """
+        self._assessors = []
+        assr_elements = self.sess_element.find('xnat:assessors', NS)
+        if assr_elements:
+            for assr in assr_elements:
+                self._assessors.append(CachedImageAssessor(assr, self))
+
+        self._assr_index = index_by(self._assessors, lambda c: c.label())
+        self._proctype_index = group_by(
+            self._assessors, lambda c: c.info().get('proctype'))
 
     def label(self):
         """
@@ -2887,13 +3373,33 @@ class CachedImageSession(object):
         :return: List of CachedImageScan objects for the session.
 
         """
-        scan_list = []
-        scan_elements = self.sess_element.find('xnat:scans', NS)
-        if scan_elements:
-            for scan in scan_elements:
-                scan_list.append(CachedImageScan(scan, self))
+        if self._scans is None:
+            self._load_scans()
+        return list(self._scans)
+
+    def get_scan(self, scan_id):
+        """
+        Get the CachedImageScan object with the scan ID given
+
+        :param scan_id: ID of the scan
+        :return: CachedImageScan object, None if not found
+
+        """
+        if self._scans is None:
+            self._load_scans()
+        return self._scan_index.get(scan_id)
+
+    def get_scans_by_type(self, scantype):
+        """
+        Get the CachedImageScan objects with the scan type given
 
-        return scan_list
+        :param scantype: type of the scans (exact match)
+        :return: List of CachedImageScan objects
+
+        """
+        if self._scans is None:
+            self._load_scans()
+        return list(self._scantype_index.get(scantype, []))
 
     def assessors(self):
         """
@@ -2902,19 +3408,51 @@ class CachedImageSession(object):
         :return: List of CachedImageAssessor objects for the session.
 
         """
-        assr_list = []
+        if self._assessors is None:
+            self._load_assessors()
+        return list(self._assessors)
 
-        assr_elements = self.sess_element.find('xnat:assessors', NS)
-        if assr_elements:
-            for assr in assr_elements:
-                assr_list.append(CachedImageAssessor(assr, self))
+    def get_assessor(self, label):
+        """
+        Get the CachedImageAssessor object with the label given
+
+        :param label: label of the assessor
+        :return: CachedImageAssessor object, None if not found
+
+        """
+        if self._assessors is None:
+            self._load_assessors()
+        return self._assr_index.get(label)
+
+    def get_assessors_by_proctype(self, proctype):
+        """
+        Get the CachedImageAssessor objects with the proctype given
 
-        return assr_list
+        :param proctype: proctype of the assessors
+        :return: List of CachedImageAssessor objects
+
+        """
+        if self._assessors is None:
+            self._load_assessors()
+        return list(self._proctype_index.get(proctype, []))
 
     def info(self):
         """
         Get a dictionary of lots of variables that correspond to the session
 
+        The XML is parsed once per load of the session.
+
+        :return: Dictionary of variables
+
+        """
+        if self._info is None:
+            self._info = self._parse_info()
+        return dict(self._info)
+
+    def _parse_info(self):
+        """
+        Read the variables of the session from the XML
+
         :return: Dictionary of variables
 
         """
@@ -2959,6 +3497,17 @@ class CachedImageSession(object):
 
         return res_list
 
+    def get_resource(self, label):
+        """
+        Get the CachedResource object of the session with the label given
+
+        :param label: label of the resource
+        :return: CachedResource object, None if not found
+        """
+        if self._resources is None:
+            self._resources = index_by(self.resources(), lambda c: c.label())
+        return self._resources.get(label)
+
     def get_resources(self):
         """
         Return a list of dictionaries that correspond to the information
@@ -2982,6 +3531,8 @@ class CachedImageScan(object):
     """
     Class to cache the XML information for a scan on XNAT
     """
+    __slots__ = ('scan_parent', 'scan_element', '_info', '_resources')
+
     def __init__(self, scan_element, parent):
         """
         Entry point for the CachedImageScan class
@@ -2993,6 +3544,8 @@ class CachedImageScan(object):
         """
         self.scan_parent = parent
         self.scan_element = scan_element
+        self._info = None
+        self._resources = None
 
     def parent(self):
         """
@@ -3042,9 +3595,23 @@ class CachedImageScan(object):
         """
         Get lots of variables assocaited with this scan.
 
+        The XML is parsed once, the session reload creates new objects.
+
         :return: Dictionary of infomation about the scan.
 
         """
+        if self._info is None:
+            self._info = self._parse_info()
+        return dict(self._info)
+
+    def _parse_info(self):
+        """
+        Read the variables of the scan from the XML
+
+        :return: Dictionary of infomation about the scan.
+
+        """
+        sess_info = self.parent().info()
         scan_info = {}
 
         scan_info['ID'] = self.get('ID')
@@ -3054,9 +3621,9 @@ class CachedImageScan(object):
         scan_info['note'] = self.get('xnat:note')
         scan_info['type'] = self.get('type')
         scan_info['series_description'] = self.get('xnat:series_description')
-        scan_info['project_id'] = self.parent().project
-        scan_info['subject_id'] = self.parent().get('xnat:subject_ID')
-        scan_info['subject_label'] = self.parent().subject
+        scan_info['project_id'] = sess_info['project_id']
+        scan_info['subject_id'] = sess_info['subject_id']
+        scan_info['subject_label'] = sess_info['subject_label']
 
         scan_info['scan_id'] = scan_info['ID']
         scan_info['scan_label'] = scan_info['label']
@@ -3066,8 +3633,8 @@ class CachedImageScan(object):
         scan_info['scan_frames'] = scan_info['frames']
         scan_info['scan_description'] = scan_info['series_description']
 
-        scan_info['session_id'] = self.parent().get('ID')
-        scan_info['session_label'] = self.parent().get('label')
+        scan_info['session_id'] = sess_info['ID']
+        scan_info['session_label'] = sess_info['label']
         scan_info['project_label'] = scan_info['project_id']
 
         return scan_info
@@ -3098,11 +3665,24 @@ class CachedImageScan(object):
         """
         return [res.info() for res in self.resources()]
 
+    def get_resource(self, label):
+        """
+        Get the CachedResource object of the scan with the label given
+
+        :param label: label of the resource
+        :return: CachedResource object, None if not found
+        """
+        if self._resources is None:
+            self._resources = index_by(self.resources(), lambda c: c.label())
+        return self._resources.get(label)
+
 
 class CachedImageAssessor(object):
     """
     Class to cache the XML information for an assessor on XNAT
     """
+    __slots__ = ('assr_parent', 'assr_element', '_info', '_resources')
+
     def __init__(self, assr_element, parent):
         """
         Entry point for the CachedImageAssessor class on XNAT
@@ -3114,6 +3694,8 @@ class CachedImageAssessor(object):
         """
         self.assr_parent = parent
         self.assr_element = assr_element
+        self._info = None
+        self._resources = None
 
     def parent(self):
         """
@@ -3171,9 +3753,23 @@ class CachedImageAssessor(object):
         """
         Get a dictionary of information associated with the assessor
 
-        :return: None
+        The XML is parsed once, the session reload creates new objects.
 
+        :return: Dictionary of information about the assessor
+
+        """
+        if self._info is None:
+            self._info = self._parse_info()
+        return dict(self._info)
+
+    def _parse_info(self):
         """
+        Read the information of the assessor from the XML
+
+        :return: Dictionary of information about the assessor
+
+        """
+        sess_info = self.parent().info()
         assr_info = {}
 
         assr_info['ID'] = self.get('ID')
@@ -3182,10 +3778,10 @@ class CachedImageAssessor(object):
         assr_info['assessor_label'] = assr_info['label']
         assr_info['project_id'] = self.get('project')
         assr_info['project_label'] = assr_info['project_id']
-        assr_info['subject_id'] = self.parent().get('xnat:subject_ID')
-        assr_info['subject_label'] = self.parent().subject
-        assr_info['session_id'] = self.parent().get('ID')
-        assr_info['session_label'] = self.parent().get('label')
+        assr_info['subject_id'] = sess_info['subject_id']
+        assr_info['subject_label'] = sess_info['subject_label']
+        assr_info['session_id'] = sess_info['ID']
+        assr_info['session_label'] = sess_info['label']
         xmltype = '{http://www.w3.org/2001/XMLSchema-instance}type'
         assr_info['xsiType'] = self.get(xmltype).lower()
 
@@ -3282,11 +3878,26 @@ class CachedImageAssessor(object):
         """
         return self.get_out_resources()
 
+    def get_resource(self, label):
+        """
+        Get the CachedResource object for "out" type with the label given
+
+        :param label: label of the resource
+        :return: CachedResource object, None if not found
+
+        """
+        if self._resources is None:
+            self._resources = index_by(self.out_resources(),
+                                       lambda c: c.label())
+        return self._resources.get(label)
+
 
 class CachedResource(object):
     """
     Class to cache resource XML info on XNAT
     """
+    __slots__ = ('res_parent', 'res_element', '_info')
+
     def __init__(self, element, parent):
         """
         Entry point for the CachgedResource class
@@ -3297,6 +3908,7 @@ class CachedResource(object):
         """
         self.res_parent = parent
         self.res_element = element
+        self._info = None
 
     def parent(self):
         """
@@ -3347,6 +3959,16 @@ class CachedResource(object):
         """
         Get a dictionary of information relating to the resource
 
+        :returns: dictionary of information about the resource.
+        """
+        if self._info is None:
+            self._info = self._parse_info()
+        return dict(self._info)
+
+    def _parse_info(self):
+        """
+        Read the information of the resource from the XML
+
         :returns: dictionary of information about the resource.
         """
         res_info = {}
@@ -3361,6 +3983,34 @@ class CachedResource(object):
         return res_info
 
 
+def index_by(cobj_list, key_func):
+    """
+    Index cached objects by a key, keeping the first object for each key
+
+    :param cobj_list: list of Cached objects
+    :param key_func: function returning the key of an object
+    :return: dictionary key: Cached object
+    """
+    index = dict()
+    for cobj in cobj_list:
+        index.setdefault(key_func(cobj), cobj)
+    return index
+
+
+def group_by(cobj_list, key_func):
+    """
+    Group cached objects by a key, keeping the order of the list
+
+    :param cobj_list: list of Cached objects
+    :param key_func: function returning the key of an object
+    :return: dictionary key: list of Cached objects
+    """
+    groups = dict()
+    for cobj in cobj_list:
+        groups.setdefault(key_func(cobj), list()).append(cobj)
+    return groups
+
+
 # File Utils
 def gzip_file(file_not_zipped):
     """
@@ -59,7 +59,9 @@ python file describing the Launcher object or a YAML file.')
 
 
 def launch_jobs(settings_path, logfile, debug, projects=None, sessions=None,
-                writeonly=False, pbsdir=None, force_no_qsub=False):
+                writeonly=False, pbsdir=None, force_no_qsub=False,
+                array=False, workers=1, watch=False, watch_poll=False,
+                watch_interval=5):
     """
     Method to launch jobs on the grid
 
@@ -71,6 +73,12 @@ def launch_jobs(settings_path, logfile, debug, projects=None, sessions=None,
     :param writeonly:  write the job files without submitting them
     :param pbsdir: folder to store the pbs file
     :param force_no_qsub: run the job locally on the computer (serial mode)
+    :param array: launch the tasks as job arrays
+    :param workers: number of jobs submitted at the same time
+    :param watch: keep running and launch the DiskQ tasks as soon as they
+     are written
+    :param watch_poll: poll the DiskQ folders instead of using inotify
+    :param watch_interval: seconds between two checks when polling
     :return: None
 
     """
@@ -80,9 +88,16 @@ def launch_jobs(settings_path, logfile, debug, projects=None, sessions=None,
     _launcher_obj = read_settings(settings_path, logger, exe='launch_jobs')
     lockfile_prefix = os.path.splitext(os.path.basename(settings_path))[0]
     try:
-        _launcher_obj.launch_jobs(lockfile_prefix, projects, sessions,
-                                  writeonly, pbsdir,
-                                  force_no_qsub=force_no_qsub)
+        if watch:
+            _launcher_obj.watch_jobs(lockfile_prefix, projects,
+                                     force_no_qsub=force_no_qsub,
+                                     workers=workers, poll=watch_poll,
+                                     interval=watch_interval)
+        else:
+            _launcher_obj.launch_jobs(lockfile_prefix, projects, sessions,
+                                      writeonly, pbsdir,
+                                      force_no_qsub=force_no_qsub,
+                                      array=array, workers=workers)
     except KeyboardInterrupt:
         logger.warn('Killed by user.')
         flagfile = os.path.join(os.path.join(
@@ -102,7 +117,7 @@ def launch_jobs(settings_path, logfile, debug, projects=None, sessions=None,
 
 
 def build(settings_path, logfile, debug, projects=None, sessions=None,
-          mod_delta=None, proj_lastrun=None):
+          mod_delta=None, proj_lastrun=None, workers=1, plan=False):
     """
     Method that is responsible for running all modules and putting assessors
      into the database
@@ -112,6 +127,8 @@ def build(settings_path, logfile, debug, projects=None, sessions=None,
     :param debug: Should debug mode be used
     :param projects: Project(s) that need to be built
     :param sessions: Session(s) that need to be built
+    :param workers: number of sessions to build at the same time
+    :param plan: only build the sessions selected by the build planner
     :return: None
 
     """
@@ -122,7 +139,8 @@ def build(settings_path, logfile, debug, projects=None, sessions=None,
     lockfile_prefix = os.path.splitext(os.path.basename(settings_path))[0]
     try:
         _launcher_obj.build(lockfile_prefix, projects, sessions,
-                            mod_delta=mod_delta, proj_lastrun=proj_lastrun)
+                            mod_delta=mod_delta, proj_lastrun=proj_lastrun,
+                            workers=workers, plan=plan)
     except KeyboardInterrupt:
         logger.warn('Killed by user.')
         flagfile = os.path.join(os.path.join(
@@ -0,0 +1,310 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" build_planner.py
+
+Plan the build of a project from the project-wide XNAT listings.
+
+The inputs of the YAML processors (AutoProcessor) are resolved for every
+session at once from the scans and assessors listings of the project
+(columns type/quality/proctype/qcstatus/resources) with NumPy group-bys.
+The status given by AutoProcessor.has_inputs is predicted for each
+assessor. Only the sessions where an assessor needs to be created or where
+its status changes need their XML downloaded by the build.
+
+The listings do not have the number of files of a resource: a resource is
+considered present if its label is listed. A session predicted ready is
+always built, so the per-session check of build_session has the last word.
+"""
+
+from builtins import object
+from builtins import range
+from builtins import zip
+
+import logging
+import numpy as np
+
+from . import XnatUtils
+from . import processors
+from .dax_settings import DEFAULT_FS_DATATYPE
+from .task import NEED_INPUTS, NEED_TO_RUN, RERUN, REPROC
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['BuildPlanner']
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Launcher types with the tasks built on disk
+DISKQ_LAUNCHERS = ['diskq-xnat', 'diskq-combined']
+
+
+class BuildPlanner(object):
+    """ Predict the assessor status of the YAML processors for a project """
+    def __init__(self, project_id, session_list, scan_list, assessor_list):
+        """
+        Entry point for the BuildPlanner class
+
+        :param project_id: project ID on XNAT
+        :param session_list: sessions to plan (XnatUtils.list_sessions)
+        :param scan_list: scans of the project (list_project_scans)
+        :param assessor_list: assessors of the project
+                              (list_project_assessors)
+        :return: None
+        """
+        self.project_id = project_id
+        self.sessions = session_list
+        sess_idx = dict((sess['session_id'], ind)
+                        for ind, sess in enumerate(session_list))
+        self.nb_sess = len(session_list)
+        self.sess_subj = get_column(session_list, 'subject_label')
+        self.sess_label = get_column(session_list, 'label')
+
+        # Only keep the rows of the sessions to plan
+        scan_list = [scan for scan in scan_list
+                     if scan['session_id'] in sess_idx]
+        assessor_list = [assr for assr in assessor_list
+                         if assr['session_id'] in sess_idx]
+
+        self.scans = {
+            'sess': np.array([sess_idx[scan['session_id']]
+                              for scan in scan_list], dtype=int),
+            'ID': get_column(scan_list, 'scan_id'),
+            'type': get_column(scan_list, 'scan_type'),
+            'usable': get_column(scan_list, 'scan_quality') != 'unusable',
+            'ready': np.ones(len(scan_list), dtype=bool),
+            'resources': [set(scan['resources']) for scan in scan_list]}
+
+        xsitypes = np.array([assr['xsiType'].lower()
+                             for assr in assessor_list], dtype=object)
+        qcstatus = get_column(assessor_list, 'qcstatus')
+        procstatus = get_column(assessor_list, 'procstatus')
+        self.assessors = {
+            'sess': np.array([sess_idx[assr['session_id']]
+                              for assr in assessor_list], dtype=int),
+            # Same proctype as CachedImageAssessor.info() for FreeSurfer
+            'type': np.where(xsitypes == DEFAULT_FS_DATATYPE.lower(),
+                             'FreeSurfer',
+                             get_column(assessor_list, 'proctype')),
+            'usable': vectorize(XnatUtils.is_bad_qa, qcstatus) == 1,
+            # Skipped by get_good_cassr whatever needs_qc
+            'ready': procstatus != NEED_INPUTS,
+            'resources': [set(assr['resources']) for assr in assessor_list]}
+        self.assr_status = dict(
+            (assr['label'], (assr['procstatus'] or '', assr['qcstatus'] or ''))
+            for assr in assessor_list)
+
+    def sessions_to_build(self, proc_list, launcher_type='xnatq-combined'):
+        """
+        Get the sessions where the processors change something on XNAT
+
+        :param proc_list: list of processors for the project
+        :param launcher_type: type of launcher (see launcher.py)
+        :return: set of session IDs, None if a processor can not be planned
+                 (every session needs to be built)
+        """
+        session_ids = set()
+        for proc in proc_list:
+            if not isinstance(proc, processors.AutoProcessor):
+                LOGGER.debug('build plan: %s is not a YAML processor'
+                             % proc.name)
+                return None
+
+            for label, sess, status, qcstatus in self.plan_processor(proc):
+                if self.needs_build(proc, label, status, qcstatus,
+                                    launcher_type):
+                    session_ids.add(self.sessions[sess]['session_id'])
+        return session_ids
+
+    def needs_build(self, proc, label, status, qcstatus, launcher_type):
+        """
+        Check if build_session would create or change the assessor
+
+        Mirrors the conditions of Launcher.build_session_processors and
+         Launcher.build_scan_processors.
+
+        :param proc: AutoProcessor object
+        :param label: label of the assessor
+        :param status: predicted has_inputs status (-1, 0 or 1)
+        :param qcstatus: predicted qcstatus for the status
+        :param launcher_type: type of launcher (see launcher.py)
+        :return: True if the session needs to be built
+        """
+        if label not in self.assr_status:
+            return True
+        cur_procstatus, cur_qcstatus = self.assr_status[label]
+        if launcher_type in DISKQ_LAUNCHERS:
+            if cur_qcstatus in [RERUN, REPROC]:
+                return True
+            if proc.type == 'scan' and cur_procstatus == NEED_TO_RUN:
+                return True
+        if cur_procstatus != NEED_INPUTS:
+            return False
+        # Still missing inputs: only the qcstatus is set again
+        return status != 0 or qcstatus != cur_qcstatus
+
+    def plan_processor(self, proc):
+        """
+        Predict AutoProcessor.has_inputs for every assessor of a processor
+
+        :param proc: AutoProcessor object
+        :return: list of (assessor label, session index, status, qcstatus)
+        """
+        status, qcstatus = self.sessions_status(proc)
+        plan = list()
+        if proc.type == 'scan':
+            scans = self.scans
+            matcher = XnatUtils.get_matcher(
+                proc.scaninfo.get('types', '').split(','), proc.full_regex)
+            rows = np.flatnonzero(match_column(scans['type'], matcher))
+            row_status = status[scans['sess'][rows]]
+            row_qc = qcstatus[scans['sess'][rows]]
+            # The checks on the scan itself come first
+            for res_dict in reversed(proc.scaninfo.get('resources', list())):
+                resource = res_dict.get('resource')
+                missing = ~has_resource(scans['resources'], resource)[rows]
+                row_status[missing] = 0
+                row_qc[missing] = 'No {}'.format(resource)
+            unusable = ~scans['usable'][rows]
+            row_status[unusable] = -1
+            row_qc[unusable] = 'Scan unusable'
+
+            for ind, row in enumerate(rows):
+                sess = scans['sess'][row]
+                label = '-x-'.join([self.project_id, self.sess_subj[sess],
+                                    self.sess_label[sess], scans['ID'][row],
+                                    proc.proctype])
+                plan.append((label, sess, row_status[ind], row_qc[ind]))
+        else:
+            for sess in range(self.nb_sess):
+                label = '-x-'.join([self.project_id, self.sess_subj[sess],
+                                    self.sess_label[sess], proc.proctype])
+                plan.append((label, sess, status[sess], qcstatus[sess]))
+        return plan
+
+    def sessions_status(self, proc):
+        """
+        Resolve the xnat inputs of a processor for all the sessions
+
+        :param proc: AutoProcessor object
+        :return: status array and qcstatus array (one value per session)
+        """
+        status = np.ones(self.nb_sess, dtype=int)
+        qcstatus = np.empty(self.nb_sess, dtype=object)
+        inputs = list()
+        for scan_in in proc.xnat_inputs.get('scans', list()):
+            if proc.scan_nb not in list(scan_in.keys()):
+                inputs.append(('scan', scan_in.get('types'), scan_in))
+        for assr_in in proc.xnat_inputs.get('assessors', list()):
+            inputs.append(('assessor', assr_in.get('proctypes'), assr_in))
+
+        # has_inputs stops at the first input not ready
+        for otype, sp_types, doc in inputs:
+            resources = [_doc.get('resource')
+                         for _doc in doc.get('resources', list())
+                         if _doc.get('required', True)]
+            in_status, in_qc = self.input_status(
+                otype, sp_types.split(','), doc.get('nargs', False),
+                resources, doc.get('needs_qc', True), proc.full_regex)
+            update = (status == 1) & (in_status != 1)
+            status[update] = in_status[update]
+            qcstatus[update] = in_qc[update]
+        return status, qcstatus
+
+    def input_status(self, otype, sp_types, nargs, resources, needs_qc,
+                     full_regex):
+        """
+        Resolve one xnat input (see AutoProcessor._check_xnat_cobj)
+
+        :param otype: 'scan' or 'assessor'
+        :param sp_types: list of scan types or proctypes to look for
+        :param nargs: allow more than one object of this type
+        :param resources: resources required on the objects
+        :param needs_qc: only use objects with a good qc
+        :param full_regex: sp_types are full regex
+        :return: status array and qcstatus array (one value per session)
+        """
+        table = self.scans if otype == 'scan' else self.assessors
+        types_str = ','.join(sp_types)
+        matcher = XnatUtils.get_matcher(sp_types, full_regex)
+        good = match_column(table['type'], matcher) & table['ready']
+        if needs_qc:
+            good &= table['usable']
+        counts = np.bincount(table['sess'][good], minlength=self.nb_sess)
+
+        status = np.ones(self.nb_sess, dtype=int)
+        qcstatus = np.empty(self.nb_sess, dtype=object)
+
+        # Missing resources on the good objects (first one in the listing)
+        missing = np.zeros(len(good), dtype=bool)
+        for resource in resources:
+            missing |= ~has_resource(table['resources'], resource)
+        missing &= good
+        sess_missing, first_rows = np.unique(table['sess'][missing],
+                                             return_index=True)
+        rows = np.flatnonzero(missing)[first_rows]
+        status[sess_missing] = 0
+        for sess, row in zip(sess_missing, rows):
+            res = [res for res in resources
+                   if res not in table['resources'][row]][0]
+            qcstatus[sess] = 'Missing {} on {}'.format(res, table['type'][row])
+
+        if not nargs:
+            too_many = counts > 1
+            status[too_many] = 0
+            qcstatus[too_many] = 'Too many {} found'.format(types_str)
+
+        no_obj = counts == 0
+        status[no_obj] = -1 if otype == 'scan' else 0
+        qcstatus[no_obj] = 'No {} found'.format(types_str)
+        return status, qcstatus
+
+
+def get_column(obj_list, key):
+    """
+    Get a column of a listing as a NumPy array of strings
+
+    :param obj_list: list of dictionaries
+    :param key: key of the column
+    :return: NumPy array ('' for missing values)
+    """
+    return np.array([obj.get(key) or '' for obj in obj_list], dtype=object)
+
+
+def vectorize(func, column):
+    """
+    Apply a function once per unique value of a column
+
+    :param func: function taking a value of the column
+    :param column: NumPy array of strings
+    :return: NumPy array of the results
+    """
+    if len(column) == 0:
+        return np.array([])
+    uniq, inverse = np.unique(column.astype(str), return_inverse=True)
+    return np.array([func(value) for value in uniq])[inverse]
+
+
+def match_column(column, matcher):
+    """
+    Match a column with a type matcher (see XnatUtils.get_matcher)
+
+    :param column: NumPy array of strings
+    :param matcher: compiled matcher
+    :return: NumPy boolean array
+    """
+    if len(column) == 0:
+        return np.zeros(0, dtype=bool)
+    return vectorize(lambda value: matcher.match(value) is not None,
+                     column).astype(bool)
+
+
+def has_resource(resources_column, resource):
+    """
+    Check the presence of a resource label on each row
+
+    :param resources_column: list of sets of resource labels
+    :param resource: label of the resource
+    :return: NumPy boolean array
+    """
+    return np.array([resource in res for res in resources_column],
+                    dtype=bool)
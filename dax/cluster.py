@@ -8,11 +8,14 @@ Cluster functionality
 
 from builtins import str
 from builtins import object
+from builtins import range
 
 import os
+import re
 import time
 import logging
 import subprocess as sb
+import threading
 from datetime import datetime
 
 from .dax_settings import DAX_Settings
@@ -22,8 +25,17 @@ from .errors import ClusterError
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 DAX_SETTINGS = DAX_Settings()
 MAX_TRACE_DAYS = 30
+COUNT_JOBS_TRIES = 6
+COUNT_JOBS_MAX_DELAY = 60
+# Pending elements of a job array: 1234_[3-5,8%2]
+ARRAY_JOBID_RE = re.compile(r'^(\d+)_\[([0-9,%-]+)\]$')
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
+# Status of all the jobs in the queue (see get_jobs_status)
+_JOBS_SNAPSHOT = {'time': None, 'jobs': None}
+_JOBS_SNAPSHOT_LOCK = threading.Lock()
+_JOBS_USAGE = dict()
+_JOBS_USAGE_LOCK = threading.Lock()
 
 
 def c_output(output):
@@ -42,25 +54,35 @@ def c_output(output):
     return error
 
 
-def count_jobs():
+def count_jobs(max_tries=COUNT_JOBS_TRIES):
     """
     Count the number of jobs in the queue on the cluster
 
-    :return: number of jobs in the queue
+    The command is tried again with an exponential backoff (2s, 4s, 8s...
+     up to COUNT_JOBS_MAX_DELAY) if its output is not a number.
+
+    :param max_tries: number of times the command is run before giving up
+    :return: number of jobs in the queue, -1 if the count failed
     """
     if command_found(cmd=DAX_SETTINGS.get_cmd_submit()):
         cmd = DAX_SETTINGS.get_cmd_count_nb_jobs()
-        output = sb.check_output(cmd, shell=True)
-        error = c_output(output)
-        while error:
-            LOGGER.info('    try again to access number of jobs in 2 seconds.')
-            time.sleep(2)
-            output = sb.check_output(cmd, shell=True)
-            error = c_output(output)
-        if int(output) < 0:
-            return 0
-        else:
-            return int(output)
+        delay = 2
+        for nb_try in range(max_tries):
+            if nb_try > 0:
+                LOGGER.info('    try again to access number of jobs in %s \
+seconds.' % str(delay))
+                time.sleep(delay)
+                delay = min(delay * 2, COUNT_JOBS_MAX_DELAY)
+            try:
+                output = sb.check_output(cmd, shell=True)
+            except sb.CalledProcessError as err:
+                LOGGER.error(err)
+                continue
+            if not c_output(output):
+                return max(int(output), 0)
+        LOGGER.error('failed to count the jobs after %s tries'
+                     % str(max_tries))
+        return -1
     else:
         LOGGER.info(' Running locally. No queue with jobs.')
         return 0
@@ -70,6 +92,24 @@ def job_status(jobid):
     """
     Get the status for a job on the cluster
 
+    The status comes from the snapshot of the queue if cmd_list_jobs_status
+     is set. A job missing from the snapshot is checked on its own since it
+     may have been submitted after the snapshot.
+
+    :param jobid: job id to check
+    :return: job status
+
+    """
+    jobs = get_jobs_status()
+    if jobs is not None and str(jobid).strip() in jobs:
+        return jobs[str(jobid).strip()]
+    return single_job_status(jobid)
+
+
+def single_job_status(jobid):
+    """
+    Get the status for a job on the cluster with cmd_get_job_status
+
     :param jobid: job id to check
     :return: job status
 
@@ -91,6 +131,97 @@ def job_status(jobid):
         return None
 
 
+def get_jobs_status(force=False, since=None):
+    """
+    Get the status of all the jobs in the queue from one command
+
+    The output of cmd_list_jobs_status (one line "jobid status" per job)
+     is kept for job_status_ttl seconds and shared by all the tasks.
+
+    :param force: run the command even if the snapshot is recent
+    :param since: run the command if the snapshot is older than this time
+     (seconds since the epoch)
+    :return: dictionary jobid: status ('R', 'Q', 'C' or None),
+             None if cmd_list_jobs_status is not set or failed
+    """
+    cmd = DAX_SETTINGS.get_cmd_list_jobs_status()
+    if not cmd:
+        return None
+
+    with _JOBS_SNAPSHOT_LOCK:
+        now = time.time()
+        snap_time = _JOBS_SNAPSHOT['time']
+        if not force and snap_time is not None and \
+           now - snap_time < DAX_SETTINGS.get_job_status_ttl() and \
+           (since is None or snap_time >= since):
+            return _JOBS_SNAPSHOT['jobs']
+
+        try:
+            output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+        except sb.CalledProcessError as err:
+            LOGGER.warn('failed to list the jobs status: %s' % str(err))
+            _JOBS_SNAPSHOT['time'] = None
+            _JOBS_SNAPSHOT['jobs'] = None
+            return None
+
+        _JOBS_SNAPSHOT['time'] = now
+        _JOBS_SNAPSHOT['jobs'] = parse_jobs_status(output)
+        LOGGER.debug('jobs status: %s jobs in the queue'
+                     % str(len(_JOBS_SNAPSHOT['jobs'])))
+        return _JOBS_SNAPSHOT['jobs']
+
+
+def parse_jobs_status(output):
+    """
+    Parse the output of cmd_list_jobs_status
+
+    :param output: output of the command (one line "jobid status" per job)
+    :return: dictionary jobid: status ('R', 'Q', 'C' or None)
+    """
+    status_map = {DAX_SETTINGS.get_running_status(): 'R',
+                  DAX_SETTINGS.get_queue_status(): 'Q',
+                  DAX_SETTINGS.get_complete_status(): 'C'}
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+
+    jobs = dict()
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields:
+            continue
+        state = fields[1] if len(fields) > 1 else None
+        for jobid in expand_array_jobid(fields[0]):
+            jobs[jobid] = status_map.get(state)
+    return jobs
+
+
+def expand_array_jobid(jobid):
+    """
+    Expand the pending elements of a job array listed on one line
+
+    SLURM lists the pending elements of a job array as 1234_[3-5,8%2].
+
+    :param jobid: job id from the listing
+    :return: list of job ids (see array_jobid)
+    """
+    match = ARRAY_JOBID_RE.match(jobid)
+    if not match:
+        return [jobid]
+
+    array_jobid = DAX_SETTINGS.get_array_jobid()
+    jobids = list()
+    for index_range in match.group(2).split('%')[0].split(','):
+        bounds = index_range.split('-')
+        try:
+            first, last = int(bounds[0]), int(bounds[-1])
+        except ValueError:
+            continue
+        for index in range(first, last + 1):
+            jobids.append(array_jobid.safe_substitute(
+                {'jobid': match.group(1), 'index': str(index)}))
+    return jobids
+
+
 def is_traceable_date(jobdate):
     """
     Check if the job is traceable on the cluster
@@ -114,6 +245,11 @@ def tracejob_info(jobid, jobdate):
     :param jobdate: launching date of the job
     :return: dictionary object with 'mem_used', 'walltime_used', 'jobnode'
     """
+    with _JOBS_USAGE_LOCK:
+        jobinfo = _JOBS_USAGE.pop(str(jobid).strip(), None)
+    if jobinfo is not None:
+        return jobinfo
+
     time_s = datetime.strptime(jobdate, "%Y-%m-%d")
     diff_days = (datetime.today() - time_s).days + 1
     jobinfo = dict()
@@ -124,6 +260,77 @@ def tracejob_info(jobid, jobdate):
     return jobinfo
 
 
+def prefetch_jobs_usage(jobs):
+    """
+    Get the usage of many finished jobs from one accounting query
+
+    cmd_get_jobs_usage is run once for all the jobs and the usage is kept
+     until tracejob_info asks for it. Jobs missing from the output are
+     traced one by one by tracejob_info.
+
+    :param jobs: list of (jobid, launching date of the job)
+    :return: number of jobs found in the output
+    """
+    cmd = DAX_SETTINGS.get_cmd_get_jobs_usage()
+    if not cmd:
+        return 0
+
+    jobids = list()
+    diff_days = 1
+    for jobid, jobdate in jobs:
+        jobid = str(jobid or '').strip()
+        if not jobid or jobid == '0' or not jobdate or \
+           not is_traceable_date(jobdate):
+            continue
+        time_s = datetime.strptime(jobdate, "%Y-%m-%d")
+        diff_days = max(diff_days, (datetime.today() - time_s).days + 1)
+        jobids.append(jobid)
+
+    if not jobids:
+        return 0
+
+    cmd = cmd.safe_substitute({'numberofdays': diff_days,
+                               'jobids': ','.join(jobids)})
+    try:
+        output = sb.check_output(cmd, stderr=sb.STDOUT, shell=True)
+    except sb.CalledProcessError as err:
+        LOGGER.warn('failed to get the usage of the jobs: %s' % str(err))
+        return 0
+
+    usage = parse_jobs_usage(output)
+    with _JOBS_USAGE_LOCK:
+        for jobid in jobids:
+            if jobid in usage:
+                _JOBS_USAGE[jobid] = usage[jobid]
+    LOGGER.debug('jobs usage: %s/%s jobs found'
+                 % (str(len(usage)), str(len(jobids))))
+    return len([jobid for jobid in jobids if jobid in usage])
+
+
+def parse_jobs_usage(output):
+    """
+    Parse the output of cmd_get_jobs_usage
+
+    :param output: output of the command (one line
+                   "jobid mem_used walltime_used jobnode" per job)
+    :return: dictionary jobid: dictionary with 'mem_used', 'walltime_used',
+             'jobnode' (same as tracejob_info)
+    """
+    if isinstance(output, bytes):
+        output = output.decode('utf-8', 'replace')
+
+    usage = dict()
+    for line in output.splitlines():
+        fields = line.split()
+        if not fields or fields[0].startswith('sacct:'):
+            continue
+        fields += [''] * (4 - len(fields))
+        usage[fields[0]] = {'mem_used': fields[1],
+                            'walltime_used': fields[2],
+                            'jobnode': fields[3]}
+    return usage
+
+
 def get_job_mem_used(jobid, diff_days):
     """
     Get the memory used for the task from cluster
@@ -295,6 +502,10 @@ class PBS(object):   # The script file generator class
         job_dir = os.path.dirname(self.filename)
         if not os.path.exists(job_dir):
             os.makedirs(job_dir)
+        # outlog dir (not created by the scheduler)
+        outlog_dir = os.path.dirname(self.outfile)
+        if outlog_dir and not os.path.exists(outlog_dir):
+            os.makedirs(outlog_dir)
         # Write the Bedpost script (default value)
         job_data = {'job_email': self.email,
                     'job_email_options': self.email_options,
@@ -311,25 +522,117 @@ class PBS(object):   # The script file generator class
             f_obj.write(DAX_SETTINGS.get_job_template()
                                     .safe_substitute(job_data))
 
-    def submit(self, outlog=None, force_no_qsub=False):
+    def submit(self, outlog=None, force_no_qsub=False, depends=None):
         """
         Submit the file to the cluster
 
+        :param depends: job ids that must succeed before the job starts
         :return: None
         """
         return submit_job(self.filename, outlog=outlog,
-                          force_no_qsub=force_no_qsub)
+                          force_no_qsub=force_no_qsub, depends=depends)
 
 
-def submit_job(filename, outlog=None, force_no_qsub=False):
+class PBSArray(object):
+    """ PBSArray class to generate/submit a job array running PBS files """
+    def __init__(self, filename, outfile, scripts, walltime_str, mem_mb=2048,
+                 ppn=1, email=None, email_options=DAX_SETTINGS.get_email_opts(),
+                 xnat_host=None):
+        """
+        Entry point for the PBSArray class
+
+        :param filename: filename for the script of the job array
+        :param outfile: filepath for the outlogs of the job array
+        :param scripts: list of (PBS file, outlog) run by the job array,
+                        one per index (starting at 1)
+        :param walltime_str: walltime to set for each job of the array
+        :param mem_mb: memory in mb to set for each job of the array
+        :param ppn: number of processor to set for each job of the array
+        :param email: email address to set for the script
+        :param email_options: email options to set for the script
+        :param xnat_host: set the XNAT_HOST for the job (export)
+        :return: None
+        """
+        self.filename = filename
+        self.outfile = outfile
+        self.table = '%s.table' % os.path.splitext(filename)[0]
+        self.scripts = scripts
+        self.walltime_str = walltime_str
+        self.mem_mb = mem_mb
+        self.ppn = ppn
+        self.email = email
+        self.email_options = email_options
+        if xnat_host:
+            self.xnat_host = xnat_host
+        else:
+            self.xnat_host = os.environ['XNAT_HOST']
+
+    def write(self):
+        """
+        Write the command table and the file of the job array
+
+        :return: None
+        """
+        job_dir = os.path.dirname(self.filename)
+        if not os.path.exists(job_dir):
+            os.makedirs(job_dir)
+        with open(self.table, 'w') as f_obj:
+            for script, outlog in self.scripts:
+                f_obj.write('%s %s\n' % (script, outlog))
+
+        job_data = {'job_email': self.email,
+                    'job_email_options': self.email_options,
+                    'job_ppn': str(self.ppn),
+                    'job_walltime': str(self.walltime_str),
+                    'job_memory': str(self.mem_mb),
+                    'job_output_file': self.outfile,
+                    'job_output_file_options': 'oe',
+                    'job_array_size': str(len(self.scripts)),
+                    'job_array_table': self.table,
+                    'xnat_host': self.xnat_host}
+
+        with open(self.filename, 'w') as f_obj:
+            f_obj.write(DAX_SETTINGS.get_job_array_template()
+                                    .safe_substitute(job_data))
+
+    def submit(self):
+        """
+        Submit the job array to the cluster
+
+        :return: list of the job ids of the array elements (same order as
+                 the scripts), empty list if the submission failed
+        """
+        jobid, _ = submit_job(self.filename)
+        # PBS/MOAB print the id of a job array as 1234[]
+        jobid = jobid.strip().replace('[]', '')
+        if jobid == '' or jobid == '0':
+            return list()
+        array_jobid = DAX_SETTINGS.get_array_jobid()
+        return [array_jobid.safe_substitute({'jobid': jobid,
+                                             'index': str(index)})
+                for index in range(1, len(self.scripts) + 1)]
+
+
+def submit_job(filename, outlog=None, force_no_qsub=False, depends=None):
     """
     Submit the file to the cluster
+
+    :param depends: job ids that must succeed before the job starts
+     (see job_depend_option in the cluster settings)
     :return: jobid and error if the job failed when running locally
     """
     failed = False
     submit_cmd = DAX_SETTINGS.get_cmd_submit()
     if command_found(cmd=submit_cmd) and not force_no_qsub:
         try:
+            if depends:
+                depend_option = DAX_SETTINGS.get_job_depend_option()
+                if not depend_option:
+                    raise ClusterError('job_depend_option not set in the \
+cluster settings, cannot submit %s after %s' % (filename, ','.join(depends)))
+                submit_cmd = '%s %s' % (submit_cmd,
+                                        depend_option.safe_substitute(
+                                            {'jobids': ':'.join(depends)}))
             cmd = '%s %s' % (submit_cmd, filename)
             proc = sb.Popen(cmd.split(), stdout=sb.PIPE, stderr=sb.PIPE)
             output, error = proc.communicate()
@@ -366,6 +366,20 @@ class DAX_Settings(object):
         else:
             return []
 
+    def get_project_index(self):
+        """Get the project_index value from the admin section.
+
+        Path to the SQLite file caching the XNAT listings of the projects.
+
+        :return: String of the project_index path, None if empty
+        """
+        if not self.config_parser.has_option('admin', 'project_index'):
+            return None
+        project_index = self.get('admin', 'project_index')
+        if project_index:
+            return os.path.expanduser(project_index)
+        return None
+
     # Begin cluster section
     def get_cmd_submit(self):
         """Get the cmd_submit value from the cluster section.
@@ -425,6 +439,41 @@ class DAX_Settings(object):
             return ''
         return self.read_file_and_return_template(filepath)
 
+    def get_cmd_list_jobs_status(self):
+        """Get the cmd_list_jobs_status value from the cluster section.
+
+        Command printing one line "jobid status" for each job of the user
+         in the queue. Used to get the status of all the jobs at once.
+
+        :return: String of the command, '' if not set
+        """
+        if not self.config_parser.has_option('cluster',
+                                             'cmd_list_jobs_status'):
+            return ''
+        filepath = self.get('cluster', 'cmd_list_jobs_status')
+        if filepath is None:
+            return ''
+        if filepath.startswith('~/'):
+            filepath = os.path.join(self.get_user_home(), filepath)
+        if not os.path.isfile(filepath):
+            return ''
+        return self.read_file_and_return_string(filepath)
+
+    def get_job_status_ttl(self):
+        """Get the job_status_ttl value from the cluster section.
+
+        Number of seconds the status of all the jobs is kept before running
+         cmd_list_jobs_status again.
+
+        :return: Integer of the job_status_ttl value (60 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'job_status_ttl'):
+            return 60
+        ttl = self.get('cluster', 'job_status_ttl')
+        if ttl is None:
+            return 60
+        return int(ttl)
+
     def get_queue_status(self):
         """Get the queue_status value from the cluster section.
 
@@ -500,6 +549,27 @@ class DAX_Settings(object):
             return ''
         return self.read_file_and_return_template(filepath)
 
+    def get_cmd_get_jobs_usage(self):
+        """Get the cmd_get_jobs_usage value from the cluster section.
+
+        Command printing one line "jobid mem_used walltime_used jobnode" for
+         each job of ${jobids} (comma separated). Used to get the usage of
+         all the finished jobs at once.
+
+        :return: Template class of the file containing the command,
+                 '' if not set
+        """
+        if not self.config_parser.has_option('cluster', 'cmd_get_jobs_usage'):
+            return ''
+        filepath = self.get('cluster', 'cmd_get_jobs_usage')
+        if filepath is None:
+            return ''
+        if filepath.startswith('~/'):
+            filepath = os.path.join(self.get_user_home(), filepath)
+        if not os.path.isfile(filepath):
+            return ''
+        return self.read_file_and_return_template(filepath)
+
     def get_job_extension_file(self):
         """Get the job_extension_file value from the cluster section.
 
@@ -525,6 +595,69 @@ class DAX_Settings(object):
             return ''
         return self.read_file_and_return_template(filepath)
 
+    def get_job_array_template(self):
+        """Get the job_array_template value from the cluster section.
+
+        Template of the file of a job array. ${job_array_size} is the
+         number of jobs in the array and ${job_array_table} the file with
+         one line "pbs_file outlog" per index of the array (starting at 1).
+
+        :return: Template class of the file, '' if not set (no job array)
+        """
+        if not self.config_parser.has_option('cluster', 'job_array_template'):
+            return ''
+        filepath = self.get('cluster', 'job_array_template')
+        if filepath is None:
+            return ''
+        if filepath.startswith('~/'):
+            filepath = os.path.join(self.get_user_home(), filepath)
+        if not os.path.isfile(filepath):
+            return ''
+        return self.read_file_and_return_template(filepath)
+
+    def get_array_jobid(self):
+        """Get the array_jobid value from the cluster section.
+
+        Format of the job id of an element of a job array from ${jobid}
+         (id of the array) and ${index}.
+
+        :return: Template class of the array_jobid value
+                 (${jobid}_${index} if not set)
+        """
+        if self.config_parser.has_option('cluster', 'array_jobid'):
+            array_jobid = self.get('cluster', 'array_jobid')
+            if array_jobid:
+                return Template(array_jobid)
+        return Template('${jobid}_${index}')
+
+    def get_job_depend_option(self):
+        """Get the job_depend_option value from the cluster section.
+
+        Option of cmd_submit making a job wait for the success of the jobs
+         ${jobids} (separated by ':'), e.g. --dependency=afterok:${jobids}.
+
+        :return: Template class of the job_depend_option value,
+                 '' if not set
+        """
+        if not self.config_parser.has_option('cluster', 'job_depend_option'):
+            return ''
+        depend_option = self.get('cluster', 'job_depend_option')
+        if not depend_option:
+            return ''
+        return Template(depend_option)
+
+    def get_max_array_size(self):
+        """Get the max_array_size value from the cluster section.
+
+        :return: int of the max_array_size value (1000 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'max_array_size'):
+            return 1000
+        size = self.get('cluster', 'max_array_size')
+        if not size:
+            return 1000
+        return int(size)
+
     def get_email_opts(self):
         """Get the email_opts value from the cluster section.
 
@@ -556,6 +689,38 @@ class DAX_Settings(object):
         else:
             return 14
 
+    def get_queue_resync_jobs(self):
+        """Get the queue_resync_jobs value from the cluster section.
+
+        Number of jobs submitted by the launcher before counting the jobs
+         in the queue again (cmd_count_nb_jobs).
+
+        :return: int of the queue_resync_jobs value (20 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'queue_resync_jobs'):
+            return 20
+        nb_jobs = self.get('cluster', 'queue_resync_jobs')
+        if not nb_jobs:
+            return 20
+        return max(int(nb_jobs), 1)
+
+    def get_queue_resync_seconds(self):
+        """Get the queue_resync_seconds value from the cluster section.
+
+        Number of seconds after which the launcher counts the jobs in the
+         queue again (cmd_count_nb_jobs), whatever the number of jobs
+         submitted.
+
+        :return: int of the queue_resync_seconds value (300 if not set)
+        """
+        if not self.config_parser.has_option('cluster',
+                                             'queue_resync_seconds'):
+            return 300
+        seconds = self.get('cluster', 'queue_resync_seconds')
+        if not seconds:
+            return 300
+        return int(seconds)
+
     def get_results_dir(self):
         """Get the results_dir value from the cluster section.
 
@@ -593,6 +758,78 @@ class DAX_Settings(object):
         """
         return self.get('cluster', 'launcher_type')
 
+    def get_diskq_store(self):
+        """Get the diskq_store value from the cluster section.
+
+        Path to the SQLite file storing the attributes of the DiskQ tasks
+         (procstatus, jobid, ...) instead of one file per attribute.
+
+        :return: String of the diskq_store path, None if empty
+        """
+        if not self.config_parser.has_option('cluster', 'diskq_store'):
+            return None
+        diskq_store = self.get('cluster', 'diskq_store')
+        if diskq_store:
+            return os.path.expanduser(diskq_store)
+        return None
+
+    def get_queue_layout(self):
+        """Get the queue_layout value from the cluster section.
+
+        Layout of the folders of RESULTS_DIR and DISKQ holding one file or
+         folder per assessor (see queue_layout.py).
+
+        :return: String of the queue_layout, flat if not set
+        """
+        if not self.config_parser.has_option('cluster', 'queue_layout'):
+            return 'flat'
+        return self.get('cluster', 'queue_layout') or 'flat'
+
+    def get_upload_part_size(self):
+        """Get the upload_part_size value from the cluster section.
+
+        Maximum size in MB of the parts of a resource uploaded one after the
+         other (see XnatUtils.upload_folder_parts).
+
+        :return: int of the upload_part_size value (1024 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'upload_part_size'):
+            return 1024
+        part_size = self.get('cluster', 'upload_part_size')
+        if not part_size:
+            return 1024
+        return max(int(part_size), 1)
+
+    def get_upload_retries(self):
+        """Get the upload_retries value from the cluster section.
+
+        Number of times the upload of a part is retried after a network
+         error, waiting twice longer after each failure.
+
+        :return: int of the upload_retries value (5 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'upload_retries'):
+            return 5
+        retries = self.get('cluster', 'upload_retries')
+        if not retries:
+            return 5
+        return max(int(retries), 0)
+
+    def get_upload_timeout(self):
+        """Get the upload_timeout value from the cluster section.
+
+        Number of seconds without progress on the connection before the
+         upload of a part fails and is retried.
+
+        :return: int of the upload_timeout value (300 if not set)
+        """
+        if not self.config_parser.has_option('cluster', 'upload_timeout'):
+            return 300
+        timeout = self.get('cluster', 'upload_timeout')
+        if not timeout:
+            return 300
+        return max(int(timeout), 1)
+
     def get_api_url(self):
         """Get the api_url value from the dax_manager section.
 
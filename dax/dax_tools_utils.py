@@ -36,14 +36,20 @@ import socket
 import stat
 import subprocess as sb
 import sys
+import threading
 import time
 import traceback
+from multiprocessing.pool import ThreadPool
 
 from . import bin
+from . import diskq_store
+from . import job_depends
 from . import launcher
 from . import log
+from . import queue_layout
 from . import modules
 from . import processors
+from . import resource_sync
 from . import task
 from . import xnat_tools_utils
 from . import XnatUtils
@@ -81,7 +87,8 @@ ADMIN_DEFAULTS = OrderedDict([
     ('smtp_host', ''),
     ('smtp_from', ''),
     ('smtp_pass', ''),
-    ('xsitype_include', 'proc:genProcData')])
+    ('xsitype_include', 'proc:genProcData'),
+    ('project_index', '')])
 
 CLUSTER_DEFAULTS = OrderedDict([
     ('cmd_submit', 'qsub'),
@@ -89,22 +96,36 @@ CLUSTER_DEFAULTS = OrderedDict([
     ('suffix_jobid', ''),
     ('cmd_count_nb_jobs', ''),
     ('cmd_get_job_status', ''),
+    ('cmd_list_jobs_status', ''),
+    ('job_status_ttl', '60'),
     ('queue_status', ''),
     ('running_status', ''),
     ('complete_status', ''),
     ('cmd_get_job_memory', ''),
     ('cmd_get_job_walltime', ''),
     ('cmd_get_job_node', ''),
+    ('cmd_get_jobs_usage', ''),
     ('job_extension_file', '.pbs'),
     ('job_template', ''),
+    ('job_array_template', ''),
+    ('array_jobid', ''),
+    ('max_array_size', '1000'),
+    ('job_depend_option', ''),
     ('email_opts', 'a'),
     ('gateway', socket.gethostname()),
     ('root_job_dir', '/tmp'),
     ('queue_limit', '400'),
+    ('queue_resync_jobs', '20'),
+    ('queue_resync_seconds', '300'),
     ('results_dir', os.path.join(os.path.expanduser('~'),
                                  'RESULTS_XNAT_SPIDER')),
     ('max_age', '14'),
     ('launcher_type', 'xnatq-combined'),
+    ('diskq_store', ''),
+    ('queue_layout', 'flat'),
+    ('upload_part_size', '1024'),
+    ('upload_retries', '5'),
+    ('upload_timeout', '300'),
     ('skip_lastupdate', '')])
 
 CODE_PATH_DEFAULTS = OrderedDict([
@@ -182,6 +203,9 @@ email address: ', 'is_path': False},
 email address: ', 'is_path': False, 'confidential': True},
     'xsitype_include': {'msg': 'Please enter the xsitypes you would like DAX \
 to access in your XNAT instance: ', 'is_path': False},
+    'project_index': {'msg': 'Please enter the path to the SQLite file used \
+to cache the XNAT listings of the projects (empty to disable): ',
+                      'is_path': False},
     'cmd_submit': {'msg': 'What command is used to submit your batch file? \
 [e.g., qsub, sbatch]: ', 'is_path': False},
     'prefix_jobid': {'msg': 'Please enter a string to print before the \
@@ -189,11 +213,17 @@ job id after submission: ', 'is_path': False},
     'suffix_jobid': {'msg': 'Please enter a string to print after the \
 job id after submission: ', 'is_path': False},
     'cmd_count_nb_jobs': {'msg': 'Please enter the full path to text file \
-containing the command used to count the number of jobs in the queue: ',
+containing the command used to count the number of jobs in the queue (each \
+element of a job array counted as one job, e.g. squeue --array): ',
                           'is_path': True},
     'cmd_get_job_status': {'msg': 'Please enter the full path to text file \
 containing the command used to check the running status of a job: ',
                            'is_path': True},
+    'cmd_list_jobs_status': {'msg': 'Please enter the full path to text \
+file containing the command used to list the status of all your jobs \
+(one line "jobid status" per job): ', 'is_path': True},
+    'job_status_ttl': {'msg': 'Please enter the number of seconds the status \
+of all the jobs is kept before listing the jobs again: ', 'is_path': False},
     'queue_status': {'msg': 'Please enter the string the job scheduler would \
 use to indicate that a job is "in the queue": ', 'is_path': False},
     'running_status': {'msg': 'Please enter the string the job scheduler \
@@ -209,11 +239,24 @@ file containing the command used to see how much walltime a job used: ',
     'cmd_get_job_node': {'msg': 'Please enter the full path to the text file \
 containing the command used to see which node a job used: ',
                          'is_path': True},
+    'cmd_get_jobs_usage': {'msg': 'Please enter the full path to the text \
+file containing the command used to get the usage of many jobs (one line \
+"jobid memory walltime node" per job): ', 'is_path': True},
     'job_extension_file': {'msg': 'Please enter an extension for the job \
 batch file: ', 'is_path': False},
     'job_template': {'msg': 'Please enter the full path to the text file \
 containing the template used to generate the batch script: ',
                      'is_path': True},
+    'job_array_template': {'msg': 'Please enter the full path to the text \
+file containing the template used to generate the script of a job array \
+(leave empty to launch one job per assessor): ', 'is_path': True},
+    'array_jobid': {'msg': 'Please enter the format of the job id of an \
+element of a job array from ${jobid} and ${index}: ', 'is_path': False},
+    'max_array_size': {'msg': 'Please enter the maximum number of jobs in a \
+job array: ', 'is_path': False},
+    'job_depend_option': {'msg': 'Please enter the option of the submit \
+command making a job wait for the success of the jobs ${jobids} (leave \
+empty to not launch jobs depending on other jobs): ', 'is_path': False},
     'email_opts': {'msg': 'Please provide the options for the email \
 notification for a job as defined by your grid scheduler: ', 'is_path': False},
     'gateway': {'msg': 'Please enter the hostname of the server \
@@ -222,12 +265,27 @@ to run dax on: ', 'is_path': False},
 on the node: ', 'is_path': True},
     'queue_limit': {'msg': 'Please enter the maximum number of jobs \
 that should run at once: ', 'is_path': False},
+    'queue_resync_jobs': {'msg': 'Please enter the number of jobs \
+submitted before counting the jobs in the queue again: ', 'is_path': False},
+    'queue_resync_seconds': {'msg': 'Please enter the number of seconds \
+after which the jobs in the queue are counted again: ', 'is_path': False},
     'results_dir': {'msg': 'Please enter directory where data will get \
 copied to for upload: ', 'is_path': True},
     'max_age': {'msg': 'Please enter max days before re-running dax_build \
 on a session: ', 'is_path': False},
     'launcher_type': {'msg': 'Please enter launcher type: ',
                       'is_path': False},
+    'diskq_store': {'msg': 'Please enter the path to the SQLite file used \
+to store the DiskQ tasks (leave empty to store them in files): ',
+                    'is_path': True},
+    'queue_layout': {'msg': 'Please enter the layout of the queue folders \
+(flat or sharded): ', 'is_path': False},
+    'upload_part_size': {'msg': 'Please enter the maximum size in MB of \
+each part of a resource uploaded: ', 'is_path': False},
+    'upload_retries': {'msg': 'Please enter the number of times the upload \
+of a part is retried: ', 'is_path': False},
+    'upload_timeout': {'msg': 'Please enter the number of seconds without \
+progress before the upload of a part is retried: ', 'is_path': False},
     'skip_lastupdate': {'msg': 'Do you want to skip last update?: ',
                         'is_path': False},
     'api_url': {'msg': 'Please enter your REDCap API URL: ',
@@ -277,6 +335,8 @@ DEFAULT_SGE_DICT = {'cmd_submit': 'qsub',
                     'cmd_get_job_node': "echo ''\n",
                     'cmd_get_job_status': "qstat -u $USER | grep ${jobid} \
 | awk {'print $5'}\n",
+                    'cmd_list_jobs_status': "qstat -u $USER \
+| awk 'NR>2 {print $1, $5}'\n",
                     'cmd_get_job_walltime': "echo ''\n",
                     'job_extension_file': '.pbs',
                     'job_template': SGE_TEMPLATE,
@@ -303,11 +363,24 @@ xvfb-run --wait=5 \
 --server-args="-screen 0 1920x1200x24 -ac +extension GLX" \
 ${job_cmds}\n"""
 
+SLURM_ARRAY_TEMPLATE = """#!/bin/bash
+#SBATCH --mail-user=${job_email}
+#SBATCH --mail-type=${job_email_options}
+#SBATCH --nodes=1
+#SBATCH --ntasks=${job_ppn}
+#SBATCH --time=${job_walltime}
+#SBATCH --mem=${job_memory}mb
+#SBATCH -o ${job_output_file}
+#SBATCH --array=1-${job_array_size}
+
+set -- $(sed -n "${SLURM_ARRAY_TASK_ID}p" ${job_array_table})
+bash $1 > $2 2>&1\n"""
+
 DEFAULT_SLURM_DICT = {'cmd_submit': 'sbatch',
                       'prefix_jobid': 'Submitted batch job ',
                       'suffix_jobid': '\n',
                       'cmd_count_nb_jobs': 'squeue -u masispider,vuiiscci \
---noheader | wc -l\n',
+--noheader --array | wc -l\n',
                       'queue_status': 'Q',
                       'running_status': 'R',
                       'complete_status': 'slurm_load_jobs error: Invalid job \
@@ -316,12 +389,21 @@ id specified\n',
 MaxRss --noheader | awk '{print $1+0}'\n",
                       'cmd_get_job_node': 'sacct -j ${jobid}.batch --format \
 NodeList --noheader\n',
+                      'cmd_get_jobs_usage': "sacct -j ${jobids} --format \
+JobID,MaxRss,CPUTime,NodeList --noheader --parsable2 | awk -F'|' \
+'$1 ~ /\\.batch$/ {sub(/\\.batch$/, \"\", $1); print $1, $2+0, $3, $4}'\n",
                       'cmd_get_job_status': 'slurm_load_jobs error: Invalid \
 job id specified\n',
+                      'cmd_list_jobs_status': "squeue -u $USER --noheader \
+--format='%i %t' | sed 's/ PD$/ Q/'\n",
                       'cmd_get_job_walltime': 'sacct -j ${jobid}.batch \
 --format CPUTime --noheader\n',
                       'job_extension_file': '.slurm',
                       'job_template': SLURM_TEMPLATE,
+                      'job_array_template': SLURM_ARRAY_TEMPLATE,
+                      'array_jobid': '${jobid}_${index}',
+                      'job_depend_option': '--dependency=afterok:${jobids} \
+--kill-on-invalid-dep=yes',
                       'email_opts': 'FAIL'}
 
 MOAB_TEMPLATE = """#!/bin/bash
@@ -345,6 +427,19 @@ xvfb-run --wait=5 \
 --server-args="-screen 0 1920x1200x24 -ac +extension GLX" \
 ${job_cmds}\n"""
 
+MOAB_ARRAY_TEMPLATE = """#!/bin/bash
+#PBS -M ${job_email}
+#PBS -m ${job_email_options}
+#PBS -l nodes=1:ppn=${job_ppn}
+#PBS -l walltime=${job_walltime}
+#PBS -l mem=${job_memory}mb
+#PBS -o ${job_output_file}
+#PBS -j y
+#PBS -t 1-${job_array_size}
+
+set -- $(sed -n "${PBS_ARRAYID}p" ${job_array_table})
+bash $1 > $2 2>&1\n"""
+
 DEFAULT_MOAB_DICT = {
     'cmd_submit': 'qsub',
     'prefix_jobid': '',
@@ -359,11 +454,16 @@ ${jobid}'2> /dev/null | awk -v FS='(resources_used.mem=|kb)' '{print $2}' \
     'cmd_get_job_node': "echo ''\n",
     'cmd_get_job_status': "qstat -f ${jobid} | grep job_state \
 | awk {'print $3'}\n",
+    'cmd_list_jobs_status': "qstat -u $USER | awk 'NR>5 \
+{split($1, a, \".\"); print a[1], $10}'\n",
     'cmd_get_job_walltime': "rsh vmpsched 'tracejob -n ${numberofdays} \
 ${jobid}' 2> /dev/null | awk -v FS='(resources_used.walltime=|\n)' \
 '{print $2}' | sort -u | tail -1\n",
     'job_extension_file': '.pbs',
     'job_template': MOAB_TEMPLATE,
+    'job_array_template': MOAB_ARRAY_TEMPLATE,
+    'array_jobid': '${jobid}[${index}]',
+    'job_depend_option': '-W depend=afterok:${jobids}',
     'email_opts': 'a'}
 
 # Variables for upload
@@ -384,12 +484,15 @@ _OUTLOG = 'OUTLOG'
 _TRASH = 'TRASH'
 _PBS = 'PBS'
 _FLAG_FILES = 'FlagFiles'
-_UPLOAD_SKIP_LIST = [_OUTLOG, _TRASH, _PBS, _FLAG_FILES]
+_DISKQ = 'DISKQ'
+_UPLOAD_SKIP_LIST = [_OUTLOG, _TRASH, _PBS, _FLAG_FILES, _DISKQ]
 FLAGFILE_TEMPLATE = os.path.join(RESULTS_DIR, _FLAG_FILES,
                                  'Process_Upload_running')
 SNAPSHOTS_ORIGINAL = 'snapshot_original.png'
 SNAPSHOTS_PREVIEW = 'snapshot_preview.png'
 DEFAULT_HEADER = ['host', 'username', 'password', 'projects']
+# Per-thread XNAT interface of the upload workers
+_UPLOAD_LOCAL = threading.local()
 
 # Cmd:
 GS_CMD = """gs -q -o {original} -sDEVICE=pngalpha -dLastPage=1 {assessor_path}\
@@ -480,7 +583,7 @@ DEL_UP = "=================================================================\
 
 def upload_tasks(logfile, debug, upload_settings=None,
                  host=None, username=None, password=None,
-                 projects=None, suffix=None, emailaddress=None):
+                 projects=None, suffix=None, emailaddress=None, workers=1):
     """
     Upload tasks from the queue folder.
 
@@ -494,27 +597,83 @@ def upload_tasks(logfile, debug, upload_settings=None,
     :param suffix: suffix for flagfile
     :param emailaddress: email address for warnings
     :param projects: Project(s) to upload
+    :param workers: number of assessors uploaded at the same time
 
     """
     bin.set_logger(logfile, debug)
 
     # Check if folders exist
     check_folders()
-    ##flagfile = "%s%s.txt" % (FLAGFILE_TEMPLATE, suffix)
+    flagfile = "%s%s.txt" % (FLAGFILE_TEMPLATE, suffix)
 
     # Load the settings for upload
-    #upload_settings = load_upload_settings(upload_settings, host, username,
-    #                                       password, projects)
-    #print_upload_settings(upload_settings)
+    upload_settings = load_upload_settings(upload_settings, host, username,
+                                           password, projects)
+    print_upload_settings(upload_settings)
     # create the flag file showing that the spider is running
-    ##if is_dax_upload_running(flagfile):
-    ##    pass
-    ##else:
-    ##    try:
-    #upload_results(upload_settings, emailaddress)
-    ##    finally:
+    if is_dax_upload_running(flagfile):
+        pass
+    else:
+        try:
+            upload_results(upload_settings, emailaddress, workers)
+        finally:
             # remove flagfile
-    ##        os.remove(flagfile)
+            os.remove(flagfile)
+
+
+def migrate_diskq(logfile, debug, clean=False):
+    """
+    Copy the DiskQ tasks from the attribute files to the DiskQ store.
+
+    :param logfile: Full file of the file used to log to
+    :param debug: Should debug mode be used
+    :param clean: remove the attribute files copied to the store
+    :return: None
+    """
+    bin.set_logger(logfile, debug)
+
+    store = diskq_store.get_diskq_store()
+    if store is None:
+        raise DaxError('diskq_store not set in the cluster section of \
+~/.dax_settings.ini.')
+    diskq_store.migrate_diskq(DISKQ_DIR, store, clean)
+
+
+def migrate_layout(logfile, debug, layout=None):
+    """
+    Move the entries of the queue folders to a layout (see queue_layout.py).
+
+    The results folders without flag file (job still writing them) are not
+     moved. The jobs on the cluster write their outlog where it was when
+     they were submitted: they are still found but the empty folders of the
+     sharded layout are removed when going back to flat.
+
+    :param logfile: Full file of the file used to log to
+    :param debug: Should debug mode be used
+    :param layout: 'flat' or 'sharded' (queue_layout in the settings if None)
+    :return: None
+    """
+    bin.set_logger(logfile, debug)
+
+    layout = layout or queue_layout.get_layout()
+    if layout not in queue_layout.LAYOUTS:
+        raise DaxError('unknown layout %s (%s).'
+                       % (layout, ', '.join(queue_layout.LAYOUTS)))
+    if layout != queue_layout.get_layout():
+        LOGGER.warn('queue_layout is %s in the settings, the new entries will \
+not be in the %s layout.' % (queue_layout.get_layout(), layout))
+
+    folders = [(DISKQ_BATCH_DIR, JOB_EXTENSION_FILE),
+               (os.path.join(DISKQ_DIR, _OUTLOG), '.txt'),
+               (os.path.join(RESULTS_DIR, _PBS), JOB_EXTENSION_FILE),
+               (os.path.join(RESULTS_DIR, _OUTLOG), '.output')]
+    folders.extend((os.path.join(DISKQ_DIR, attr), '')
+                   for attr in diskq_store.TASK_ATTRS)
+    for folder, suffix in folders:
+        if os.path.isdir(folder):
+            queue_layout.migrate_folder(folder, suffix, layout)
+    queue_layout.migrate_folder(RESULTS_DIR, '', layout, _UPLOAD_SKIP_LIST,
+                                [_READY_FLAG_FILE, _FAILED_FLAG_FILE])
 
 
 def testing(test_file, project, sessions, host=None, username=None, hide=False,
@@ -728,39 +887,52 @@ def get_assessor_list(projects):
     """
     Get the list of assessors labels to upload to XNAT from the queue folder.
 
+    The queue folder is listed in one pass (os.scandir gives the folders
+     without a stat) and each assessor folder is listed once to find its
+     flag files. The DiskQ batch files and the hold files of job_depends are
+     listed once for all the assessors. Only the assessors ready to upload
+     are sorted by the modification time of their folder.
+
     :param projects: list of projects to upload to XNAT
     :return: list of assessor to upload from upload folder
     """
-    assessor_label_list = list()
-
     LOGGER.debug(' - Get Processes names from the upload folder...')
-    # check all files/folder in the directory
-    dirs = list(filter(os.path.isdir,
-                       glob.glob(os.path.join(RESULTS_DIR, '*'))))
-    dirs.sort(key=lambda x: os.path.getmtime(x))
-    for assessor_label in dirs:
-        assessor_label = os.path.basename(assessor_label)
-        if assessor_label in _UPLOAD_SKIP_LIST:
+    ready_entries = list()
+    diskq_labels = None
+    held_labels = None
+    # check all folders in the directory (only the folders of the projects
+    # to upload to XNAT with the sharded layout)
+    for entry in queue_layout.scan_paths(RESULTS_DIR, projects,
+                                         _UPLOAD_SKIP_LIST):
+        if not entry.is_dir():
             continue
-        # If projects set, check that the project is in the list of projects
-        # to upload to XNAT
-        if projects and assessor_label.split('-x-')[0] not in projects:
-            continue
-
-        assessor_path = os.path.join(RESULTS_DIR, assessor_label)
-        if not os.path.isdir(assessor_path):
+        try:
+            flags = set(os.listdir(entry.path))
+        except OSError:
+            # folder removed since the listing (uploaded by another process)
             continue
-        if os.path.exists(os.path.join(assessor_path, _EMAILED_FLAG_FILE)):
+        if _EMAILED_FLAG_FILE in flags or \
+           (_READY_FLAG_FILE not in flags and _FAILED_FLAG_FILE not in flags):
             continue
-        rflag = os.path.join(assessor_path, _READY_FLAG_FILE)
-        fflag = os.path.join(assessor_path, _FAILED_FLAG_FILE)
-        cflag = os.path.join(assessor_path, _COMPLETE_FLAG_FILE)
-        if (os.path.exists(rflag) or os.path.exists(fflag)) and \
-           (not is_diskq_assessor(assessor_label) or os.path.exists(cflag)):
-            # Passed all checks, so add it to upload list
-            assessor_label_list.append(assessor_label)
-
-    return assessor_label_list
+        # DiskQ assessors are uploaded once the job is complete
+        if _COMPLETE_FLAG_FILE not in flags:
+            if diskq_labels is None:
+                diskq_labels = queue_layout.list_names(
+                    DISKQ_BATCH_DIR, projects, JOB_EXTENSION_FILE)
+            if entry.name in diskq_labels:
+                continue
+        # Results read by jobs waiting for this one (see job_depends)
+        if _READY_FLAG_FILE in flags:
+            if held_labels is None:
+                held_labels = job_depends.get_held_labels()
+            if entry.name in held_labels and \
+               job_depends.is_results_held(entry.name):
+                continue
+        # Passed all checks, so add it to upload list
+        ready_entries.append(entry)
+
+    ready_entries.sort(key=lambda entry: entry.stat().st_mtime)
+    return [entry.name for entry in ready_entries]
 
 
 def get_pbs_list(projects):
@@ -773,14 +945,9 @@ def get_pbs_list(projects):
     pbs_list = list()
 
     LOGGER.debug(' - Get the PBS for the processes...')
-    # check all files/folder in the directory
-    for pbs_name in os.listdir(os.path.join(RESULTS_DIR, _PBS)):
-        # If projects set, check that the project is in the list of
-        # projects to upload to XNAT
-        if projects and pbs_name.split('-x-')[0] not in projects:
-            continue
-
-        pbs_file = os.path.join(RESULTS_DIR, _PBS, pbs_name)
+    # check all files/folder in the directory for the projects to upload
+    for pbs_name, pbs_file in queue_layout.list_paths(
+            os.path.join(RESULTS_DIR, _PBS), projects):
         if os.path.isfile(pbs_file):
             pbs_list.append(pbs_name)
 
@@ -837,8 +1004,9 @@ def copy_outlog(assessor_dict):
     :param assessor_dict: dictionary for the assessor
     :return: None
     """
-    outlog_path = os.path.join(RESULTS_DIR, _OUTLOG,
-                               assessor_dict['label'] + '.output')
+    outlog_path = queue_layout.find_path(os.path.join(RESULTS_DIR, _OUTLOG),
+                                         assessor_dict['label'],
+                                         assessor_dict['label'] + '.output')
     new_outlog_path = os.path.join(assessor_dict['path'], _OUTLOG,
                                    assessor_dict['label'] + '.output')
     if os.path.exists(outlog_path):
@@ -941,12 +1109,13 @@ def should_upload_assessor(assessor_obj, assessor_dict, xsitype, version):
     return True
 
 
-def upload_assessor(xnat, assessor_dict):
+def upload_assessor(xnat, assessor_dict, prepared=False):
     """
     Upload results to an assessor
 
     :param xnat: pyxnat.Interface object
     :param assessor_dict: assessor dictionary
+    :param prepared: the snapshots were written by prepare_assessor
     :return: None
     """
     # get spiderpath from version.txt file:
@@ -965,7 +1134,8 @@ def upload_assessor(xnat, assessor_dict):
 
     if should_upload_assessor(assessor_obj, assessor_dict, xsitype, version):
         # Before Upload
-        generate_snapshots(assessor_dict['path'])
+        if not prepared:
+            generate_snapshots(assessor_dict['path'])
         copy_outlog(assessor_dict)
 
         # Upload the XML if FreeSurfer
@@ -1028,14 +1198,43 @@ unable to find XML file: %s'
 
 def is_diskq_assessor(assr_label):
     # Does a batch file exist for this assessor?
-    afile = os.path.join(DISKQ_BATCH_DIR, assr_label + JOB_EXTENSION_FILE)
+    afile = queue_layout.find_path(DISKQ_BATCH_DIR, assr_label,
+                                   assr_label + JOB_EXTENSION_FILE)
     return os.path.exists(afile)
 
 
+def prepare_assessor(assessor_dict):
+    """
+    Write the files needed to upload an assessor: the snapshots.
+
+    The resources are zipped on the fly while uploaded (see zip_stream.py).
+
+    :param assessor_dict: assessor dictionary
+    :return: None
+    """
+    generate_snapshots(assessor_dict['path'])
+
+
+def is_zip_resource(resource_path):
+    """
+    Check if a resource folder is uploaded as a zip
+
+    :param resource_path: resource path on the station
+    :return: True if the folder has more than one file or a sub-folder
+    """
+    rfiles_list = os.listdir(resource_path)
+    return len(rfiles_list) > 1 or \
+        (len(rfiles_list) == 1 and
+         os.path.isdir(os.path.join(resource_path, rfiles_list[0])))
+
+
 def upload_resource(assessor_obj, resource, resource_path):
     """
     Upload a resource folder to an assessor
 
+    The files of a folder already on XNAT with the same content are not
+     uploaded again (see resource_sync.py).
+
     :param assessor_obj: pyxnat assessor Eobject
     :param resource: resource to upload
     :param resource_path: resource path on the station
@@ -1047,11 +1246,11 @@ def upload_resource(assessor_obj, resource, resource_path):
         rfiles_list = os.listdir(resource_path)
         if not rfiles_list:
             LOGGER.warn('No files in {}'.format(resource_path))
-        elif len(rfiles_list) > 1 or os.path.isdir(rfiles_list[0]):
+        elif is_zip_resource(resource_path):
             try:
-                XnatUtils.upload_folder_to_obj(
-                    resource_path, assessor_obj.out_resource(resource),
-                    resource, removeall=True)
+                resource_sync.sync_folder(
+                    assessor_obj._intf, assessor_obj.out_resource(resource),
+                    resource_path, resource)
             except XnatUtilsError as err:
                 print(ERR_MSG % err)
         # One or two file, let just upload them:
@@ -1099,21 +1298,26 @@ def upload_snapshots(assessor_obj, resource_path):
             print(ERR_MSG % err)
 
 
-def upload_assessors(xnat, projects):
+def upload_assessors(xnat, projects, workers=1, upload_dict=None):
     """
     Upload all assessors to XNAT
 
     :param xnat: pyxnat.Interface object
     :param projects: list of projects to upload to XNAT
-    :return: None
+    :param workers: number of assessors uploaded at the same time
+    :param upload_dict: host/username/password of xnat for the workers
+    :return: list of warnings
     """
     # Get the assessor label from the directory :
     assessors_list = get_assessor_list(projects)
+    if workers > 1 and upload_dict and len(assessors_list) > 1:
+        return upload_assessors_parallel(assessors_list, workers, upload_dict)
+
     number_of_processes = len(assessors_list)
     warnings = list()
 
     for index, assessor_label in enumerate(assessors_list):
-        assessor_path = os.path.join(RESULTS_DIR, assessor_label)
+        assessor_path = queue_layout.find_path(RESULTS_DIR, assessor_label)
         msg = "    *Process: %s/%s -- label: %s / time: %s"
         LOGGER.info(msg % (str(index + 1), str(number_of_processes),
                            assessor_label, str(datetime.now())))
@@ -1129,6 +1333,100 @@ def upload_assessors(xnat, projects):
     return warnings
 
 
+def upload_assessors_parallel(assessors_list, workers, upload_dict):
+    """
+    Upload assessors to XNAT on two pools of threads
+
+    The assessors go through two stages: the prepare workers write the
+     snapshots (CPU and disk), the transfer workers zip the resources on
+     the fly and upload them to XNAT (network). An assessor is sent to the
+     transfer workers as soon as it is prepared so both stages overlap.
+     Each transfer worker opens its own XNAT interface. The failure of an
+     assessor is logged and added to the warnings without stopping the
+     others.
+
+    :param assessors_list: list of assessor labels to upload
+    :param workers: number of threads of each stage
+    :param upload_dict: host/username/password of xnat for the workers
+    :return: list of warnings
+    """
+    number_of_processes = len(assessors_list)
+    workers = min(workers, number_of_processes)
+    LOGGER.info('  * Uploading %s assessors with %s workers'
+                % (str(number_of_processes), str(workers)))
+    interfaces = list()
+    intf_lock = threading.Lock()
+    mess = """    - Assessor label : {label}\n"""
+
+    def _prepare(assessor_label):
+        """Write the snapshots of one assessor."""
+        assessor_path = queue_layout.find_path(RESULTS_DIR, assessor_label)
+        assessor_dict = get_assessor_dict(assessor_label, assessor_path)
+        if not assessor_dict:
+            return assessor_label, None, None
+        try:
+            prepare_assessor(assessor_dict)
+        except Exception:
+            return assessor_label, assessor_dict, traceback.format_exc()
+        return assessor_label, assessor_dict, None
+
+    def _transfer(prepared):
+        """Upload one prepared assessor with the interface of the thread."""
+        assessor_label, assessor_dict, error = prepared
+        if error is not None:
+            return error
+        if getattr(_UPLOAD_LOCAL, 'xnat', None) is None:
+            _UPLOAD_LOCAL.xnat = XnatUtils.get_interface(
+                host=upload_dict['host'], user=upload_dict['username'],
+                pwd=upload_dict['password'])
+            with intf_lock:
+                interfaces.append(_UPLOAD_LOCAL.xnat)
+        LOGGER.info('    *Process: %s -- time: %s'
+                    % (assessor_label, str(datetime.now())))
+        try:
+            return upload_assessor(_UPLOAD_LOCAL.xnat, assessor_dict,
+                                   prepared=True)
+        except Exception:
+            return traceback.format_exc()
+
+    warnings = list()
+    prepare_pool = ThreadPool(workers)
+    transfer_pool = ThreadPool(workers)
+    try:
+        transfers = list()
+        for prepared in prepare_pool.imap_unordered(_prepare, assessors_list):
+            if prepared[1] is None:
+                LOGGER.warn('     --> wrong label: %s' % prepared[0])
+                continue
+            transfers.append((prepared[0], transfer_pool.apply_async(
+                _transfer, (prepared,))))
+
+        for index, (assessor_label, transfer) in enumerate(transfers):
+            result = transfer.get()
+            if result is True:
+                LOGGER.info('    *Process: %s/%s -- label: %s uploaded'
+                            % (str(index + 1), str(len(transfers)),
+                               assessor_label))
+                continue
+            if result is not False and result is not None:
+                LOGGER.critical('Caught exception uploading assessor %s'
+                                % assessor_label)
+                LOGGER.critical(result)
+            warnings.append(mess.format(label=assessor_label))
+    finally:
+        prepare_pool.close()
+        transfer_pool.close()
+        prepare_pool.join()
+        transfer_pool.join()
+        for intf in interfaces:
+            try:
+                intf.disconnect()
+            except Exception as E:
+                LOGGER.warn('failed to disconnect worker interface: %s'
+                            % str(E))
+    return warnings
+
+
 def upload_pbs(xnat, projects):
     """
     Upload all pbs files to XNAT
@@ -1140,12 +1438,13 @@ def upload_pbs(xnat, projects):
     pbs_list = get_pbs_list(projects)
     number_pbs = len(pbs_list)
     for index, pbsfile in enumerate(pbs_list):
-        pbs_fpath = os.path.join(RESULTS_DIR, _PBS, pbsfile)
+        assessor_label = os.path.splitext(pbsfile)[0]
+        pbs_fpath = queue_layout.find_path(os.path.join(RESULTS_DIR, _PBS),
+                                           assessor_label, pbsfile)
         mess = """   *Uploading PBS {index}/{max} -- File name: {file}"""
         LOGGER.info(mess.format(index=str(index + 1),
                                 max=str(number_pbs),
                                 file=pbsfile))
-        assessor_label = os.path.splitext(pbsfile)[0]
         assessor_dict = get_assessor_dict(assessor_label, 'none')
         if not assessor_dict:
             LOGGER.warn('wrong assessor label for %s' % (pbsfile))
@@ -1162,7 +1461,8 @@ def upload_pbs(xnat, projects):
                     label = assessor_dict['label']
                     msg = 'the PBS resource already exists for the assessor %s'
                     LOGGER.warn(msg % (label))
-                    adir = os.path.join(RESULTS_DIR, assessor_dict['label'])
+                    adir = queue_layout.find_path(RESULTS_DIR,
+                                                  assessor_dict['label'])
                     if os.path.isdir(adir):
                         msg = 'Copying the pbs file in the assessor folder...'
                         LOGGER.warn(msg)
@@ -1193,14 +1493,11 @@ def upload_outlog(xnat, projects):
     :param projects: list of projects to upload to XNAT
     :return: None
     """
-    outlogs_list = os.listdir(os.path.join(RESULTS_DIR, _OUTLOG))
-    if projects:
-        outlogs_list = [logfile for logfile in outlogs_list
-                        if logfile.split('-x-')[0] in projects]
+    outlogs_list = queue_layout.list_paths(os.path.join(RESULTS_DIR, _OUTLOG),
+                                           projects)
 
     number_outlog = len(outlogs_list)
-    for index, outlogfile in enumerate(outlogs_list):
-        outlog_fpath = os.path.join(RESULTS_DIR, _OUTLOG, outlogfile)
+    for index, (outlogfile, outlog_fpath) in enumerate(outlogs_list):
         mess = """   *Checking OUTLOG {index}/{max} -- File name: {file}"""
         LOGGER.info(mess.format(index=str(index + 1),
                                 max=str(number_outlog),
@@ -1232,12 +1529,14 @@ def upload_outlog(xnat, projects):
                             os.remove(outlog_fpath)
 
 
-def upload_results(upload_settings, emailaddress):
+def upload_results(upload_settings, emailaddress, workers=1):
     """
     Main function to upload the results / PBS / OUTLOG of assessors
      from the queue folder
 
     :param upload_settings: dictionary defining the upload information
+    :param emailaddress: email address for warnings
+    :param workers: number of assessors uploaded at the same time
     :return: None
     """
     if len(os.listdir(RESULTS_DIR)) == 0:
@@ -1245,6 +1544,7 @@ def upload_results(upload_settings, emailaddress):
         sys.exit()
 
     warnings = list()
+    resource_sync.SYNC_REPORT.reset()
 
     for upload_dict in upload_settings:
         with XnatUtils.get_interface(host=upload_dict['host'],
@@ -1263,7 +1563,8 @@ for projects: %s' % (upload_dict['host'], proj_str))
             # 1) Upload the assessor data
             # For each assessor label that need to be upload :
             LOGGER.info(' - Uploading results for assessors')
-            warnings.extend(upload_assessors(xnat, upload_dict['projects']))
+            warnings.extend(upload_assessors(xnat, upload_dict['projects'],
+                                             workers, upload_dict))
 
             # 2) Upload the PBS files
             # For each file, upload it to the PBS resource
@@ -1275,6 +1576,7 @@ for projects: %s' % (upload_dict['host'], proj_str))
 jobs ...')
             upload_outlog(xnat, upload_dict['projects'])
 
+    resource_sync.SYNC_REPORT.report()
     send_warning_emails(warnings, emailaddress)
 
 
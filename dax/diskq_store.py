@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" diskq_store.py
+
+SQLite store of the attributes of the DiskQ tasks.
+
+By default, ClusterTask keeps each attribute of a task (procstatus, jobid,
+ memused, walltimeused, jobnode, jobstartdate) in a file
+ DISKQ/<attribute>/<assessor_label>. With the store, the attributes of all
+ the tasks are rows of one SQLite file indexed on the status and the
+ project: the attributes of a task are set in one transaction and the tasks
+ with a status are found with one query.
+
+The store is enabled by setting diskq_store in the [cluster] section of
+~/.dax_settings.ini to the path of the SQLite file. The tasks not in the
+store are still read from the files: they are copied to the store when the
+DiskQ is loaded (see import_missing_tasks) or the first time one of their
+attributes is set. `dax migrate_diskq` copies all the existing tasks at
+once.
+"""
+
+from builtins import object
+from builtins import str
+from builtins import zip
+
+import logging
+import os
+import sqlite3
+import threading
+
+from . import queue_layout
+from .dax_settings import DAX_Settings
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['DiskqStore', 'get_diskq_store', 'migrate_diskq',
+           'import_missing_tasks']
+DAX_SETTINGS = DAX_Settings()
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+TASK_ATTRS = ['procstatus', 'jobid', 'memused', 'walltimeused', 'jobnode',
+              'jobstartdate']
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    label TEXT PRIMARY KEY, project TEXT, procstatus TEXT, jobid TEXT,
+    memused TEXT, walltimeused TEXT, jobnode TEXT, jobstartdate TEXT);
+CREATE INDEX IF NOT EXISTS tasks_status ON tasks (procstatus);
+CREATE INDEX IF NOT EXISTS tasks_project ON tasks (project, procstatus);
+"""
+# Status of a task without procstatus (see ClusterTask.get_status)
+DEFAULT_STATUS = 'NEED_TO_RUN'
+_DISKQ_STORE = None
+
+
+class DiskqStore(object):
+    """ SQLite store of the attributes of the DiskQ tasks """
+    def __init__(self, db_path):
+        """
+        Entry point for the DiskqStore class
+
+        :param db_path: path to the SQLite file (created if needed)
+        :return: None
+        """
+        self.db_path = db_path
+        self._local = threading.local()
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        conn = self._connect()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def _connect(self):
+        """
+        Get the connection to the store of the current thread.
+
+        :return: sqlite3 connection
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60)
+            self._local.conn = conn
+        return conn
+
+    def get_attrs(self, label):
+        """
+        Get the attributes of a task.
+
+        :param label: assessor label of the task
+        :return: dictionary attribute: value (None if not set),
+                 None if the task is not in the store
+        """
+        row = self._connect().execute(
+            'SELECT %s FROM tasks WHERE label=?' % ', '.join(TASK_ATTRS),
+            (label,)).fetchone()
+        if row is None:
+            return None
+        return dict(list(zip(TASK_ATTRS, row)))
+
+    def set_attrs(self, label, attrs):
+        """
+        Set attributes of a task in one transaction.
+
+        :param label: assessor label of the task
+        :param attrs: dictionary attribute: value
+        :return: None
+        """
+        names = [name for name in attrs if name in TASK_ATTRS]
+        if len(names) != len(attrs):
+            err = 'unknown DiskQ attributes: %s'
+            raise ValueError(err % ', '.join(set(attrs) - set(TASK_ATTRS)))
+
+        conn = self._connect()
+        with conn:
+            conn.execute('INSERT OR IGNORE INTO tasks (label, project) \
+VALUES (?, ?)', (label, get_label_project(label)))
+            if names:
+                conn.execute(
+                    'UPDATE tasks SET %s WHERE label=?'
+                    % ', '.join('%s=?' % name for name in names),
+                    [str_value(attrs[name]) for name in names] + [label])
+
+    def delete(self, label):
+        """
+        Delete a task.
+
+        :param label: assessor label of the task
+        :return: None
+        """
+        conn = self._connect()
+        with conn:
+            conn.execute('DELETE FROM tasks WHERE label=?', (label,))
+
+    def list_labels(self, status=None, projects=None):
+        """
+        List the tasks with a status in projects.
+
+        :param status: procstatus of the tasks (all if None)
+        :param projects: list of projects (all if None)
+        :return: list of assessor labels
+        """
+        where = list()
+        values = list()
+        if status:
+            where.append('procstatus=?')
+            values.append(status)
+        if projects:
+            where.append('project IN (%s)' % ', '.join('?' for _ in projects))
+            values.extend(projects)
+        query = 'SELECT label FROM tasks'
+        if where:
+            query = '%s WHERE %s' % (query, ' AND '.join(where))
+        return [row[0] for row in
+                self._connect().execute(query, values).fetchall()]
+
+    def import_tasks(self, tasks):
+        """
+        Add tasks to the store in one transaction (existing tasks replaced).
+
+        :param tasks: list of (label, dictionary attribute: value)
+        :return: None
+        """
+        conn = self._connect()
+        with conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO tasks (label, project, %s) VALUES \
+(?, ?, %s)' % (', '.join(TASK_ATTRS), ', '.join('?' for _ in TASK_ATTRS)),
+                [[label, get_label_project(label)] +
+                 [str_value(attrs.get(name)) for name in TASK_ATTRS]
+                 for label, attrs in tasks])
+
+
+def get_label_project(label):
+    """ Get the project of a task from its assessor label """
+    return label.split('-x-')[0]
+
+
+def str_value(value):
+    """ Convert a value to store like ClusterTask.set_attr (None kept) """
+    if value is None:
+        return None
+    return str(value).strip()
+
+
+def read_attr_files(diskq_dir, label):
+    """
+    Read the attribute files of a task (DISKQ/<attribute>/<label>)
+
+    :param diskq_dir: DISKQ folder in RESULTS_DIR
+    :param label: assessor label of the task
+    :return: dictionary attribute: value (procstatus always set)
+    """
+    attrs = dict()
+    for name in TASK_ATTRS:
+        attr_path = queue_layout.find_path(os.path.join(diskq_dir, name),
+                                           label)
+        if os.path.isfile(attr_path):
+            with open(attr_path, 'r') as f_obj:
+                attrs[name] = f_obj.read().strip()
+    if not attrs.get('procstatus'):
+        attrs['procstatus'] = DEFAULT_STATUS
+    return attrs
+
+
+def get_diskq_store():
+    """
+    Get the DiskQ store set in the settings.
+
+    :return: DiskqStore object, None if diskq_store is not set
+    """
+    global _DISKQ_STORE
+    db_path = DAX_SETTINGS.get_diskq_store()
+    if not db_path:
+        return None
+    if _DISKQ_STORE is None or _DISKQ_STORE.db_path != db_path:
+        _DISKQ_STORE = DiskqStore(db_path)
+    return _DISKQ_STORE
+
+
+def import_missing_tasks(diskq_dir, store, projects=None):
+    """
+    Copy to the store the DiskQ tasks written before the store.
+
+    The tasks with a batch file but not in the store (e.g. the tasks still
+     running when the store was set) are added with the attributes read
+     from their files.
+
+    :param diskq_dir: DISKQ folder in RESULTS_DIR
+    :param store: DiskqStore object
+    :param projects: list of projects (all if None)
+    :return: number of tasks copied
+    """
+    known = set(store.list_labels(projects=projects))
+    batch_dir = os.path.join(diskq_dir, 'BATCH')
+    labels = list()
+    for batch_file, _ in queue_layout.list_paths(batch_dir, projects):
+        label = os.path.splitext(batch_file)[0]
+        if label not in known:
+            labels.append(label)
+
+    if not labels:
+        return 0
+
+    store.import_tasks([(label, read_attr_files(diskq_dir, label))
+                        for label in labels])
+    LOGGER.info('%s DiskQ tasks not in the store copied from their files to \
+%s' % (str(len(labels)), store.db_path))
+    return len(labels)
+
+
+def migrate_diskq(diskq_dir, store, clean=False):
+    """
+    Copy the attribute files of the DiskQ tasks to the store.
+
+    Every task with a batch file is added to the store (NEED_TO_RUN if it
+     has no procstatus file).
+
+    :param diskq_dir: DISKQ folder in RESULTS_DIR
+    :param store: DiskqStore object
+    :param clean: remove the attribute files copied to the store
+    :return: number of tasks copied
+    """
+    batch_dir = os.path.join(diskq_dir, 'BATCH')
+    labels = [os.path.splitext(batch_file)[0]
+              for batch_file, _ in queue_layout.list_paths(batch_dir)]
+
+    tasks = [(label, read_attr_files(diskq_dir, label)) for label in labels]
+    store.import_tasks(tasks)
+    LOGGER.info('%s DiskQ tasks copied to %s'
+                % (str(len(tasks)), store.db_path))
+
+    if clean:
+        for label in labels:
+            for name in TASK_ATTRS:
+                try:
+                    os.remove(queue_layout.find_path(
+                        os.path.join(diskq_dir, name), label))
+                except OSError:
+                    pass
+    return len(tasks)
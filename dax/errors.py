@@ -15,8 +15,8 @@ import sys
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
 __all__ = ['DaxError', 'DaxXnatError', 'DaxSpiderError', 'DaxProcessorError',
            'DaxSetupError', 'DaxNetrcError', 'DaxUploadError',
-           'XnatAuthentificationError', 'XnatUtilsError', 'XnatAccessError',
-           'XnatToolsError', 'XnatToolsUserError',
+           'XnatAuthentificationError', 'XnatUtilsError', 'XnatUploadError',
+           'XnatAccessError', 'XnatToolsError', 'XnatToolsUserError',
            'ClusterLaunchException', 'ClusterCountJobsException',
            'ClusterJobIDException',
            'SpiderError', 'AutoSpiderError',
@@ -87,6 +87,14 @@ class XnatUtilsError(DaxXnatError):
         Exception.__init__(self, 'Error in XnatUtils: %s' % message)
 
 
+class XnatUploadError(XnatUtilsError):
+    """XnatUtils exception raised when an upload to XNAT failed."""
+    def __init__(self, message, status=None):
+        XnatUtilsError.__init__(self, message)
+        # HTTP status returned by XNAT, None if the connection failed
+        self.status = status
+
+
 class XnatToolsError(DaxError):
     """Xnat Tools Exception."""
     def __init__(self, message):
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" job_depends.py
+
+Launch the assessors waiting for the outputs of other assessors as soon as
+ the jobs of those assessors are submitted.
+
+A YAML processor (AutoProcessor) with assessors in its xnat_inputs stays
+ NEED_INPUTS until its inputs are uploaded and QC'd. In a session, such an
+ assessor depends on the assessors of the same session matching its input
+ proctypes (the per-session processor DAG). When all its missing inputs
+ are assessors with a job on the cluster (JOB_RUNNING), dax launch can
+ submit its job right away with a dependency on those jobs (afterok, see
+ job_depend_option in the cluster settings). The job reads the outputs of
+ the input assessors from RESULTS_DIR instead of XNAT, so dax upload holds
+ the results of the input assessors until the dependent jobs left the queue.
+"""
+
+from builtins import str
+
+import logging
+import os
+import time
+
+from . import cluster
+from . import XnatUtils
+from .dax_settings import DAX_Settings
+from .task import NEED_INPUTS, JOB_RUNNING
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['find_dependent_assessors', 'hold_results', 'is_results_held',
+           'get_held_labels']
+DAX_SETTINGS = DAX_Settings()
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Results kept for the dependent jobs at most this many days
+HOLD_MAX_DAYS = 7
+HOLD_SUFFIX = '_DEPENDENTS.txt'
+
+
+def find_dependent_assessors(assr_list, proc_list):
+    """
+    Find the assessors waiting for input assessors with a running job
+
+    An input assessor stays JOB_RUNNING on XNAT until its results are
+     uploaded: only the jobs still on the cluster ('R' or 'Q') are used,
+     the scheduler rejects a dependency on a job it does not know anymore.
+
+    :param assr_list: assessors of a project (list_project_assessors)
+    :param proc_list: processors of the project
+    :return: list of (assessor info, dictionary label: jobid of the input
+             assessors of the same session with a job on the cluster)
+    """
+    procs = dict((proc.name, proc) for proc in proc_list
+                 if hasattr(proc, 'get_upstream_proctypes') and
+                 proc.get_upstream_proctypes())
+    if not procs:
+        return list()
+
+    # Only the jobs submitted by dax for this project write in RESULTS_DIR
+    proc_names = set(proc.name for proc in proc_list)
+    running = dict()
+    for assr_info in assr_list:
+        if assr_info['procstatus'] == JOB_RUNNING and \
+           assr_info['proctype'] in proc_names and \
+           is_dependable_jobid(assr_info.get('jobid')):
+            running.setdefault(assr_info['session_id'],
+                               list()).append(assr_info)
+
+    on_cluster = dict()
+    dependents = list()
+    for assr_info in assr_list:
+        proc = procs.get(assr_info['proctype'])
+        if proc is None or assr_info['procstatus'] != NEED_INPUTS:
+            continue
+        matcher = XnatUtils.get_matcher(proc.get_upstream_proctypes(),
+                                        proc.full_regex)
+        upstream = dict(
+            (upstream_info['assessor_label'],
+             str(upstream_info['jobid']).strip())
+            for upstream_info in running.get(assr_info['session_id'], list())
+            if matcher.match(upstream_info['proctype']) is not None and
+            is_job_on_cluster(upstream_info['jobid'], on_cluster))
+        if upstream:
+            dependents.append((assr_info, upstream))
+    return dependents
+
+
+def is_dependable_jobid(jobid):
+    """
+    Check if a job can be used in a dependency of another job
+
+    :param jobid: job id set on the assessor
+    :return: True if the job was submitted to the cluster
+    """
+    jobid = str(jobid or '').strip()
+    return jobid not in ['', '0', 'no_qsub']
+
+
+def is_job_on_cluster(jobid, known):
+    """
+    Check if the scheduler reports a job as running or waiting
+
+    :param jobid: job id to check
+    :param known: dictionary jobid: result of the jobs already checked
+    :return: True if the job status is 'R' or 'Q'
+    """
+    jobid = str(jobid).strip()
+    if jobid not in known:
+        known[jobid] = cluster.job_status(jobid) in ['R', 'Q']
+    return known[jobid]
+
+
+def get_hold_file(assessor_label):
+    """ Get the file listing the jobs waiting for the results of an assessor """
+    return os.path.join(DAX_SETTINGS.get_results_dir(), 'FlagFiles',
+                        '%s%s' % (assessor_label, HOLD_SUFFIX))
+
+
+def get_held_labels():
+    """
+    Get the labels of the assessors with a hold file, in one listing
+
+    :return: set of assessor labels (see is_results_held)
+    """
+    flag_dir = os.path.dirname(get_hold_file(''))
+    if not os.path.isdir(flag_dir):
+        return set()
+    return set(name[:-len(HOLD_SUFFIX)] for name in os.listdir(flag_dir)
+               if name.endswith(HOLD_SUFFIX))
+
+
+def hold_results(upstream, assessor_label, jobid):
+    """
+    Keep the results of the input assessors while the job is on the cluster
+
+    :param upstream: dictionary label: jobid of the input assessors
+    :param assessor_label: label of the dependent assessor
+    :param jobid: job id of the dependent assessor
+    :return: None
+    """
+    for upstream_label in upstream:
+        with open(get_hold_file(upstream_label), 'a') as f_obj:
+            f_obj.write('%s %s\n' % (assessor_label, jobid))
+
+
+def is_results_held(assessor_label):
+    """
+    Check if the results of an assessor are still needed by dependent jobs
+
+    The results are held until the scheduler reports that all the dependent
+     jobs finished (see is_job_finished). A job with an unknown status
+     keeps the hold. The hold is released after HOLD_MAX_DAYS.
+
+    :param assessor_label: label of the assessor in RESULTS_DIR
+    :return: True if the upload of the assessor needs to wait
+    """
+    hold_file = get_hold_file(assessor_label)
+    if not os.path.isfile(hold_file):
+        return False
+
+    hold_time = os.path.getmtime(hold_file)
+    if time.time() - hold_time < HOLD_MAX_DAYS * 86400:
+        with open(hold_file, 'r') as f_obj:
+            held = [line.split() for line in f_obj if len(line.split()) == 2]
+        # The snapshot of the queue must be newer than the last dependent job
+        waiting = [label for label, jobid in held
+                   if not is_job_finished(jobid, hold_time)]
+        if waiting:
+            LOGGER.debug('%s held for the jobs of %s'
+                         % (assessor_label, ', '.join(waiting)))
+            return True
+
+    os.remove(hold_file)
+    return False
+
+
+def is_job_finished(jobid, since=None):
+    """
+    Check if the scheduler reports a job as finished
+
+    A job is finished if it is missing from the snapshot of the queue or if
+     its status is 'C'. The status is unknown (None) for a job in a state
+     that dax does not map (e.g. held) or if the status command failed.
+
+    :param jobid: job id to check
+    :param since: submission time of the job: an older snapshot of the
+     queue is taken again
+    :return: True if the job finished, False if it is on the cluster or if
+             its status is unknown
+    """
+    jobid = str(jobid).strip()
+    jobs = cluster.get_jobs_status(since=since)
+    if jobs is not None and jobid not in jobs:
+        return True
+    return cluster.job_status(jobid) == 'C'
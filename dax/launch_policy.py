@@ -0,0 +1,251 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" launch_policy.py
+
+Order the tasks found by dax launch before their submission.
+
+FifoPolicy keeps the order of the tasks found (default). FairSharePolicy
+ spreads the queue between the projects: the projects take turns according
+ to their weight and the number of jobs they already have on the cluster,
+ the tasks of a project are sorted by the priority of their processor
+ (attrs/priority in the YAML) boosted by the time they have been waiting,
+ and a project can not have more jobs on the cluster than its slots.
+"""
+
+from builtins import object
+from past.builtins import basestring
+
+import heapq
+import json
+import logging
+import os
+import time
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['FifoPolicy', 'FairSharePolicy', 'get_launch_policy']
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+LAUNCH_POLICIES = ['fifo', 'fairshare']
+
+
+class FifoPolicy(object):
+    """ Launch the tasks in the order they were found """
+    # order() needs the number of jobs of each project on the cluster
+    needs_running = False
+
+    def order(self, task_list, running=None, ages_file=None):
+        """
+        Order the tasks to launch
+
+        :param task_list: list of tasks found (launched from the end)
+        :param running: dictionary project: number of jobs on the cluster
+        :param ages_file: JSON file keeping when the tasks were first found
+        :return: list of tasks in launch order
+        """
+        return list(reversed(task_list))
+
+    def reserve(self, cur_task):
+        """
+        Check if a task can be launched now and count it for its project
+
+        :param cur_task: task to launch
+        :return: True if the task can be launched, False otherwise
+        """
+        return True
+
+
+class FairSharePolicy(FifoPolicy):
+    """ Weighted fair share between the projects with slot caps """
+    needs_running = True
+
+    def __init__(self, weights=None, slots=None, priorities=None,
+                 age_boost_hours=24):
+        """
+        Entry point for the FairSharePolicy class
+
+        :param weights: dictionary project: weight (1 if not set)
+        :param slots: dictionary project: maximum number of jobs on the
+                      cluster (no limit if not set)
+        :param priorities: dictionary processor name: priority (0 if not
+                           set), the higher the sooner
+        :param age_boost_hours: hours of waiting adding one to the priority
+                                of a task (no boost if 0 or None)
+        :return: None
+        """
+        self.weights = weights or dict()
+        self.slots = slots or dict()
+        self.priorities = priorities or dict()
+        self.age_boost_hours = age_boost_hours
+        self.used = dict()
+
+    def order(self, task_list, running=None, ages_file=None):
+        """
+        Order the tasks to launch
+
+        The projects are interleaved by stride scheduling: the next task
+         comes from the project with the lowest (jobs on the cluster + jobs
+         ordered so far) / weight.
+
+        :param task_list: list of tasks found
+        :param running: dictionary project: number of jobs on the cluster
+        :param ages_file: JSON file keeping when the tasks were first found
+        :return: list of tasks in launch order
+        """
+        running = running or dict()
+        self.used = dict(running)
+        waiting = get_waiting_hours(task_list, ages_file)
+
+        project_tasks = dict()
+        for cur_task in task_list:
+            project_tasks.setdefault(get_task_project(cur_task),
+                                     list()).append(cur_task)
+        for project, tasks in list(project_tasks.items()):
+            tasks.sort(key=lambda cur_task: -self.get_task_score(
+                cur_task, waiting.get(cur_task.assessor_label, 0)))
+
+        heap = list()
+        for project, tasks in list(project_tasks.items()):
+            weight = self.get_weight(project)
+            heap.append((float(running.get(project, 0) + 1) / weight,
+                         project, 0))
+        heapq.heapify(heap)
+
+        ordered = list()
+        while heap:
+            _, project, index = heapq.heappop(heap)
+            tasks = project_tasks[project]
+            ordered.append(tasks[index])
+            if index + 1 < len(tasks):
+                nb_jobs = running.get(project, 0) + index + 2
+                heapq.heappush(heap, (float(nb_jobs) / self.get_weight(
+                    project), project, index + 1))
+
+        LOGGER.debug('fair share order: %s' % ', '.join(
+            '%s:%s' % (project, str(len(tasks)))
+            for project, tasks in sorted(project_tasks.items())))
+        return ordered
+
+    def reserve(self, cur_task):
+        """
+        Check if a task can be launched now and count it for its project
+
+        :param cur_task: task to launch
+        :return: True if the project of the task has a slot left
+        """
+        project = get_task_project(cur_task)
+        limit = self.slots.get(project)
+        if limit is not None and self.used.get(project, 0) >= limit:
+            LOGGER.debug('project %s has no slot left (%s), skipping %s'
+                         % (project, str(limit), cur_task.assessor_label))
+            return False
+        self.used[project] = self.used.get(project, 0) + 1
+        return True
+
+    def get_weight(self, project):
+        """
+        Get the weight of a project
+
+        :param project: project ID
+        :return: weight (float > 0)
+        """
+        weight = float(self.weights.get(project, 1))
+        return weight if weight > 0 else 1.0
+
+    def get_task_score(self, cur_task, waiting_hours):
+        """
+        Get the score of a task in its project (the higher the sooner)
+
+        :param cur_task: task to launch
+        :param waiting_hours: hours since the task was first found
+        :return: priority of the processor plus the age boost
+        """
+        score = float(self.priorities.get(get_task_proctype(cur_task), 0))
+        if self.age_boost_hours:
+            score += waiting_hours / float(self.age_boost_hours)
+        return score
+
+
+def get_launch_policy(name=None, weights=None, slots=None, priorities=None,
+                      age_boost_hours=24):
+    """
+    Get the policy ordering the tasks of dax launch
+
+    :param name: 'fifo' (default) or 'fairshare'
+    :param weights: project weights, dictionary or string "PROJ1:2,PROJ2:1"
+    :param slots: project slot caps, dictionary or string "PROJ1:50,PROJ2:10"
+    :param priorities: dictionary processor name: priority
+    :param age_boost_hours: hours of waiting adding one to the priority
+    :return: FifoPolicy or FairSharePolicy object
+    """
+    if not name or name.lower() == 'fifo':
+        return FifoPolicy()
+    elif name.lower() == 'fairshare':
+        return FairSharePolicy(parse_project_values(weights, float),
+                               parse_project_values(slots, int),
+                               priorities, age_boost_hours)
+    else:
+        LOGGER.warn('unknown launch policy %s (%s), using fifo.'
+                    % (name, ', '.join(LAUNCH_POLICIES)))
+        return FifoPolicy()
+
+
+def parse_project_values(values, vtype):
+    """
+    Parse the per-project values of the settings
+
+    :param values: dictionary or string "PROJ1:2,PROJ2:1"
+    :param vtype: type of the values (int or float)
+    :return: dictionary project: value
+    """
+    if not values:
+        return dict()
+    if isinstance(values, basestring):
+        values = dict(item.split(':', 1) for item in values.split(',')
+                      if ':' in item)
+    return dict((str(project).strip(), vtype(value))
+                for project, value in list(values.items()))
+
+
+def get_task_project(cur_task):
+    """ Get the project of a task from its assessor label """
+    return cur_task.assessor_label.split('-x-')[0]
+
+
+def get_task_proctype(cur_task):
+    """ Get the proctype of a task from its assessor label """
+    return cur_task.assessor_label.split('-x-')[-1]
+
+
+def get_waiting_hours(task_list, ages_file):
+    """
+    Get the hours since each task was first found by dax launch
+
+    The first time each assessor label is found is kept in ages_file. The
+     labels not found anymore (launched or removed) are dropped.
+
+    :param task_list: list of tasks found
+    :param ages_file: JSON file (no age if None)
+    :return: dictionary assessor label: hours waiting
+    """
+    if not ages_file:
+        return dict()
+
+    first_found = dict()
+    if os.path.isfile(ages_file):
+        try:
+            with open(ages_file, 'r') as f_obj:
+                first_found = json.load(f_obj)
+        except ValueError:
+            LOGGER.warn('cannot read %s, ages reset' % ages_file)
+
+    now = time.time()
+    ages = dict((cur_task.assessor_label,
+                 first_found.get(cur_task.assessor_label, now))
+                for cur_task in task_list)
+    with open(ages_file, 'w') as f_obj:
+        json.dump(ages, f_obj)
+
+    return dict((label, (now - found) / 3600.0)
+                for label, found in list(ages.items()))
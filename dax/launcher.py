@@ -9,14 +9,20 @@ from builtins import object
 from past.builtins import basestring
 
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
+import copy
 import logging
 import redcap
 import sys
 import os
+import threading
+import time
 import traceback
 
-from . import processors, modules, XnatUtils, task, cluster
-from .task import Task, ClusterTask, XnatTask
+from . import processors, modules, XnatUtils, task, cluster, project_index
+from . import build_planner, diskq_store, job_depends, launch_policy
+from . import queue_layout, queue_watch
+from .task import Task, ClusterTask, XnatTask, ListedTask
 from .dax_settings import DAX_Settings, DAX_Netrc
 from .errors import (ClusterCountJobsException, ClusterLaunchException,
                      DaxXnatError, DaxLauncherError)
@@ -35,8 +41,15 @@ UPDATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 BUILD_SUFFIX = 'BUILD_RUNNING.txt'
 UPDATE_SUFFIX = 'UPDATE_RUNNING.txt'
 LAUNCH_SUFFIX = 'LAUNCHER_RUNNING.txt'
+# Number of tasks submitted per round and per launch worker
+LAUNCH_ROUND_FACTOR = 4
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
+# Per-thread state of the build workers (interface, processors, logs)
+_BUILD_LOCAL = threading.local()
+# Per-thread interface of the launch workers
+_LAUNCH_LOCAL = threading.local()
+_LAUNCH_LOCK = threading.Lock()
 
 
 def str_to_timedelta(delta_str):
@@ -56,6 +69,21 @@ def str_to_timedelta(delta_str):
         raise ValueError('invalid timedelta string value')
 
 
+class _SessionLogBuffer(logging.Filter):
+    """
+    Filter holding back the log records emitted by a build worker thread.
+
+    The records are stored on the worker until its session is built and then
+     handled again by the main thread so each session logs in one block.
+    """
+    def filter(self, record):
+        records = getattr(_BUILD_LOCAL, 'records', None)
+        if records is None:
+            return True
+        records.append(record)
+        return False
+
+
 def check_dir(dir_path):
     try:
         os.makedirs(dir_path)
@@ -76,7 +104,9 @@ class Launcher(object):
                  xnat_user=None, xnat_pass=None, xnat_host=None, cr=None,
                  job_email=None, job_email_options='bae', max_age=7,
                  launcher_type=DAX_SETTINGS.get_launcher_type(),
-                 skip_lastupdate=None):
+                 skip_lastupdate=None, launch_order=None,
+                 project_weights=None, project_slots=None,
+                 age_boost_hours=24, job_depends=False):
 
         """
         Entry point for the Launcher class
@@ -93,10 +123,21 @@ class Launcher(object):
         :param job_email: job email address for report
         :param job_email_options: email options for the jobs
         :param max_age: maximum time before updating again a session
+        :param launch_order: policy ordering the tasks to launch, 'fifo'
+         (default) or 'fairshare' (see launch_policy.py)
+        :param project_weights: weight of each project for 'fairshare',
+         dictionary or string "PROJ1:2,PROJ2:1"
+        :param project_slots: maximum number of jobs on the cluster for each
+         project for 'fairshare', dictionary or string "PROJ1:50,PROJ2:10"
+        :param age_boost_hours: hours of waiting adding one to the priority
+         of a task for 'fairshare'
+        :param job_depends: also launch the assessors waiting for input
+         assessors with a running job, after those jobs (see job_depends.py)
         :return: None
         """
         self.queue_limit = queue_limit
         self.root_job_dir = root_job_dir
+        self.module_lock = threading.RLock()
 
         # Processors:
         if not isinstance(project_process_dict, dict):
@@ -135,6 +176,16 @@ name as a key and list of yaml filepaths as values.'
                 else:
                     self.project_process_dict[project].append(proc)
 
+        # Policy ordering the tasks to launch
+        priorities = dict(
+            (proc.name, getattr(proc, 'priority', 0))
+            for procs in list(self.project_process_dict.values())
+            for proc in procs)
+        self.launch_policy = launch_policy.get_launch_policy(
+            launch_order, project_weights, project_slots, priorities,
+            age_boost_hours)
+        self.job_depends = job_depends
+
         if isinstance(priority_project, list):
             self.priority_project = priority_project
         elif isinstance(priority_project, basestring):
@@ -193,7 +244,8 @@ name as a key and list of yaml filepaths as values.'
 
     # LAUNCH Main Method
     def launch_jobs(self, lockfile_prefix, project_local, sessions_local,
-                    writeonly=False, pbsdir=None, force_no_qsub=False):
+                    writeonly=False, pbsdir=None, force_no_qsub=False,
+                    array=False, workers=1):
         """
         Main Method to launch the tasks
 
@@ -204,6 +256,8 @@ name as a key and list of yaml filepaths as values.'
         :param writeonly: write the job files without submitting them
         :param pbsdir: folder to store the pbs file
         :param force_no_qsub: run the job locally on the computer (serial mode)
+        :param array: launch the tasks as job arrays
+        :param workers: number of jobs submitted at the same time
         :return: None
 
         """
@@ -223,15 +277,8 @@ name as a key and list of yaml filepaths as values.'
                                         type_update=3, start_end=1)
 
         if self.launcher_type in ['diskq-cluster', 'diskq-combined']:
-            msg = 'Loading task queue from: %s'
-            LOGGER.info(msg % os.path.join(res_dir, 'DISKQ'))
-            task_list = load_task_queue(
-                status=task.NEED_TO_RUN,
-                proj_filter=list(set(self.project_process_dict.keys()+self.project_modules_dict.keys())))
-
-            msg = '%s tasks that need to be launched found'
-            LOGGER.info(msg % str(len(task_list)))
-            self.launch_tasks(task_list, force_no_qsub=force_no_qsub)
+            self.launch_task_queue(project_list, lockfile_prefix,
+                                   force_no_qsub, array, workers)
         else:
             LOGGER.info('Connecting to XNAT at %s' % self.xnat_host)
             with XnatUtils.get_interface(self.xnat_host, self.xnat_user,
@@ -249,13 +296,113 @@ name as a key and list of yaml filepaths as values.'
 
                 msg = '%s tasks that need to be launched found'
                 LOGGER.info(msg % str(len(task_list)))
+                task_list = self.order_tasks(
+                    task_list,
+                    lambda: self.count_running_xnat(xnat, project_list,
+                                                    sessions_local),
+                    lockfile_prefix)
 
                 # Launch the task that need to be launch
                 self.launch_tasks(task_list, writeonly, pbsdir,
-                                  force_no_qsub=force_no_qsub)
+                                  force_no_qsub=force_no_qsub, array=array,
+                                  workers=workers)
+
+                if self.use_job_depends(writeonly, force_no_qsub):
+                    self.launch_dependent_tasks(xnat, project_list,
+                                                sessions_local, workers)
 
         self.finish_script(flagfile, project_list, 3, 2, project_local)
 
+    def launch_task_queue(self, project_list, lockfile_prefix,
+                          force_no_qsub=False, array=False, workers=1):
+        """
+        Launch the tasks of the DiskQ that need to run
+
+        :param project_list: list of projects
+        :param lockfile_prefix: prefix for the file keeping the tasks ages
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :param array: launch the tasks as job arrays
+        :param workers: number of jobs submitted at the same time
+        :return: None
+        """
+        msg = 'Loading task queue from: %s'
+        LOGGER.info(msg % os.path.join(DAX_SETTINGS.get_results_dir(),
+                                       'DISKQ'))
+        task_list = load_task_queue(status=task.NEED_TO_RUN,
+                                    proj_filter=project_list)
+
+        msg = '%s tasks that need to be launched found'
+        LOGGER.info(msg % str(len(task_list)))
+        task_list = self.order_tasks(
+            task_list, lambda: self.count_running_diskq(), lockfile_prefix)
+        self.launch_tasks(task_list, force_no_qsub=force_no_qsub,
+                          array=array, workers=workers)
+
+    def watch_jobs(self, lockfile_prefix, project_local, force_no_qsub=False,
+                   workers=1, poll=False, interval=5):
+        """
+        Launch the tasks of the DiskQ as soon as they are written
+
+        Runs until killed. The DiskQ is loaded and the tasks launched again
+         each time the batch files or the status of the tasks change (new
+         task ready or job finished, see queue_watch.py) and every
+         queue_resync_seconds to check the number of jobs on the cluster.
+
+        :param lockfile_prefix: prefix for flag file to lock the launcher
+        :param project_local: project to run locally
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :param workers: number of jobs submitted at the same time
+        :param poll: poll the DiskQ folders instead of using inotify
+        :param interval: seconds between two checks when polling
+        :return: None
+        """
+        if self.launcher_type not in ['diskq-cluster', 'diskq-combined']:
+            err = 'cannot watch the DiskQ with this launcher type: %s'
+            raise DaxLauncherError(err % self.launcher_type)
+
+        LOGGER.info('-------------- Watch Tasks --------------\n')
+        LOGGER.info('launcher_type = %s' % self.launcher_type)
+
+        res_dir = DAX_SETTINGS.get_results_dir()
+        diskq_dir = os.path.join(res_dir, 'DISKQ')
+        flagfile = os.path.join(os.path.join(res_dir, 'FlagFiles'),
+                                '%s_%s' % (lockfile_prefix, LAUNCH_SUFFIX))
+        project_list = self.init_script(flagfile, project_local,
+                                        type_update=3, start_end=1)
+
+        # New batch files, and the tasks changing status (new task ready
+        # or job finished) in the store or the status index
+        roots = [os.path.join(diskq_dir, 'BATCH')]
+        store = diskq_store.get_diskq_store()
+        if store is not None:
+            roots.append(store.db_path)
+        else:
+            for status in [task.NEED_TO_RUN, task.JOB_RUNNING]:
+                status_dir = os.path.join(diskq_dir, task.STATUS_DIRNAME,
+                                          status)
+                check_dir(status_dir)
+                roots.append(status_dir)
+        watcher = queue_watch.get_watcher(roots, interval, poll)
+        LOGGER.info('watching %s with %s'
+                    % (', '.join(roots), watcher.__class__.__name__))
+
+        resync_seconds = DAX_SETTINGS.get_queue_resync_seconds()
+        try:
+            while True:
+                try:
+                    self.launch_task_queue(project_list, lockfile_prefix,
+                                           force_no_qsub, workers=workers)
+                except (ClusterCountJobsException,
+                        ClusterLaunchException):
+                    LOGGER.error('failed to launch the tasks, trying again \
+at the next change.')
+                if not watcher.wait(resync_seconds):
+                    LOGGER.debug('no change in %s seconds'
+                                 % str(resync_seconds))
+        finally:
+            watcher.close()
+            self.finish_script(flagfile, project_list, 3, 2, project_local)
+
     @staticmethod
     def is_launchable_tasks(assr_info):
         """
@@ -267,19 +414,68 @@ name as a key and list of yaml filepaths as values.'
         return assr_info['procstatus'] == task.NEED_TO_RUN
 
     def launch_tasks(self, task_list, writeonly=False, pbsdir=None,
-                     force_no_qsub=False):
+                     force_no_qsub=False, array=False, workers=1):
         """
         Launch tasks from the passed list until the queue is full or
          the list is empty
 
+        The number of jobs in the queue is counted locally after each
+         submission and counted again on the cluster every queue_resync_jobs
+         submissions or queue_resync_seconds seconds.
+
+        The job files are written by the main thread. With more than one
+         worker, the submissions (qsub/sbatch) of a round of tasks run at
+         the same time and each job is set on its tasks by the worker as
+         soon as its submission returns (see submit_launches).
+
+        :param task_list: list of task to launch
+        :param writeonly: write the job files without submitting them
+        :param pbsdir: folder to store the pbs file
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :param array: launch the tasks with the same processor, walltime,
+         memory and ppn as job arrays (see task.launch_array)
+        :param workers: number of submissions running at the same time
+        :return: None
+        """
+        # One pool (and one XNAT interface per worker) for all the rounds
+        pool = None
+        interfaces = list()
+        if workers > 1 and not writeonly and not force_no_qsub:
+            pool = ThreadPool(workers)
+        try:
+            self.launch_rounds(task_list, writeonly, pbsdir, force_no_qsub,
+                               array, workers, pool, interfaces)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            for intf in interfaces:
+                try:
+                    intf.disconnect()
+                except Exception as E:
+                    LOGGER.warn('failed to disconnect worker interface: %s'
+                                % str(E))
+
+    def launch_rounds(self, task_list, writeonly=False, pbsdir=None,
+                      force_no_qsub=False, array=False, workers=1, pool=None,
+                      interfaces=None):
+        """
+        Launch the tasks by rounds of submissions (see launch_tasks)
+
         :param task_list: list of task to launch
         :param writeonly: write the job files without submitting them
         :param pbsdir: folder to store the pbs file
         :param force_no_qsub: run the job locally on the computer (serial mode)
+        :param array: launch the tasks as job arrays
+        :param workers: number of submissions running at the same time
+        :param pool: ThreadPool of the workers (main thread if None)
+        :param interfaces: list of the interfaces opened by the workers
         :return: None
         """
+        cjobs = 0
         if force_no_qsub:
             LOGGER.info('No qsub - Running job locally on your computer.')
+            workers = 1
         else:
             # Check number of jobs on cluster
             cjobs = cluster.count_jobs()
@@ -290,56 +486,394 @@ name as a key and list of yaml filepaths as values.'
             if cluster.command_found(cmd=DAX_SETTINGS.get_cmd_submit()):
                 LOGGER.info('%s jobs currently in queue' % str(cjobs))
 
+        resync_jobs = DAX_SETTINGS.get_queue_resync_jobs()
+        resync_seconds = DAX_SETTINGS.get_queue_resync_seconds()
+        nb_submitted = 0
+        last_sync = time.time()
+        use_array = self.use_job_array(array, writeonly, force_no_qsub)
+        max_array_size = DAX_SETTINGS.get_max_array_size()
+        round_size = 1 if workers <= 1 else workers * LAUNCH_ROUND_FACTOR
+
         # Launch until we reach cluster limit or no jobs left to launch
         while (cjobs < self.queue_limit or writeonly) and len(task_list) > 0:
-            cur_task = task_list.pop()
-
-            # Confirm task is still ready to run
-            # I don't think that we need to make this get here.
-            # We've already filtered the assessors as need to run.
-            # if cur_task.get_status() != task.NEED_TO_RUN:
-            #     continue
-
-            if writeonly:
-                msg = "  +Writing PBS file for job:%s, currently %s jobs in \
-cluster queue"
-                LOGGER.info(msg % (cur_task.assessor_label,
-                                   str(cjobs)))
-            else:
-                msg = '  +Launching job:%s, currently %s jobs in cluster queue'
-                LOGGER.info(msg % (cur_task.assessor_label, str(cjobs)))
-
-            try:
-                if self.launcher_type in ['diskq-cluster',
-                                          'diskq-combined']:
-                    success = cur_task.launch(force_no_qsub=force_no_qsub)
+            launches = list()
+            nb_jobs = 0
+            while len(task_list) > 0 and len(launches) < round_size and \
+                    (cjobs + nb_jobs < self.queue_limit or writeonly):
+                cur_task = task_list.pop()
+                if not self.launch_policy.reserve(cur_task):
+                    continue
+                array_tasks = list()
+                if use_array:
+                    max_size = min(self.queue_limit - cjobs - nb_jobs,
+                                   max_array_size)
+                    array_tasks = pop_array_tasks(
+                        task_list, cur_task, max_size - 1,
+                        accept=self.launch_policy.reserve)
+
+                # Confirm task is still ready to run
+                # I don't think that we need to make this get here.
+                # We've already filtered the assessors as need to run.
+                # if cur_task.get_status() != task.NEED_TO_RUN:
+                #     continue
+
+                if writeonly:
+                    msg = "  +Writing PBS file for job:%s, currently %s jobs \
+in cluster queue"
+                    LOGGER.info(msg % (cur_task.assessor_label,
+                                       str(cjobs + nb_jobs)))
+                elif array_tasks:
+                    msg = '  +Launching job array of %s jobs:%s, currently %s \
+jobs in cluster queue'
+                    LOGGER.info(msg % (str(len(array_tasks) + 1),
+                                       cur_task.assessor_label,
+                                       str(cjobs + nb_jobs)))
                 else:
-                    success = cur_task.launch(self.root_job_dir,
-                                              self.job_email,
-                                              self.job_email_options,
-                                              self.xnat_host,
-                                              writeonly, pbsdir,
-                                              force_no_qsub=force_no_qsub)
-            except Exception as E:
+                    msg = '  +Launching job:%s, currently %s jobs in cluster \
+queue'
+                    LOGGER.info(msg % (cur_task.assessor_label,
+                                       str(cjobs + nb_jobs)))
+
+                launch = self.prepare_launch(cur_task, array_tasks, writeonly,
+                                             pbsdir, force_no_qsub)
+                if launch is not None:
+                    launches.append(launch)
+                nb_jobs += 1 + len(array_tasks)
+
+            self.submit_launches(launches, pool, interfaces)
+
+            if writeonly or force_no_qsub:
+                continue
+
+            cjobs += nb_jobs
+            nb_submitted += nb_jobs
+            if nb_submitted >= resync_jobs or \
+               time.time() - last_sync >= resync_seconds:
+                cjobs = cluster.count_jobs()
+                nb_submitted = 0
+                last_sync = time.time()
+
+                if cjobs == -1:
+                    LOGGER.error('ERROR: cannot get count of jobs from cluster')
+                    raise ClusterCountJobsException
+
+    def order_tasks(self, task_list, count_running, lockfile_prefix):
+        """
+        Order the tasks to launch with the launch policy
+
+        :param task_list: list of tasks found
+        :param count_running: function returning the number of jobs on the
+         cluster for each project (only called if the policy needs it)
+        :param lockfile_prefix: prefix for the file keeping the tasks ages
+        :return: list of tasks, the next task to launch at the end
+        """
+        running = None
+        if self.launch_policy.needs_running:
+            running = count_running()
+        ages_file = os.path.join(DAX_SETTINGS.get_results_dir(), 'FlagFiles',
+                                 '%s_launch_ages.json' % lockfile_prefix)
+        ordered = self.launch_policy.order(task_list, running, ages_file)
+        return list(reversed(ordered))
+
+    def count_running_xnat(self, xnat, project_list, sessions_local=None):
+        """
+        Count the jobs running on the cluster for each project from XNAT
+
+        :param xnat: pyxnat.Interface object
+        :param project_list: list of projects
+        :param sessions_local: list of sessions to count
+        :return: dictionary project: number of assessors JOB_RUNNING
+        """
+        running = dict()
+        for project_id in project_list:
+            assr_list = self.get_assessors_list(xnat, project_id,
+                                                sessions_local)
+            running[project_id] = len([
+                assr for assr in assr_list
+                if assr['procstatus'] == task.JOB_RUNNING])
+        return running
+
+    def count_running_diskq(self):
+        """
+        Count the jobs running on the cluster for each project from DiskQ
+
+        :return: dictionary project: number of tasks JOB_RUNNING
+        """
+        running = dict()
+        for cur_task in load_task_queue(
+                status=task.JOB_RUNNING,
+                proj_filter=list(self.project_process_dict.keys())):
+            project = launch_policy.get_task_project(cur_task)
+            running[project] = running.get(project, 0) + 1
+        return running
+
+    def prepare_launch(self, cur_task, array_tasks, writeonly=False,
+                       pbsdir=None, force_no_qsub=False):
+        """
+        Write the job file(s) of a task before its submission
+
+        :param cur_task: task to launch
+        :param array_tasks: other tasks to launch in the job array of the task
+        :param writeonly: write the job files without submitting them
+        :param pbsdir: folder to store the pbs file
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :raises: ClusterLaunchException if the job file can not be written
+        :return: (label, submit, finish, tasks) where submit() submits the
+                 job and finish(result of submit) sets the job on the
+                 task(s) in tasks, None if the job is not submitted
+                 (writeonly)
+        """
+        try:
+            if array_tasks:
+                tasks = [cur_task] + array_tasks
+                pbs_array = task.write_array(tasks, self.root_job_dir,
+                                             self.job_email,
+                                             self.job_email_options,
+                                             self.xnat_host)
+                return (cur_task.assessor_label, pbs_array.submit,
+                        lambda jobids: task.finish_array(tasks, jobids),
+                        tasks)
+            elif self.launcher_type in ['diskq-cluster', 'diskq-combined']:
+                return (cur_task.assessor_label,
+                        lambda: cur_task.submit(force_no_qsub),
+                        lambda result: cur_task.finish_launch(
+                            result[0], result[1], force_no_qsub),
+                        [cur_task])
+
+            pbs = cur_task.write_pbs(self.root_job_dir, self.job_email,
+                                     self.job_email_options, self.xnat_host,
+                                     writeonly, pbsdir)
+        except Exception as E:
+            LOGGER.critical('Caught exception launching job %s'
+                            % cur_task.assessor_label)
+            LOGGER.critical('Exception class %s caught with message %s'
+                            % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+            LOGGER.error('ERROR: failed to launch job')
+            raise ClusterLaunchException
+
+        if writeonly:
+            mes_format = """   filepath: {path}"""
+            LOGGER.info(mes_format.format(path=pbs.filename))
+            return None
+        if cur_task.depends:
+            return (cur_task.assessor_label,
+                    lambda: pbs.submit(outlog=pbs.outfile,
+                                       depends=list(
+                                           cur_task.depends.values())),
+                    lambda result: finish_dependent_launch(cur_task, result),
+                    [cur_task])
+        return (cur_task.assessor_label,
+                lambda: pbs.submit(outlog=pbs.outfile,
+                                   force_no_qsub=force_no_qsub),
+                lambda result: cur_task.finish_launch(
+                    result[0], result[1], force_no_qsub),
+                [cur_task])
+
+    def submit_launches(self, launches, pool=None, interfaces=None):
+        """
+        Submit the jobs prepared by prepare_launch and set them on the tasks
+
+        With a pool, each job is submitted and set on its tasks (XNAT or
+         DiskQ) by a thread of the pool: the XNAT writes of set_launch are
+         sent at the same time, each worker with its own interface (see
+         finish_launch_worker).
+
+        :param launches: list of (label, submit, finish, tasks)
+        :param pool: ThreadPool of the workers (main thread if None)
+        :param interfaces: list of the interfaces opened by the workers
+        :raises: ClusterLaunchException if a job failed to launch, once all
+                 the other jobs are set on their task
+        :return: None
+        """
+        if not launches:
+            return
+
+        def _worker(launch):
+            """Submit a job and set it on its tasks in a worker thread."""
+            launch, result, error = submit_launch(launch)
+            if error is None:
+                try:
+                    self.finish_launch_worker(launch, result, interfaces)
+                except Exception:
+                    error = traceback.format_exc()
+            return launch, error
+
+        if pool is not None and len(launches) > 1:
+            results = pool.imap_unordered(_worker, launches)
+        else:
+            results = (finish_launch(launch) for launch in launches)
+
+        failed = False
+        for launch, error in results:
+            if error is not None:
                 LOGGER.critical('Caught exception launching job %s'
-                                % cur_task.assessor_label)
-                LOGGER.critical('Exception class %s caught with message %s'
-                                % (E.__class__, E.message))
-                LOGGER.critical(traceback.format_exc())
+                                % launch[0])
+                LOGGER.critical(error)
+                failed = True
 
-                success = False
+        if pool is not None and len(launches) > 1:
+            # Written by the workers: the listings cached by the interface
+            # of the tasks do not have the jobs launched
+            invalidate_launches(launches)
 
-            if not success:
-                LOGGER.error('ERROR: failed to launch job')
-                raise ClusterLaunchException
+        if failed:
+            LOGGER.error('ERROR: failed to launch job')
+            raise ClusterLaunchException
 
-            cjobs = cluster.count_jobs()
+    def finish_launch_worker(self, launch, result, interfaces):
+        """
+        Set a submitted job on its tasks with the interface of the thread
 
-            if cjobs == -1:
-                LOGGER.error('ERROR: cannot get count of jobs from cluster')
-                raise ClusterCountJobsException
+        The XNAT assessors of the tasks are selected again on the interface
+         of the worker while the job is set, the interface of the tasks is
+         not shared between threads.
+
+        :param launch: (label, submit, finish, tasks)
+        :param result: result of submit
+        :param interfaces: list of the interfaces opened by the workers
+        :return: None
+        """
+        xnat_tasks = [cur_task for cur_task in launch[3]
+                      if cur_task.assessor is not None]
+        if not xnat_tasks:
+            launch[2](result)
+            return
+
+        if getattr(_LAUNCH_LOCAL, 'xnat', None) is None:
+            _LAUNCH_LOCAL.xnat = XnatUtils.get_interface(
+                self.xnat_host, self.xnat_user, self.xnat_pass)
+            with _LAUNCH_LOCK:
+                interfaces.append(_LAUNCH_LOCAL.xnat)
+
+        assessors = [cur_task.assessor for cur_task in xnat_tasks]
+        try:
+            for cur_task in xnat_tasks:
+                cur_task.assessor = _LAUNCH_LOCAL.xnat.select(
+                    cur_task.assessor._uri)
+            launch[2](result)
+        finally:
+            for cur_task, assessor in zip(xnat_tasks, assessors):
+                cur_task.assessor = assessor
+
+    def use_job_array(self, array, writeonly=False, force_no_qsub=False):
+        """
+        Check if the tasks can be launched as job arrays
+
+        :param array: job arrays requested by the user
+        :param writeonly: write the job files without submitting them
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :return: True if job arrays are used, False otherwise
+        """
+        if not array or writeonly or force_no_qsub:
+            return False
+        if self.launcher_type in ['diskq-cluster', 'diskq-combined']:
+            LOGGER.warn('job arrays are not available for the launcher type \
+%s, launching one job per task.' % self.launcher_type)
+            return False
+        if not DAX_SETTINGS.get_job_array_template():
+            LOGGER.warn('job_array_template not set in the cluster settings, \
+launching one job per task.')
+            return False
+        return cluster.command_found(cmd=DAX_SETTINGS.get_cmd_submit())
 
     # UPDATE Main Method
+    def use_job_depends(self, writeonly=False, force_no_qsub=False):
+        """
+        Check if the assessors waiting for running jobs can be launched
+
+        :param writeonly: write the job files without submitting them
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :return: True if the dependent tasks are launched, False otherwise
+        """
+        if not self.job_depends or writeonly or force_no_qsub:
+            return False
+        if not DAX_SETTINGS.get_job_depend_option():
+            LOGGER.warn('job_depend_option not set in the cluster settings, \
+not launching the tasks waiting for running jobs.')
+            return False
+        return True
+
+    def launch_dependent_tasks(self, xnat, project_list, sessions_local=None,
+                               workers=1):
+        """
+        Launch the assessors waiting for input assessors with a running job
+
+        The jobs wait on the cluster for the jobs of their inputs (afterok)
+         and read the outputs of their inputs from RESULTS_DIR. Each pass
+         launches one more stage of the pipelines, until no task is found or
+         the queue is full.
+
+        :param xnat: pyxnat.Interface object
+        :param project_list: list of projects
+        :param sessions_local: list of sessions to launch tasks
+        :param workers: number of jobs submitted at the same time
+        :return: None
+        """
+        nb_procs = max([len(procs) for procs in
+                        list(self.project_process_dict.values())] + [0])
+        for _ in range(nb_procs):
+            task_list = list()
+            for project_id in project_list:
+                task_list.extend(self.get_dependent_tasks(
+                    xnat, project_id, sessions_local))
+            if not task_list:
+                return
+
+            msg = '%s tasks waiting for running jobs found'
+            LOGGER.info(msg % str(len(task_list)))
+            self.launch_tasks(task_list, workers=workers)
+            if task_list:
+                # Queue full
+                return
+
+    def get_dependent_tasks(self, xnat, project_id, sessions_local=None):
+        """
+        Get the tasks of a project that can be launched after running jobs
+
+        :param xnat: pyxnat.Interface object
+        :param project_id: project ID on XNAT
+        :param sessions_local: list of sessions to launch tasks
+        :return: list of tasks with the jobs to wait for in depends
+        """
+        task_list = list()
+        pp_dict = self.project_process_dict.get(project_id, None)
+        if not pp_dict:
+            return task_list
+        sess_procs, scan_procs = processors.processors_by_type(pp_dict)
+        assr_list = self.get_assessors_list(xnat, project_id, sessions_local)
+
+        csess_dict = dict()
+        for assr_info, upstream in job_depends.find_dependent_assessors(
+                assr_list, pp_dict):
+            proc = self.match_proc(assr_info, sess_procs, scan_procs)
+            if proc is None:
+                continue
+
+            sess_key = (assr_info['subject_label'], assr_info['session_label'])
+            if sess_key not in csess_dict:
+                csess_dict[sess_key] = XnatUtils.CachedImageSession(
+                    xnat, project_id, sess_key[0], sess_key[1])
+            cobj = csess_dict[sess_key]
+            if proc.type == 'scan':
+                cobj = cobj.get_scan(assr_info['assessor_label']
+                                     .split('-x-')[3])
+                if cobj is None:
+                    continue
+
+            has_inputs, _ = proc.has_inputs(cobj, pending=list(upstream))
+            if has_inputs != 1:
+                continue
+
+            cur_task = self.generate_task(xnat, assr_info, sess_procs,
+                                          scan_procs)
+            cur_task.depends = upstream
+            LOGGER.debug('%s waiting for %s' % (cur_task.assessor_label,
+                                                ', '.join(upstream)))
+            task_list.append(cur_task)
+
+        return task_list
+
     def update_tasks(self, lockfile_prefix, project_local, sessions_local):
         """
         Main method to Update the tasks
@@ -373,6 +907,12 @@ cluster queue"
 
             LOGGER.info('%s tasks found.' % str(len(task_list)))
 
+            jobs_to_trace = get_finished_jobs(task_list)
+            if jobs_to_trace:
+                LOGGER.info('Getting the usage of %s finished jobs...'
+                            % str(len(jobs_to_trace)))
+                cluster.prefetch_jobs_usage(jobs_to_trace)
+
             LOGGER.info('Updating tasks...')
             for cur_task in task_list:
                 LOGGER.info('Updating task: %s' % cur_task.assessor_label)
@@ -390,7 +930,9 @@ cluster queue"
                 task_list = self.get_tasks(xnat,
                                            self.is_updatable_tasks,
                                            project_list,
-                                           sessions_local)
+                                           sessions_local,
+                                           trace_jobs=True,
+                                           listed=True)
 
                 LOGGER.info('%s open tasks found' % str(len(task_list)))
                 LOGGER.info('Updating tasks...')
@@ -416,7 +958,7 @@ cluster queue"
 
     # BUILD Main Method
     def build(self, lockfile_prefix, project_local, sessions_local,
-              mod_delta=None, proj_lastrun=None):
+              mod_delta=None, proj_lastrun=None, workers=1, plan=False):
         """
         Main method to build the tasks and the sessions
 
@@ -424,6 +966,8 @@ cluster queue"
         :param project_local: project to run locally
         :param sessions_local: list of sessions to launch tasks
          associated to the project locally
+        :param workers: number of sessions to build at the same time
+        :param plan: only build the sessions selected by the build planner
         :return: None
 
         """
@@ -434,6 +978,8 @@ cluster queue"
         LOGGER.info('-------------- Build --------------\n')
         LOGGER.info('launcher_type = %s' % self.launcher_type)
         LOGGER.info('mod delta = %s' % str(mod_delta))
+        LOGGER.info('workers = %s' % str(workers))
+        LOGGER.info('plan = %s' % str(plan))
 
         res_dir = DAX_SETTINGS.get_results_dir()
         flagfile = os.path.join(os.path.join(res_dir, 'FlagFiles'),
@@ -468,7 +1014,8 @@ cluster queue"
 
                     self.build_project(xnat, project_id, lockfile_prefix,
                                        sessions_local,
-                                       mod_delta=mod_delta, lastrun=lastrun)
+                                       mod_delta=mod_delta, lastrun=lastrun,
+                                       workers=workers, plan=plan)
                 except Exception as E:
                     err1 = 'Caught exception building project %s'
                     err2 = 'Exception class %s caught with message %s'
@@ -479,7 +1026,7 @@ cluster queue"
         self.finish_script(flagfile, project_list, 1, 2, project_local)
 
     def build_project(self, xnat, project_id, lockfile_prefix, sessions_local,
-                      mod_delta=None, lastrun=None):
+                      mod_delta=None, lastrun=None, workers=1, plan=False):
         """
         Build the project
 
@@ -487,6 +1034,8 @@ cluster queue"
         :param project_id: project ID on XNAT
         :param lockfile_prefix: prefix for flag file to lock the launcher
         :param sessions_local: list of sessions to launch tasks
+        :param workers: number of sessions to build at the same time
+        :param plan: only build the sessions selected by the build planner
         :return: None
         """
         # Modules prerun
@@ -516,82 +1065,247 @@ cluster queue"
 
         # Get the list of sessions:
         sessions = self.get_sessions_list(xnat, project_id, sessions_local)
+        if plan:
+            sessions = self.plan_sessions(xnat, project_id, sessions,
+                                          exp_procs + scan_procs,
+                                          exp_mods + scan_mods)
 
         # Update each session from the list:
-        for sess_info in sessions:
-            if not self.skip_lastupdate and not has_new and not sessions_local:
-                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                             UPDATE_FORMAT)
-                now_date = datetime.today()
-                last_up = self.get_lastupdated(sess_info)
-                if last_up is not None and \
-                   last_mod < last_up and \
-                   now_date < last_mod + timedelta(days=int(self.max_age)):
-                    mess = "  + Session %s: skipping, last_mod=%s,last_up=%s"
-                    mess_str = mess % (sess_info['label'], str(last_mod),
-                                       str(last_up))
-                    LOGGER.info(mess_str)
-                    continue
-
-            elif lastrun:
-                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                             UPDATE_FORMAT)
-                if last_mod < lastrun:
-                    mess = "  + Session %s:skipping not modified since last run,\
- last_mod=%s, last_run=%s"
-                    LOGGER.info(mess % (sess_info['label'], str(last_mod),
-                                        str(lastrun)))
-                    continue
-
-            elif lastmod_delta:
-                last_mod = datetime.strptime(sess_info['last_modified'][0:19],
-                                             UPDATE_FORMAT)
-                now_date = datetime.today()
-                if now_date > last_mod + lastmod_delta:
-                    mess = "  + Session %s:skipping not modified within delta,\
- last_mod=%s"
-                    LOGGER.info(mess % (sess_info['label'], str(last_mod)))
+        if workers > 1:
+            sessions = [sess_info for sess_info in sessions
+                        if not self.skip_session(sess_info, has_new,
+                                                 sessions_local, lastrun,
+                                                 lastmod_delta)]
+            self.build_sessions_parallel(sessions, workers, exp_procs,
+                                         scan_procs, exp_mods, scan_mods)
+        else:
+            for sess_info in sessions:
+                if self.skip_session(sess_info, has_new, sessions_local,
+                                     lastrun, lastmod_delta):
                     continue
-                else:
-                    LOGGER.info('lastmod = %s' % str(last_mod))
 
-            mess = "  + Session %s: building..."
-            LOGGER.info(mess % sess_info['label'])
-
-            if not self.skip_lastupdate:
-                update_start_time = datetime.now()
+                self.build_and_stamp_session(xnat, sess_info, exp_procs,
+                                             scan_procs, exp_mods, scan_mods)
 
+        if not sessions_local or sessions_local.lower() == 'all':
+            # Modules after run
+            LOGGER.debug('* Modules Afterrun')
             try:
-                self.build_session(xnat, sess_info, exp_procs, scan_procs,
-                                   exp_mods, scan_mods)
+                self.module_afterrun(xnat, project_id)
             except Exception as E:
-                err1 = 'Caught exception building sessions %s'
                 err2 = 'Exception class %s caught with message %s'
-                LOGGER.critical(err1 % sess_info['session_label'])
+                LOGGER.critical('Caught exception after running modules')
                 LOGGER.critical(err2 % (E.__class__, E.message))
                 LOGGER.critical(traceback.format_exc())
 
-            try:
-                if not self.skip_lastupdate:
-                    self.set_session_lastupdated(xnat, self.cr, sess_info,
-                                                 update_start_time)
-            except Exception as E:
-                err1 = 'Caught exception setting session timestamp %s'
-                err2 = 'Exception class %s caught with message %s'
-                LOGGER.critical(err1 % sess_info['session_label'])
-                LOGGER.critical(err2 % (E.__class__, E.message))
-                LOGGER.critical(traceback.format_exc())
+    def plan_sessions(self, xnat, project_id, sessions, proc_list, mod_list):
+        """
+        Keep the sessions where the processors create or change an assessor
 
-        if not sessions_local or sessions_local.lower() == 'all':
-            # Modules after run
-            LOGGER.debug('* Modules Afterrun')
+        The inputs are resolved from the project listings by the build
+         planner (see build_planner.py) instead of the XML of each session.
+
+        :param xnat: pyxnat.Interface object
+        :param project_id: project ID on XNAT
+        :param sessions: list of sessions (XnatUtils.list_sessions)
+        :param proc_list: list of processors for the project
+        :param mod_list: list of modules for the project
+        :return: list of sessions to build
+        """
+        if mod_list:
+            LOGGER.info('  * Build plan skipped: modules run on all sessions')
+            return sessions
+
+        try:
+            planner = build_planner.BuildPlanner(
+                project_id, sessions,
+                project_index.list_project_scans(xnat, project_id),
+                project_index.list_project_assessors(xnat, project_id))
+            session_ids = planner.sessions_to_build(proc_list,
+                                                    self.launcher_type)
+        except Exception as E:
+            err1 = 'Caught exception planning the build of project %s'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % project_id)
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+            return sessions
+
+        if session_ids is None:
+            LOGGER.info('  * Build plan skipped: processors not all YAML')
+            return sessions
+
+        planned = [sess_info for sess_info in sessions
+                   if sess_info['session_id'] in session_ids]
+        LOGGER.info('  * Build plan: %s/%s sessions to build'
+                    % (str(len(planned)), str(len(sessions))))
+        return planned
+
+    def skip_session(self, sess_info, has_new, sessions_local, lastrun=None,
+                     lastmod_delta=None):
+        """
+        Check if a session can be skipped by the build
+
+        :param sess_info: python ditionary from XnatUtils.list_sessions method
+        :param has_new: True if the project has new processors
+        :param sessions_local: list of sessions to launch tasks
+        :param lastrun: date of the last build for the project
+        :param lastmod_delta: timedelta window for the last modified date
+        :return: True if the session does not need to be built,
+                 False otherwise
+        """
+        if not self.skip_lastupdate and not has_new and not sessions_local:
+            last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                         UPDATE_FORMAT)
+            now_date = datetime.today()
+            last_up = self.get_lastupdated(sess_info)
+            if last_up is not None and \
+               last_mod < last_up and \
+               now_date < last_mod + timedelta(days=int(self.max_age)):
+                mess = "  + Session %s: skipping, last_mod=%s,last_up=%s"
+                mess_str = mess % (sess_info['label'], str(last_mod),
+                                   str(last_up))
+                LOGGER.info(mess_str)
+                return True
+
+        elif lastrun:
+            last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                         UPDATE_FORMAT)
+            if last_mod < lastrun:
+                mess = "  + Session %s:skipping not modified since last run,\
+ last_mod=%s, last_run=%s"
+                LOGGER.info(mess % (sess_info['label'], str(last_mod),
+                                    str(lastrun)))
+                return True
+
+        elif lastmod_delta:
+            last_mod = datetime.strptime(sess_info['last_modified'][0:19],
+                                         UPDATE_FORMAT)
+            now_date = datetime.today()
+            if now_date > last_mod + lastmod_delta:
+                mess = "  + Session %s:skipping not modified within delta,\
+ last_mod=%s"
+                LOGGER.info(mess % (sess_info['label'], str(last_mod)))
+                return True
+            else:
+                LOGGER.info('lastmod = %s' % str(last_mod))
+
+        return False
+
+    def build_and_stamp_session(self, xnat, sess_info, sess_proc_list,
+                                scan_proc_list, sess_mod_list, scan_mod_list):
+        """
+        Build a session and set its last updated date on XNAT.
+
+        Any exception is logged and swallowed so one session can not stop
+         the build of the others.
+
+        :param xnat: pyxnat.Interface object
+        :param sess_info: python ditionary from XnatUtils.list_sessions method
+        :param sess_proc_list: list of processors running on a session
+        :param scan_proc_list: list of processors running on a scan
+        :param sess_mod_list: list of modules running on a session
+        :param scan_mod_list: list of modules running on a scan
+        :return: None
+        """
+        mess = "  + Session %s: building..."
+        LOGGER.info(mess % sess_info['label'])
+
+        if not self.skip_lastupdate:
+            update_start_time = datetime.now()
+
+        try:
+            self.build_session(xnat, sess_info, sess_proc_list,
+                               scan_proc_list, sess_mod_list, scan_mod_list)
+        except Exception as E:
+            err1 = 'Caught exception building sessions %s'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % sess_info['session_label'])
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+
+        try:
+            if not self.skip_lastupdate:
+                self.set_session_lastupdated(xnat, self.cr, sess_info,
+                                             update_start_time)
+        except Exception as E:
+            err1 = 'Caught exception setting session timestamp %s'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % sess_info['session_label'])
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+
+    def build_sessions_parallel(self, sessions, workers, sess_proc_list,
+                                scan_proc_list, sess_mod_list, scan_mod_list):
+        """
+        Build a list of sessions on a pool of threads.
+
+        Each worker thread opens its own XNAT interface and works on its own
+         copy of the processors. The logs of a session are buffered by the
+         worker and written in the order of the sessions list once the
+         session is done, so the log file reads as in serial mode.
+
+        :param sessions: list of sessions to build (XnatUtils.list_sessions)
+        :param workers: number of threads to use
+        :param sess_proc_list: list of processors running on a session
+        :param scan_proc_list: list of processors running on a scan
+        :param sess_mod_list: list of modules running on a session
+        :param scan_mod_list: list of modules running on a scan
+        :return: None
+        """
+        if not sessions:
+            return
+
+        workers = min(workers, len(sessions))
+        LOGGER.info('  * Building %s sessions with %s workers'
+                    % (str(len(sessions)), str(workers)))
+        interfaces = list()
+        intf_lock = threading.Lock()
+
+        def _worker(sess_info):
+            """Build one session in a worker thread."""
+            if getattr(_BUILD_LOCAL, 'xnat', None) is None:
+                _BUILD_LOCAL.xnat = XnatUtils.get_interface(
+                    self.xnat_host, self.xnat_user, self.xnat_pass)
+                _BUILD_LOCAL.procs = copy.deepcopy((sess_proc_list,
+                                                    scan_proc_list))
+                with intf_lock:
+                    interfaces.append(_BUILD_LOCAL.xnat)
+
+            _BUILD_LOCAL.records = list()
             try:
-                self.module_afterrun(xnat, project_id)
+                self.build_and_stamp_session(
+                    _BUILD_LOCAL.xnat, sess_info, _BUILD_LOCAL.procs[0],
+                    _BUILD_LOCAL.procs[1], sess_mod_list, scan_mod_list)
             except Exception as E:
+                err1 = 'Caught exception building sessions %s'
                 err2 = 'Exception class %s caught with message %s'
-                LOGGER.critical('Caught exception after running modules')
-                LOGGER.critical(err2 % (E.__class__, E.message))
+                LOGGER.critical(err1 % sess_info['session_label'])
+                LOGGER.critical(err2 % (E.__class__, str(E)))
                 LOGGER.critical(traceback.format_exc())
+            finally:
+                records = _BUILD_LOCAL.records
+                _BUILD_LOCAL.records = None
+            return records
+
+        log_buffer = _SessionLogBuffer()
+        LOGGER.addFilter(log_buffer)
+        pool = ThreadPool(workers)
+        try:
+            # imap keeps the order of the sessions for the logs
+            for records in pool.imap(_worker, sessions):
+                for record in records:
+                    LOGGER.handle(record)
+        finally:
+            pool.close()
+            pool.join()
+            LOGGER.removeFilter(log_buffer)
+            for intf in interfaces:
+                try:
+                    intf.disconnect()
+                except Exception as E:
+                    LOGGER.warn('failed to disconnect worker interface: %s'
+                                % str(E))
 
     def build_session(self, xnat, sess_info, sess_proc_list,
                       scan_proc_list, sess_mod_list, scan_mod_list):
@@ -612,6 +1326,37 @@ cluster queue"
                                              sess_info['session_label'])
 
         # Modules
+        # NOTE: modules are shared between the build workers, only one
+        #       session runs its modules at a time
+        if sess_mod_list or scan_mod_list:
+            with self.module_lock:
+                self.build_modules(xnat, sess_info, csess, sess_mod_list,
+                                   scan_mod_list)
+
+        # Scan Processors
+        LOGGER.debug('== Build scan processors ==')
+        if scan_proc_list:
+            for cscan in csess.scans():
+                LOGGER.debug('+SCAN: ' + cscan.info()['scan_id'])
+                self.build_scan_processors(xnat, cscan, scan_proc_list)
+
+        # Session Processors
+        LOGGER.debug('== Build session processors ==')
+        if sess_proc_list:
+            self.build_session_processors(xnat, csess, sess_proc_list)
+
+    def build_modules(self, xnat, sess_info, csess, sess_mod_list,
+                      scan_mod_list):
+        """
+        Run the session and scan modules until the session stops changing
+
+        :param xnat: pyxnat.Interface object
+        :param sess_info: python ditionary from XnatUtils.list_sessions method
+        :param csess: CachedObject for Session (XnatUtils)
+        :param sess_mod_list: list of modules running on a session
+        :param scan_mod_list: list of modules running on a scan
+        :return: None
+        """
         mod_count = 0
         while mod_count < 3:
             mess = """== Build modules (count:{count}) =="""
@@ -631,18 +1376,6 @@ cluster queue"
             csess.reload()
             mod_count += 1
 
-        # Scan Processors
-        LOGGER.debug('== Build scan processors ==')
-        if scan_proc_list:
-            for cscan in csess.scans():
-                LOGGER.debug('+SCAN: ' + cscan.info()['scan_id'])
-                self.build_scan_processors(xnat, cscan, scan_proc_list)
-
-        # Session Processors
-        LOGGER.debug('== Build session processors ==')
-        if sess_proc_list:
-            self.build_session_processors(xnat, csess, sess_proc_list)
-
     def build_session_processors(self, xnat, csess, sess_proc_list):
         """ Build Session processors.
 
@@ -683,9 +1416,11 @@ cluster queue"
                 else:
                     # TODO: check that it actually exists in QUEUE
                     LOGGER.debug('skipping, already built: %s' % assr_name)
+            elif p_assr is None:
+                assessor = csess.full_object().assessor(assr_name)
+                self.create_assessor(assessor, assr_name, sess_proc, csess)
             else:
-                if p_assr is None or \
-                   p_assr.info()['procstatus'] == task.NEED_INPUTS:
+                if p_assr.info()['procstatus'] == task.NEED_INPUTS:
                     sess_task = sess_proc.get_task(xnat, csess, res_dir)
                     log_updating_status(sess_proc.name,
                                         sess_task.assessor_label)
@@ -710,6 +1445,33 @@ setting assessor status'
                     # Other statuses handled by dax_update_tasks
                     pass
 
+    @staticmethod
+    def create_assessor(assessor, assr_name, proc, cobj):
+        """
+        Create a new assessor with the status given by the processor inputs.
+
+        The inputs are checked before the assessor exists so it is created
+         with its final status in one request (see task.create_assessor).
+
+        :param assessor: pyxnat assessor object (not existing yet)
+        :param assr_name: label of the assessor
+        :param proc: processor of the assessor
+        :param cobj: CachedImageSession or CachedImageScan (XnatUtils)
+        :return: None
+        """
+        log_updating_status(proc.name, assr_name)
+        has_inputs, qcstatus = proc.has_inputs(cobj)
+        procstatus, qcstatus = task.get_initial_status(has_inputs, qcstatus)
+        try:
+            task.create_assessor(assessor, proc, procstatus, qcstatus)
+        except Exception as E:
+            err1 = 'Caught exception building session %s while creating \
+assessor'
+            err2 = 'Exception class %s caught with message %s'
+            LOGGER.critical(err1 % cobj.info()['session_label'])
+            LOGGER.critical(err2 % (E.__class__, str(E)))
+            LOGGER.critical(traceback.format_exc())
+
     def build_session_modules(self, xnat, csess, sess_mod_list):
         """
         Build a session
@@ -782,9 +1544,12 @@ setting assessor status'
                 else:
                     # TODO: check that it actually exists in QUEUE
                     LOGGER.debug('skipping, already built:' + assr_name)
+            elif p_assr is None:
+                scan = XnatUtils.get_full_object(xnat, scan_info)
+                assessor = scan.parent().assessor(assr_name)
+                self.create_assessor(assessor, assr_name, scan_proc, cscan)
             else:
-                if p_assr is None or \
-                   p_assr.info()['procstatus'] == task.NEED_INPUTS:
+                if p_assr.info()['procstatus'] == task.NEED_INPUTS:
                     scan_task = scan_proc.get_task(xnat, cscan, res_dir)
                     log_updating_status(scan_proc.name,
                                         scan_task.assessor_label)
@@ -962,7 +1727,7 @@ The project is not part of the settings."""
             os.remove(lock_file)
 
     def get_tasks(self, xnat, is_valid_assessor, project_list=None,
-                  sessions_local=None):
+                  sessions_local=None, trace_jobs=False, listed=False):
         """
         Get list of tasks for a projects list
 
@@ -971,9 +1736,14 @@ The project is not part of the settings."""
         :param project_list: List of projects to search tasks from
         :param sessions_local: list of sessions to update tasks associated
          to the project locally
+        :param trace_jobs: get the usage of the finished jobs from the
+         cluster with one query (see cluster.prefetch_jobs_usage)
+        :param listed: build the tasks from the assessors listing
+         (see task.ListedTask)
         :return: list of tasks
         """
         task_list = list()
+        jobs_to_trace = list() if trace_jobs else None
 
         if not project_list:
             projects = list(self.project_process_dict.keys())
@@ -989,12 +1759,20 @@ The project is not part of the settings."""
             task_list.extend(self.get_project_tasks(xnat,
                                                     project_id,
                                                     sessions_local,
-                                                    is_valid_assessor))
+                                                    is_valid_assessor,
+                                                    jobs_to_trace,
+                                                    listed))
+
+        if jobs_to_trace:
+            LOGGER.info('Getting the usage of %s finished jobs...'
+                        % str(len(jobs_to_trace)))
+            cluster.prefetch_jobs_usage(jobs_to_trace)
 
         return task_list
 
     def get_project_tasks(self, xnat, project_id, sessions_local,
-                          is_valid_assessor):
+                          is_valid_assessor, jobs_to_trace=None,
+                          listed=False):
         """
         Get list of tasks for a specific project where each task agrees
          the is_valid_assessor conditions
@@ -1004,6 +1782,9 @@ The project is not part of the settings."""
         :param sessions_local: list of sessions to update tasks associated
          to the project locally
         :param is_valid_assessor: method to validate the assessor
+        :param jobs_to_trace: list to extend with the (jobid, jobstartdate)
+         of the tasks ready to complete
+        :param listed: build the tasks from the assessors listing
         :return: list of tasks
         """
         task_list = list()
@@ -1019,9 +1800,14 @@ The project is not part of the settings."""
         for assr_info in assr_list:
             if is_valid_assessor(assr_info):
                 cur_task = self.generate_task(xnat, assr_info, sess_procs,
-                                              scan_procs)
+                                              scan_procs, listed)
                 if cur_task:
                     task_list.append(cur_task)
+                    if jobs_to_trace is not None and \
+                       assr_info['procstatus'] == task.READY_TO_COMPLETE and \
+                       not assr_info.get('walltimeused'):
+                        jobs_to_trace.append((assr_info.get('jobid'),
+                                              assr_info.get('jobstartdate')))
 
         return task_list
 
@@ -1050,7 +1836,8 @@ The project is not part of the settings."""
 
         return None
 
-    def generate_task(self, xnat, assr_info, sess_proc_list, scan_proc_list):
+    def generate_task(self, xnat, assr_info, sess_proc_list, scan_proc_list,
+                      listed=False):
         """
         Generate a task for the assessor in the info
 
@@ -1059,6 +1846,8 @@ The project is not part of the settings."""
                           (See XnatUtils.list_assessors)
         :param sess_proc_list: list of processors running on a session
         :param scan_proc_list: list of processors running on a scan
+        :param listed: return a ListedTask that only selects the assessor
+         on XNAT when needed
         :return: task if processor and assessor match, None otherwise
         """
         task_proc = self.match_proc(assr_info, sess_proc_list, scan_proc_list)
@@ -1067,6 +1856,9 @@ The project is not part of the settings."""
             warn = 'no matching processor found: %s'
             LOGGER.warn(warn % assr_info['assessor_label'])
             return None
+        elif listed:
+            return ListedTask(task_proc, xnat, assr_info,
+                              DAX_SETTINGS.get_results_dir())
         else:
             # Get a new task with the matched processor
             assr = XnatUtils.get_full_object(xnat, assr_info)
@@ -1084,7 +1876,7 @@ The project is not part of the settings."""
         :return: list of assessors for a project
         """
         # Get lists of assessors for this project
-        assr_list = XnatUtils.list_project_assessors(xnat, project_id)
+        assr_list = project_index.list_project_assessors(xnat, project_id)
 
         # filter the assessors to the sessions given as parameters if given
         if slocal and slocal.lower() != 'all':
@@ -1208,7 +2000,7 @@ The project is not part of the settings."""
         :return: True if has new processors, False otherwise
         """
         # Get unique list of assessors already in XNAT
-        assr_list = XnatUtils.list_project_assessors(xnat, project_id)
+        assr_list = project_index.list_project_assessors(xnat, project_id)
         assr_type_set = set([x['proctype'] for x in assr_list])
 
         # Get unique list of processors prescribed for project
@@ -1227,7 +2019,26 @@ def load_task_queue(status=None, proj_filter=None):
     diskq_dir = os.path.join(DAX_SETTINGS.get_results_dir(), 'DISKQ')
     results_dir = DAX_SETTINGS.get_results_dir()
 
-    for t in os.listdir(os.path.join(diskq_dir, 'BATCH')):
+    store = diskq_store.get_diskq_store()
+    if store is not None:
+        # Tasks written before the store are only in their files
+        diskq_store.import_missing_tasks(diskq_dir, store, proj_filter)
+        # One query on the indexes of the store (see diskq_store.py)
+        for label in store.list_labels(status, proj_filter):
+            LOGGER.debug('loading:' + label)
+            task_list.append(ClusterTask(label, results_dir, diskq_dir))
+        return task_list
+
+    if status:
+        index_flag = os.path.join(diskq_dir, task.STATUS_DIRNAME,
+                                  task.STATUS_INDEX_FLAG)
+        if not os.path.exists(index_flag):
+            index_task_queue(diskq_dir)
+        return load_indexed_tasks(diskq_dir, status, proj_filter)
+
+    # With the sharded layout, only the folders of the projects are read
+    for t, _ in queue_layout.list_paths(os.path.join(diskq_dir, 'BATCH'),
+                                        proj_filter):
         # TODO:complete filtering by project/subject/session/type
         if proj_filter:
             assr = XnatUtils.AssessorHandler(t)
@@ -1236,16 +2047,195 @@ def load_task_queue(status=None, proj_filter=None):
                 continue
 
         LOGGER.debug('loading:' + t)
-        task = ClusterTask(os.path.splitext(t)[0], results_dir, diskq_dir)
-        LOGGER.debug('status = ' + task.get_status())
+        cur_task = ClusterTask(os.path.splitext(t)[0], results_dir, diskq_dir)
+        LOGGER.debug('status = ' + cur_task.get_status())
+        LOGGER.debug('adding task to list:' + t)
+        task_list.append(cur_task)
+
+    return task_list
+
+
+def load_indexed_tasks(diskq_dir, status, proj_filter=None):
+    """
+    Load the tasks of the DiskQ with a status from the status index
 
-        if not status or task.get_status() == status:
-            LOGGER.debug('adding task to list:' + t)
-            task_list.append(task)
+    Only the entries of the index for the status and the projects are
+     read. The entries of the tasks deleted or with another status are
+     removed.
+
+    :param diskq_dir: DISKQ folder in RESULTS_DIR
+    :param status: procstatus of the tasks
+    :param proj_filter: list of projects (all if None)
+    :return: list of ClusterTask
+    """
+    task_list = list()
+    results_dir = DAX_SETTINGS.get_results_dir()
+    status_dir = os.path.join(diskq_dir, task.STATUS_DIRNAME, status)
+    if not os.path.isdir(status_dir):
+        return task_list
+
+    for project in proj_filter or os.listdir(status_dir):
+        proj_dir = os.path.join(status_dir, project)
+        if not os.path.isdir(proj_dir):
+            continue
+        for label in os.listdir(proj_dir):
+            cur_task = ClusterTask(label, results_dir, diskq_dir)
+            if not os.path.exists(cur_task.batch_path()) or \
+               cur_task.get_status() != status:
+                LOGGER.debug('removing from the status index:' + label)
+                try:
+                    os.remove(os.path.join(proj_dir, label))
+                except OSError:
+                    pass
+                continue
+            LOGGER.debug('loading:' + label)
+            task_list.append(cur_task)
 
     return task_list
 
 
+def index_task_queue(diskq_dir):
+    """
+    Add all the tasks of the DiskQ to the status index
+
+    Done once: the index is then kept by ClusterTask.set_status.
+
+    :param diskq_dir: DISKQ folder in RESULTS_DIR
+    :return: None
+    """
+    results_dir = DAX_SETTINGS.get_results_dir()
+    LOGGER.info('Indexing the status of the tasks in %s' % diskq_dir)
+    for batch_file, _ in queue_layout.list_paths(
+            os.path.join(diskq_dir, 'BATCH')):
+        cur_task = ClusterTask(os.path.splitext(batch_file)[0], results_dir,
+                               diskq_dir)
+        cur_task.set_status_index(None, cur_task.get_status())
+    task.create_flag(os.path.join(diskq_dir, task.STATUS_DIRNAME,
+                                  task.STATUS_INDEX_FLAG))
+
+
+def submit_launch(launch):
+    """
+    Run the submission of a job prepared by Launcher.prepare_launch
+
+    :param launch: (label, submit, finish, tasks)
+    :return: (launch, result of submit, None) or (launch, None, traceback)
+    """
+    try:
+        return launch, launch[1](), None
+    except Exception:
+        return launch, None, traceback.format_exc()
+
+
+def finish_launch(launch):
+    """
+    Submit a job prepared by Launcher.prepare_launch and set it on its tasks
+
+    :param launch: (label, submit, finish, tasks)
+    :return: (launch, None) or (launch, traceback)
+    """
+    launch, result, error = submit_launch(launch)
+    if error is None:
+        try:
+            launch[2](result)
+        except Exception:
+            error = traceback.format_exc()
+    return launch, error
+
+
+def invalidate_launches(launches):
+    """
+    Remove the listings cached by the interface of the tasks launched
+
+    :param launches: list of (label, submit, finish, tasks)
+    :return: None
+    """
+    for launch in launches:
+        for cur_task in launch[3]:
+            assessor = getattr(cur_task, 'assessor', None)
+            intf = getattr(assessor, '_intf', None)
+            if hasattr(intf, 'invalidate_cache'):
+                intf.invalidate_cache(assessor._uri)
+
+
+def finish_dependent_launch(cur_task, result):
+    """
+    Set the job of a task waiting for other jobs and hold the results of
+     the jobs it waits for (see job_depends.hold_results)
+
+    :param cur_task: task launched
+    :param result: (jobid, failed) returned by the submission
+    :return: None
+    """
+    try:
+        cur_task.finish_launch(result[0], result[1])
+    except ClusterLaunchException:
+        # e.g. a job it waits for left the queue: tried again next launch
+        LOGGER.warn('job of %s waiting for %s not submitted, keeping %s'
+                    % (cur_task.assessor_label,
+                       ', '.join(cur_task.depends), task.NEED_INPUTS))
+        return
+    job_depends.hold_results(cur_task.depends, cur_task.assessor_label,
+                             result[0].strip())
+
+
+def pop_array_tasks(task_list, first_task, max_size, accept=None):
+    """
+    Remove from the list the tasks to launch in the job array of a task
+
+    :param task_list: list of Task left to launch
+    :param first_task: first Task of the job array
+    :param max_size: maximum number of tasks to remove
+    :param accept: function returning False for the tasks that can not be
+     launched now (see launch_policy)
+    :return: list of Task with the same array key as first_task
+    """
+    if max_size <= 0:
+        return list()
+    key = first_task.get_array_key()
+    array_tasks = list()
+    # Same order as task_list.pop()
+    for cur_task in reversed(task_list):
+        if len(array_tasks) >= max_size:
+            break
+        if cur_task.get_array_key() == key and \
+           (accept is None or accept(cur_task)):
+            array_tasks.append(cur_task)
+
+    if array_tasks:
+        selected = set(id(cur_task) for cur_task in array_tasks)
+        task_list[:] = [cur_task for cur_task in task_list
+                        if id(cur_task) not in selected]
+    return array_tasks
+
+
+def get_finished_jobs(task_list):
+    """
+    Get the jobs of the running tasks that are not in the queue anymore
+
+    Only possible when the status of all the jobs can be listed at once
+     (see cluster.get_jobs_status).
+
+    :param task_list: list of ClusterTask
+    :return: list of (jobid, jobstartdate) of the finished jobs
+    """
+    jobs = cluster.get_jobs_status(force=True)
+    if jobs is None:
+        return list()
+
+    finished = list()
+    for cur_task in task_list:
+        if cur_task.get_status() != task.JOB_RUNNING:
+            continue
+        jobid = cur_task.get_jobid()
+        if not jobid or jobs.get(jobid) in ['R', 'Q']:
+            continue
+        if cur_task.get_walltime():
+            continue
+        finished.append((jobid, cur_task.get_attr('jobstartdate')))
+    return finished
+
+
 def get_sess_lastmod(xnat, sess_info):
     """ Get the session last modified date."""
     xsi_type = sess_info['xsiType']
@@ -248,10 +248,7 @@ class SessionModule(Module):
         :param flag_resource: resource to verify its existence on XNAT
         :return: True if the resource exists, False otherwise.
         """
-        sess_res_list = csess.get_resources()
-        flagres_list = [res for res in sess_res_list
-                        if res['label'] == flag_resource]
-        if len(flagres_list) > 0:
+        if csess.get_resource(flag_resource) is not None:
             LOGGER.debug('Already run')
             return False
 
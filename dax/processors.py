@@ -7,7 +7,7 @@ import logging
 import re
 import os
 
-from . import XnatUtils, task
+from . import XnatUtils, queue_layout, task
 from .errors import AutoProcessorError
 
 
@@ -227,13 +227,9 @@ class ScanProcessor(Processor):
 
         # Look for existing assessor
         assr_label = assr_name
-        for assr in csess.assessors():
-            if assr_name_shared is not None and \
-               assr.info()['label'] == assr_name_shared:
-                assr_label = assr_name_shared
-                break
-            if assr.info()['label'] == assr_name:
-                break
+        if assr_name_shared is not None and \
+           csess.get_assessor(assr_name_shared) is not None:
+            assr_label = assr_name_shared
 
         return assr_label
 
@@ -249,11 +245,7 @@ class ScanProcessor(Processor):
 
         # Look for existing assessor
         csess = cscan.parent()
-        p_assr = None
-        for assr in csess.assessors():
-            if assr.info()['label'] == assessor_name:
-                p_assr = assr
-                break
+        p_assr = csess.get_assessor(assessor_name)
 
         return p_assr, assessor_name
 
@@ -285,11 +277,8 @@ class ScanProcessor(Processor):
         if self.scan_types == 'all':
             return True
         else:
-            for expression in self.scan_types:
-                regex = XnatUtils.extract_exp(expression, self.full_regex)
-                if regex.match(scan_dict['scan_type']):
-                    return True
-            return False
+            matcher = XnatUtils.get_matcher(self.scan_types, self.full_regex)
+            return matcher.match(scan_dict['scan_type']) is not None
 
 
 class SessionProcessor(Processor):
@@ -357,13 +346,9 @@ class SessionProcessor(Processor):
 
         # Look for existing assessor
         assr_label = assr_name
-        for assr in csess.assessors():
-            if assr_name_shared is not None and \
-               assr.info()['label'] == assr_name_shared:
-                assr_label = assr_name_shared
-                break
-            if assr.info()['label'] == assr_name:
-                break
+        if assr_name_shared is not None and \
+           csess.get_assessor(assr_name_shared) is not None:
+            assr_label = assr_name_shared
 
         return assr_label
 
@@ -378,11 +363,7 @@ class SessionProcessor(Processor):
         assessor_name = self.get_assessor_name(csess)
 
         # Look for existing assessor
-        p_assr = None
-        for assr in csess.assessors():
-            if assr.info()['label'] == assessor_name:
-                p_assr = assr
-                break
+        p_assr = csess.get_assessor(assessor_name)
 
         return p_assr, assessor_name
 
@@ -429,6 +410,8 @@ class AutoProcessor(Processor):
         self.xsitype = self.attrs.get('xsitype', 'proc:genProcData')
         self.full_regex = self.attrs.get('fullregex', False)
         self.suffix = self.attrs.get('suffix', None)
+        # Launch priority for the fairshare launch order (see launch_policy)
+        self.priority = self.attrs.get('priority', 0)
 
         # Set scan info if scan auto processor
         if self.type == 'scan':
@@ -598,13 +581,9 @@ defined by yaml file {}'
 
         # Look for existing assessor
         assr_label = assr_name
-        for assr in csess.assessors():
-            if assr_name_shared is not None and \
-               assr.info()['label'] == assr_name_shared:
-                assr_label = assr_name_shared
-                break
-            if assr.info()['label'] == assr_name:
-                break
+        if assr_name_shared is not None and \
+           csess.get_assessor(assr_name_shared) is not None:
+            assr_label = assr_name_shared
 
         return assr_label
 
@@ -623,11 +602,7 @@ defined by yaml file {}'
             csess = cobj
         elif isinstance(cobj, XnatUtils.CachedImageScan):
             csess = cobj.parent()
-        p_assr = None
-        for assr in csess.assessors():
-            if assr.info()['label'] == assessor_name:
-                p_assr = assr
-                break
+        p_assr = csess.get_assessor(assessor_name)
 
         return p_assr, assessor_name
 
@@ -663,17 +638,14 @@ defined by yaml file {}'
             if scantypes == 'all':
                 return True
             else:
-                for expression in scantypes:
-                    regex = XnatUtils.extract_exp(expression, self.full_regex)
-                    if regex.match(obj_dict['scan_type']):
-                        return True
-                return False
+                matcher = XnatUtils.get_matcher(scantypes, self.full_regex)
+                return matcher.match(obj_dict['scan_type']) is not None
         else:
             # By definition, this should always run, so it just returns true
             # with no checks for session
             return True
 
-    def has_inputs(self, cobj):
+    def has_inputs(self, cobj, pending=None):
         """Method to check the inputs.
 
         By definition:
@@ -686,6 +658,9 @@ defined by yaml file {}'
 
         :param cobj: cached object define in dax.XnatUtils (Session or Scan)
                      (see XnatUtils in dax for information)
+        :param pending: labels of the assessors of the session with a job
+                        still running, used as good inputs (their outputs
+                        are not checked)
         :return: status, qcstatus
         """
         # If Scan assessor, check that the scan has inputs
@@ -726,14 +701,15 @@ defined by yaml file {}'
             resources = [_doc.get('resource') for _doc in doc_res
                          if _doc.get('required', True)]
             status, qcstatus = self._check_xnat_cobj(
-                csess, proctypes, 'assessor', nargs, resources, needs_qc)
+                csess, proctypes, 'assessor', nargs, resources, needs_qc,
+                pending)
             if status == 0 or status == -1:
                 return status, qcstatus
 
         return 1, None
 
     def _check_xnat_cobj(self, csess, sp_types, otype='scan', nargs=False,
-                         resources=list(), needs_qc=True):
+                         resources=list(), needs_qc=True, pending=None):
         """Method to check if in a csess you have the right inputs (scans)
 
         :param csess: CachedImageSession to check
@@ -741,15 +717,23 @@ defined by yaml file {}'
         :param nargs: allow more than one scans of this type
         :param resources: resources to check on XNAT
         :param needs_qc: if we are looking for object with qc that passed
+        :param pending: labels of the assessors with a job still running
+                        (assessor only, see has_inputs)
         :return: status, qcstatus
         """
         good_cobjs = list()
+        pending_cobjs = list()
         if otype == 'scan':
-            good_cobjs = XnatUtils.get_good_cscans(csess, sp_types, needs_qc)
+            good_cobjs = XnatUtils.get_good_cscans(csess, sp_types, needs_qc,
+                                                   self.full_regex)
         else:
-            good_cobjs = XnatUtils.get_good_cassr(csess, sp_types, needs_qc)
+            good_cobjs = XnatUtils.get_good_cassr(csess, sp_types, needs_qc,
+                                                  self.full_regex)
+            pending_cobjs = self.get_pending_cassr(csess, sp_types, pending)
+            good_cobjs = [cobj for cobj in good_cobjs
+                          if cobj.info()['label'] not in (pending or list())]
 
-        if not good_cobjs:
+        if not good_cobjs and not pending_cobjs:
             msg = '{}: No {} {} found.'
             LOGGER.debug(msg.format(self.name, ','.join(sp_types), otype))
             # Return NO DATA if scan and 0 if assessor
@@ -757,7 +741,7 @@ defined by yaml file {}'
                 return -1, 'No {} found'.format(','.join(sp_types))
             else:
                 return 0, 'No {} found'.format(','.join(sp_types))
-        elif nargs is False and len(good_cobjs) > 1:
+        elif nargs is False and len(good_cobjs) + len(pending_cobjs) > 1:
             msg = '{}: Too many {} {} found.'
             LOGGER.debug(msg.format(self.name, ','.join(sp_types),
                                     '{}s'.format(otype)))
@@ -779,6 +763,52 @@ defined by yaml file {}'
                         return 0, 'Missing {} on {}'.format(res, _type)
         return 1, None
 
+    def get_pending_cassr(self, csess, proctypes, pending=None):
+        """Method to get the assessors of a session with a job still running
+
+        :param csess: CachedImageSession to check
+        :param proctypes: list of proctypes to look for
+        :param pending: labels of the assessors with a job still running
+        :return: list of CachedImageAssessor
+        """
+        if not pending:
+            return list()
+        return [cassr for cassr in csess.assessors()
+                if cassr.info()['label'] in pending and
+                XnatUtils.is_cassessor_good_type(cassr, proctypes,
+                                                 self.full_regex)]
+
+    def get_upstream_proctypes(self):
+        """Method to get the proctypes of the assessors used as inputs
+
+        :return: list of proctypes (regex if full_regex is set)
+        """
+        proctypes = list()
+        for assr_in in self.xnat_inputs.get('assessors', list()):
+            proctypes.extend(assr_in.get('proctypes').split(','))
+        return proctypes
+
+    def get_results_path(self, cobjs, resource, fpath=None):
+        """Method to get the path of a resource in the results directory
+
+        The job of the assessors writes its outputs in RESULTS_DIR before
+         the upload to XNAT.
+
+        :param cobjs: list of CachedImageAssessor in dax.XnatUtils
+        :param resource: name of the resource
+        :param fpath: filepath to get
+        :return: list of paths
+        """
+        filepaths = list()
+        for cobj in cobjs:
+            res_path = os.path.join(
+                queue_layout.get_path(task.RESULTS_DIR, cobj.info()['label']),
+                resource)
+            if fpath:
+                res_path = os.path.join(res_path, fpath)
+            filepaths.append(res_path)
+        return filepaths
+
     def get_xnat_path(self, cobjs, resource, required=True, fpath=None):
         """Method to get the file path on XNAT for the scans
 
@@ -802,7 +832,7 @@ resource/{4}'
             elif isinstance(cobj, XnatUtils.CachedImageScan):
                 label = obj_info['ID']
                 path_tmp = scan_tmp
-            if resource in [res['label'] for res in cobj.get_resources()]:
+            if cobj.get_resource(resource) is not None:
                 x_path = path_tmp.format(obj_info['project_id'],
                                          obj_info['subject_label'],
                                          obj_info['session_label'],
@@ -816,11 +846,13 @@ resource/{4}'
                                         obj_info['session_label']))
         return filepaths
 
-    def get_cmds(self, assessor, jobdir):
+    def get_cmds(self, assessor, jobdir, pending=None):
         """Method to generate the spider command for cluster job.
 
         :param assessor: pyxnat assessor object
         :param jobdir: jobdir where the job's output will be generated
+        :param pending: labels of the input assessors with a job still
+                        running, read from the results directory
         :return: command to execute the spider in the job script
         """
         # Add the jobidr and the assessor label:
@@ -844,8 +876,8 @@ resource/{4}'
                 self._append_xnat_cobj(csess, scantypes, resources, needs_qc,
                                        'scan')
             else:
-                cprocscan = [cscan for cscan in csess.scans()
-                             if cscan.info()['ID'] == scan_label]
+                cscan = csess.get_scan(scan_label)
+                cprocscan = [cscan] if cscan is not None else []
                 self._get_xnat_procscan(cprocscan, resources)
 
         # Assessors:
@@ -854,7 +886,7 @@ resource/{4}'
             needs_qc = assr_in.get('needs_qc', True)
             resources = assr_in.get('resources', list())
             self._append_xnat_cobj(csess, proctypes, resources, needs_qc,
-                                   'assessor')
+                                   'assessor', pending)
 
         cmd = self.command.format(**self.inputs)
 
@@ -870,19 +902,27 @@ resource/{4}'
         return [cmd]
 
     def _append_xnat_cobj(self, csess, sp_types, resources, needs_qc=True,
-                          otype='scan'):
+                          otype='scan', pending=None):
         """Method to append XNAT cobj info to inputs for command.
 
         :param csess: CachedImageSession from XnatUtils
         :param sp_types: types of scan or assessor to look for
         :param resources: list of resources from YAML file with var
         :param needs_qc: if we are looking for object with qc that passed
+        :param pending: labels of the assessors with a job still running
+                        (assessor only, see get_cmds)
         """
         good_cobjs = list()
+        pending_cobjs = list()
         if otype == 'scan':
-            good_cobjs = XnatUtils.get_good_cscans(csess, sp_types, needs_qc)
+            good_cobjs = XnatUtils.get_good_cscans(csess, sp_types, needs_qc,
+                                                   self.full_regex)
         else:
-            good_cobjs = XnatUtils.get_good_cassr(csess, sp_types, needs_qc)
+            good_cobjs = XnatUtils.get_good_cassr(csess, sp_types, needs_qc,
+                                                  self.full_regex)
+            pending_cobjs = self.get_pending_cassr(csess, sp_types, pending)
+            good_cobjs = [cobj for cobj in good_cobjs
+                          if cobj.info()['label'] not in (pending or list())]
 
         for res_l in resources:
             if 'varname' not in list(res_l.keys()):
@@ -891,6 +931,9 @@ resource/{4}'
                 _in = self.get_xnat_path(good_cobjs, res_l.get('resource'),
                                          required=res_l.get('required', True),
                                          fpath=res_l.get('filepath', None))
+                _in.extend(self.get_results_path(
+                    pending_cobjs, res_l.get('resource'),
+                    fpath=res_l.get('filepath', None)))
                 self.inputs[res_l.get('varname')] = ','.join(_in)
 
     def _get_xnat_procscan(self, cprocscan, resources):
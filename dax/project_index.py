@@ -0,0 +1,377 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" project_index.py
+
+Local SQLite index of the XNAT listings (scans / assessors) of a project.
+
+The listings returned by XnatUtils.list_project_scans and
+XnatUtils.list_project_assessors are stored by host and project. On the next
+query, only the sessions and assessors whose last_modified date changed on
+XNAT are downloaded again. A full listing is still downloaded once a day.
+
+The index is enabled by setting project_index in the [admin] section of
+~/.dax_settings.ini to the path of the SQLite file.
+"""
+
+from builtins import object
+
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import sqlite3
+
+from . import XnatUtils
+from .dax_settings import DAX_Settings
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['ProjectIndex', 'get_project_index', 'list_project_scans',
+           'list_project_assessors']
+DAX_SETTINGS = DAX_Settings()
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Download everything again after this delay
+FULL_REFRESH = timedelta(days=1)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# Session values copied on each scan/assessor row by XnatUtils
+SCAN_SESSION_KEYS = ['handedness', 'gender', 'yob', 'age', 'last_modified',
+                     'last_updated']
+ASSR_SESSION_KEYS = ['session_type'] + SCAN_SESSION_KEYS
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    host TEXT, project TEXT, session_id TEXT, last_modified TEXT,
+    PRIMARY KEY (host, project, session_id));
+CREATE TABLE IF NOT EXISTS scans (
+    host TEXT, project TEXT, session_id TEXT, data TEXT);
+CREATE INDEX IF NOT EXISTS scans_session ON scans (host, project, session_id);
+CREATE TABLE IF NOT EXISTS assessors (
+    host TEXT, project TEXT, assessor_id TEXT, last_modified TEXT, data TEXT,
+    PRIMARY KEY (host, project, assessor_id));
+CREATE TABLE IF NOT EXISTS refreshes (
+    host TEXT, project TEXT, listing TEXT, date TEXT,
+    PRIMARY KEY (host, project, listing));
+"""
+_PROJECT_INDEX = None
+
+
+class ProjectIndex(object):
+    """ SQLite index of the scans and assessors listings of projects """
+    def __init__(self, db_path):
+        """
+        Entry point for the ProjectIndex class
+
+        :param db_path: path to the SQLite file (created if needed)
+        :return: None
+        """
+        self.db_path = db_path
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        if not os.path.isdir(db_dir):
+            os.makedirs(db_dir)
+        conn = self._connect()
+        try:
+            conn.executescript(SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        """
+        Open a connection to the index.
+
+        A connection is opened for each listing so the index can be used
+         by several threads and several dax processes.
+
+        :return: sqlite3 connection
+        """
+        return sqlite3.connect(self.db_path, timeout=60)
+
+    def list_project_scans(self, intf, projectid, session_list=None):
+        """
+        List all the scans of a project (shared scans included).
+
+        Same output as XnatUtils.list_project_scans.
+
+        :param intf: pyxnat.Interface object
+        :param projectid: ID of a project on XNAT
+        :param session_list: list of sessions from XnatUtils.list_sessions
+        :return: List of all the scans for the project
+        """
+        if session_list is None:
+            session_list = XnatUtils.list_sessions(intf, projectid)
+        host = get_host(intf)
+        current = dict((sess['session_id'], sess['last_modified'])
+                       for sess in session_list)
+
+        conn = self._connect()
+        try:
+            known = dict(conn.execute(
+                'SELECT session_id, last_modified FROM sessions \
+WHERE host=? AND project=?', (host, projectid)).fetchall())
+            full = self._needs_full_refresh(conn, host, projectid, 'scans')
+            changed = get_changed(current, known, full)
+            removed = [sid for sid in known if sid not in current]
+
+            if changed is None:
+                LOGGER.debug('project index: full scans listing for %s'
+                             % projectid)
+                scans = XnatUtils.get_project_scans(intf, projectid,
+                                                    session_list)
+                conn.execute('DELETE FROM scans WHERE host=? AND project=?',
+                             (host, projectid))
+                self._set_refreshed(conn, host, projectid, 'scans')
+            else:
+                LOGGER.debug('project index: %s sessions changed for %s'
+                             % (str(len(changed)), projectid))
+                scans = list()
+                if changed:
+                    scans = XnatUtils.get_project_scans(
+                        intf, projectid, session_list, session_ids=changed)
+                conn.executemany(
+                    'DELETE FROM scans WHERE host=? AND project=? AND \
+session_id=?', [(host, projectid, sid) for sid in changed + removed])
+
+            conn.executemany(
+                'INSERT INTO scans VALUES (?, ?, ?, ?)',
+                [(host, projectid, scan['session_id'], json.dumps(scan))
+                 for scan in scans])
+            conn.execute('DELETE FROM sessions WHERE host=? AND project=?',
+                         (host, projectid))
+            conn.executemany(
+                'INSERT INTO sessions VALUES (?, ?, ?, ?)',
+                [(host, projectid, sid, mod) for sid, mod in current.items()])
+            conn.commit()
+
+            rows = conn.execute('SELECT data FROM scans WHERE host=? AND \
+project=?', (host, projectid)).fetchall()
+        finally:
+            conn.close()
+
+        scans = load_rows(rows, session_list, SCAN_SESSION_KEYS)
+        return sorted(scans, key=lambda k: k['session_label'])
+
+    def list_project_assessors(self, intf, projectid, session_list=None):
+        """
+        List all the assessors of a project.
+
+        Same output as XnatUtils.list_project_assessors.
+
+        :param intf: pyxnat.Interface object
+        :param projectid: ID of a project on XNAT
+        :param session_list: list of sessions from XnatUtils.list_sessions
+        :return: List of all the assessors for the project
+        """
+        if session_list is None:
+            session_list = XnatUtils.list_sessions(intf, projectid)
+        host = get_host(intf)
+        current = XnatUtils.list_project_assessors_modified(intf, projectid)
+
+        conn = self._connect()
+        try:
+            known = dict(conn.execute(
+                'SELECT assessor_id, last_modified FROM assessors \
+WHERE host=? AND project=?', (host, projectid)).fetchall())
+            full = self._needs_full_refresh(conn, host, projectid,
+                                            'assessors')
+            changed = get_changed(current, known, full)
+            removed = [aid for aid in known if aid not in current]
+
+            if changed is None:
+                LOGGER.debug('project index: full assessors listing for %s'
+                             % projectid)
+                assessors = XnatUtils.get_project_assessors(intf, projectid,
+                                                            session_list)
+                conn.execute('DELETE FROM assessors WHERE host=? AND \
+project=?', (host, projectid))
+                self._set_refreshed(conn, host, projectid, 'assessors')
+            else:
+                LOGGER.debug('project index: %s assessors changed for %s'
+                             % (str(len(changed)), projectid))
+                assessors = list()
+                if changed:
+                    assessors = XnatUtils.get_project_assessors(
+                        intf, projectid, session_list, assessor_ids=changed)
+                conn.executemany(
+                    'DELETE FROM assessors WHERE host=? AND project=? AND \
+assessor_id=?', [(host, projectid, aid) for aid in changed + removed])
+
+            conn.executemany(
+                'INSERT OR REPLACE INTO assessors VALUES (?, ?, ?, ?, ?)',
+                [(host, projectid, assr['assessor_id'],
+                  current.get(assr['assessor_id']), json.dumps(assr))
+                 for assr in assessors])
+            conn.commit()
+
+            rows = conn.execute('SELECT data FROM assessors WHERE host=? AND \
+project=?', (host, projectid)).fetchall()
+        finally:
+            conn.close()
+
+        assessors = load_rows(rows, session_list, ASSR_SESSION_KEYS)
+        return sorted(assessors, key=lambda k: k['label'])
+
+    def clear(self, host=None, projectid=None):
+        """
+        Remove the listings from the index to force a full listing.
+
+        :param host: XNAT host to clear, all hosts if None
+        :param projectid: project to clear, all projects if None
+        :return: None
+        """
+        conditions = list()
+        values = list()
+        if host:
+            conditions.append('host=?')
+            values.append(host)
+        if projectid:
+            conditions.append('project=?')
+            values.append(projectid)
+        where = ''
+        if conditions:
+            where = ' WHERE %s' % ' AND '.join(conditions)
+
+        conn = self._connect()
+        try:
+            for table in ['sessions', 'scans', 'assessors', 'refreshes']:
+                conn.execute('DELETE FROM %s%s' % (table, where), values)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _needs_full_refresh(conn, host, projectid, listing):
+        """
+        Check if the full listing needs to be downloaded.
+
+        :param conn: sqlite3 connection
+        :param host: XNAT host
+        :param projectid: ID of a project on XNAT
+        :param listing: name of the listing (scans or assessors)
+        :return: True if never downloaded or older than FULL_REFRESH
+        """
+        row = conn.execute('SELECT date FROM refreshes WHERE host=? AND \
+project=? AND listing=?', (host, projectid, listing)).fetchone()
+        if row is None:
+            return True
+        last_full = datetime.strptime(row[0], DATE_FORMAT)
+        return datetime.now() > last_full + FULL_REFRESH
+
+    @staticmethod
+    def _set_refreshed(conn, host, projectid, listing):
+        """
+        Save the date of the last full listing.
+
+        :param conn: sqlite3 connection
+        :param host: XNAT host
+        :param projectid: ID of a project on XNAT
+        :param listing: name of the listing (scans or assessors)
+        :return: None
+        """
+        conn.execute('INSERT OR REPLACE INTO refreshes VALUES (?, ?, ?, ?)',
+                     (host, projectid, listing,
+                      datetime.now().strftime(DATE_FORMAT)))
+
+
+def get_host(intf):
+    """
+    Get the XNAT host of an interface.
+
+    :param intf: pyxnat.Interface object
+    :return: host url
+    """
+    host = getattr(intf, 'host', None)
+    if not host:
+        host = intf._server
+    return host
+
+
+def get_changed(current, known, full=False):
+    """
+    Get the IDs of the objects that changed since the last listing.
+
+    :param current: dictionary ID: last_modified from XNAT
+    :param known: dictionary ID: last_modified from the index
+    :param full: True if a full listing is required
+    :return: list of IDs, None if the full listing should be downloaded
+    """
+    if full:
+        return None
+    changed = [_id for _id, last_mod in current.items()
+               if last_mod is None or known.get(_id) != last_mod]
+    # Quicker to get everything than to query most of the objects by ID
+    if len(changed) > len(current) / 2:
+        return None
+    return changed
+
+
+def load_rows(rows, session_list, session_keys):
+    """
+    Load the json rows from the index and set the session values.
+
+    The values coming from the session (e.g: last_updated) are taken from
+     the session list just queried to stay up to date.
+
+    :param rows: rows from the index (one json string per row)
+    :param session_list: list of sessions from XnatUtils.list_sessions
+    :param session_keys: keys to set from the session
+    :return: list of dictionaries
+    """
+    sessions = dict((sess['session_id'], sess) for sess in session_list)
+    obj_list = list()
+    for row in rows:
+        obj = json.loads(row[0])
+        sess = sessions.get(obj['session_id'])
+        if sess is None:
+            continue
+        for key in session_keys:
+            if key == 'session_type':
+                obj[key] = sess['type']
+            else:
+                obj[key] = sess[key]
+        obj_list.append(obj)
+    return obj_list
+
+
+def get_project_index():
+    """
+    Get the project index set in the settings.
+
+    :return: ProjectIndex object, None if project_index is not set
+    """
+    global _PROJECT_INDEX
+    db_path = DAX_SETTINGS.get_project_index()
+    if not db_path:
+        return None
+    if _PROJECT_INDEX is None or _PROJECT_INDEX.db_path != db_path:
+        _PROJECT_INDEX = ProjectIndex(db_path)
+    return _PROJECT_INDEX
+
+
+def list_project_scans(intf, projectid, include_shared=True):
+    """
+    List all the scans of a project, using the project index if set.
+
+    :param intf: pyxnat.Interface object
+    :param projectid: ID of a project on XNAT
+    :param include_shared: include the shared data in this project
+    :return: List of all the scans for the project
+    """
+    index = get_project_index()
+    if index is None or not include_shared:
+        return XnatUtils.list_project_scans(intf, projectid, include_shared)
+    return index.list_project_scans(intf, projectid)
+
+
+def list_project_assessors(intf, projectid):
+    """
+    List all the assessors of a project, using the project index if set.
+
+    :param intf: pyxnat.Interface object
+    :param projectid: ID of a project on XNAT
+    :return: List of all the assessors for the project
+    """
+    index = get_project_index()
+    if index is None:
+        return XnatUtils.list_project_assessors(intf, projectid)
+    return index.list_project_assessors(intf, projectid)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" queue_layout.py
+
+Layout of the folders holding one file or folder per assessor.
+
+dax keeps the queue in folders with one entry per assessor: the batch
+ files (DISKQ/BATCH), the outlogs (DISKQ/OUTLOG), the attribute files
+ (DISKQ/<attribute>), the PBS files and outlogs of the xnatq launcher
+ (RESULTS_DIR/PBS and RESULTS_DIR/OUTLOG) and the results of the jobs
+ (RESULTS_DIR/<assessor_label>). With the flat layout (default), each
+ entry is directly in its folder. With hundreds of thousands of tasks,
+ every listing and lookup of these folders gets slower.
+
+With the sharded layout, the entries are in <folder>/<project>/<bucket>/
+ where bucket is the first characters of the md5 of the assessor label:
+ a folder never holds more than the tasks of one project divided by the
+ number of buckets and the listing of the tasks of a project only reads
+ the folders of that project.
+
+The layout is set by queue_layout in the [cluster] section of
+ ~/.dax_settings.ini. The readers find the entries in both layouts, so the
+ jobs submitted before a change of layout are still found, and
+ `dax migrate_layout` moves the existing entries to the layout set.
+"""
+
+from builtins import object
+from builtins import str
+
+import hashlib
+import logging
+import os
+
+from .dax_settings import DAX_Settings
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['get_layout', 'get_path', 'find_path', 'list_paths',
+           'scan_paths', 'list_names', 'migrate_folder']
+DAX_SETTINGS = DAX_Settings()
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+FLAT = 'flat'
+SHARDED = 'sharded'
+LAYOUTS = [FLAT, SHARDED]
+# Number of hexadecimal characters of the bucket (256 buckets per project)
+BUCKET_WIDTH = 2
+LABEL_SEP = '-x-'
+# os.scandir (python 3.5+): the type of the entries without a stat
+SCANDIR = getattr(os, 'scandir', None)
+
+
+class _DirEntry(object):
+    """ Entry of a folder when os.scandir is not available """
+    def __init__(self, base_dir, name):
+        """
+        Entry point for the _DirEntry class
+
+        :param base_dir: folder of the entry
+        :param name: name of the entry
+        :return: None
+        """
+        self.name = name
+        self.path = os.path.join(base_dir, name)
+
+    def is_dir(self):
+        """ Check if the entry is a folder """
+        return os.path.isdir(self.path)
+
+    def is_file(self):
+        """ Check if the entry is a file """
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        """ Get the stat of the entry """
+        return os.stat(self.path)
+
+
+def scan_dir(base_dir):
+    """
+    List the entries of a folder with their type
+
+    :param base_dir: folder to list
+    :return: list of os.DirEntry (or objects with the same methods)
+    """
+    if SCANDIR is not None:
+        return list(SCANDIR(base_dir))
+    return [_DirEntry(base_dir, name) for name in os.listdir(base_dir)]
+
+
+def get_layout():
+    """
+    Get the layout set in the settings
+
+    :return: 'flat' or 'sharded'
+    """
+    layout = DAX_SETTINGS.get_queue_layout()
+    if layout not in LAYOUTS:
+        LOGGER.warn('unknown queue_layout %s (%s), using flat.'
+                    % (layout, ', '.join(LAYOUTS)))
+        return FLAT
+    return layout
+
+
+def get_label_bucket(label):
+    """ Get the bucket of an assessor in the sharded layout """
+    return hashlib.md5(label.encode('utf-8')).hexdigest()[:BUCKET_WIDTH]
+
+
+def get_shard_dir(base_dir, label, layout=None):
+    """
+    Get the folder holding the entry of an assessor
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param label: assessor label
+    :param layout: 'flat' or 'sharded' (layout set if None)
+    :return: base_dir or base_dir/<project>/<bucket>
+    """
+    if (layout or get_layout()) == SHARDED:
+        return os.path.join(base_dir, label.split(LABEL_SEP)[0],
+                            get_label_bucket(label))
+    return base_dir
+
+
+def get_path(base_dir, label, filename=None, layout=None):
+    """
+    Get the path of the entry of an assessor in a layout
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param label: assessor label
+    :param filename: name of the entry (label if None, e.g. label.txt)
+    :param layout: 'flat' or 'sharded' (layout set if None)
+    :return: path of the entry
+    """
+    return os.path.join(get_shard_dir(base_dir, label, layout),
+                        filename or label)
+
+
+def find_path(base_dir, label, filename=None):
+    """
+    Get the path of the entry of an assessor
+
+    The entries written before a change of layout and not migrated stay
+     where they are: they are read and written there.
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param label: assessor label
+    :param filename: name of the entry (label if None, e.g. label.txt)
+    :return: path of the entry in the other layout if it is only there,
+             path in the layout set otherwise
+    """
+    layout = get_layout()
+    path = get_path(base_dir, label, filename, layout)
+    if not os.path.exists(path):
+        other = get_path(base_dir, label, filename,
+                         FLAT if layout == SHARDED else SHARDED)
+        if os.path.exists(other):
+            return other
+    return path
+
+
+def list_paths(base_dir, projects=None, skip=None):
+    """
+    List the entries of the assessors in a folder (both layouts)
+
+    The names with -x- are the entries of the flat layout, the other
+     folders are the projects of the sharded layout.
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param projects: list of projects (all if None)
+    :param skip: names of the folders in base_dir that are not entries
+    :return: list of (name of the entry, path)
+    """
+    paths = list()
+    if not os.path.isdir(base_dir):
+        return paths
+
+    for name in os.listdir(base_dir):
+        if skip and name in skip:
+            continue
+        path = os.path.join(base_dir, name)
+        if LABEL_SEP in name:
+            if not projects or name.split(LABEL_SEP)[0] in projects:
+                paths.append((name, path))
+        elif (not projects or name in projects) and os.path.isdir(path):
+            for bucket in os.listdir(path):
+                bucket_dir = os.path.join(path, bucket)
+                if os.path.isdir(bucket_dir):
+                    paths.extend((entry, os.path.join(bucket_dir, entry))
+                                 for entry in os.listdir(bucket_dir))
+    return paths
+
+
+def scan_paths(base_dir, projects=None, skip=None):
+    """
+    List the entries of the assessors in a folder (both layouts) with their
+     type, in one pass over the folders
+
+    Same as list_paths but the entries returned know if they are files or
+     folders without another stat (os.scandir).
+
+    :param base_dir: folder of the entries (e.g. RESULTS_DIR)
+    :param projects: list of projects (all if None)
+    :param skip: names of the folders in base_dir that are not entries
+    :return: list of os.DirEntry of the entries
+    """
+    entries = list()
+    if not os.path.isdir(base_dir):
+        return entries
+
+    for entry in scan_dir(base_dir):
+        if skip and entry.name in skip:
+            continue
+        if LABEL_SEP in entry.name:
+            if not projects or entry.name.split(LABEL_SEP)[0] in projects:
+                entries.append(entry)
+        elif (not projects or entry.name in projects) and entry.is_dir():
+            for bucket in scan_dir(entry.path):
+                if bucket.is_dir():
+                    entries.extend(scan_dir(bucket.path))
+    return entries
+
+
+def list_names(base_dir, projects=None, suffix=''):
+    """
+    Get the labels of the assessors with an entry in a folder (both layouts)
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param projects: list of projects (all if None)
+    :param suffix: extension of the entries after the assessor label
+    :return: set of assessor labels
+    """
+    names = set()
+    for name, _ in list_paths(base_dir, projects):
+        if suffix and name.endswith(suffix):
+            name = name[:-len(suffix)]
+        names.add(name)
+    return names
+
+
+def migrate_folder(base_dir, suffix='', layout=None, skip=None, flags=None):
+    """
+    Move the entries of a folder to a layout
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param suffix: extension of the entries after the assessor label
+    :param layout: 'flat' or 'sharded' (layout set if None)
+    :param skip: names of the folders in base_dir that are not entries
+    :param flags: names of the flag files, the folders without any of them
+                  are not moved (job still writing them)
+    :return: number of entries moved
+    """
+    layout = layout or get_layout()
+    moved = 0
+    for name, path in list_paths(base_dir, skip=skip):
+        label = name
+        if suffix and name.endswith(suffix):
+            label = name[:-len(suffix)]
+        new_path = get_path(base_dir, label, name, layout)
+        if new_path == path:
+            continue
+        if flags and not any(os.path.exists(os.path.join(path, flag))
+                             for flag in flags):
+            LOGGER.debug('not moving %s: no flag file' % path)
+            continue
+        if os.path.exists(new_path):
+            LOGGER.warn('not moving %s: %s already exists'
+                        % (path, new_path))
+            continue
+        if not os.path.isdir(os.path.dirname(new_path)):
+            os.makedirs(os.path.dirname(new_path))
+        os.rename(path, new_path)
+        moved += 1
+
+    if layout == FLAT:
+        remove_empty_shards(base_dir, skip)
+    LOGGER.info('%s entries of %s moved to the %s layout'
+                % (str(moved), base_dir, layout))
+    return moved
+
+
+def remove_empty_shards(base_dir, skip=None):
+    """
+    Remove the empty project/bucket folders of the sharded layout
+
+    :param base_dir: folder of the entries (e.g. DISKQ/BATCH)
+    :param skip: names of the folders in base_dir that are not entries
+    :return: None
+    """
+    for name in os.listdir(base_dir):
+        proj_dir = os.path.join(base_dir, name)
+        if LABEL_SEP in name or (skip and name in skip) or \
+           not os.path.isdir(proj_dir):
+            continue
+        for bucket in os.listdir(proj_dir):
+            try:
+                os.rmdir(os.path.join(proj_dir, bucket))
+            except OSError:
+                pass
+        try:
+            os.rmdir(proj_dir)
+        except OSError:
+            pass
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" queue_watch.py
+
+Wait for the changes of the DiskQ folders for `dax launch --watch`.
+
+InotifyWatcher uses the inotify API of Linux (through ctypes, no extra
+ package) on the folders and their sub-folders (projects and buckets of
+ the sharded layout, see queue_layout.py). It returns as soon as a file is
+ written, moved or removed. PollWatcher checks the modification time of
+ the same folders every few seconds: it is used when inotify is not
+ available and with --watch_poll.
+
+inotify only sees the changes made by the processes of this computer: use
+ --watch_poll when the tasks are built on another computer sharing
+ RESULTS_DIR (NFS, ...).
+"""
+
+from builtins import object
+from builtins import str
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['PollWatcher', 'InotifyWatcher', 'get_watcher']
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# inotify flags (see /usr/include/linux/inotify.h)
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+WATCH_MASK = (IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE)
+EVENT_HEADER = struct.Struct('iIII')
+# Seconds waited after a change for the other changes of the same build
+SETTLE_SECONDS = 1
+# Maximum number of seconds waited for the changes to settle
+SETTLE_MAX_SECONDS = 10
+LABEL_SEP = '-x-'
+
+
+def list_watched_dirs(root):
+    """
+    List a folder and its sub-folders that are not entries of assessors
+
+    The names with -x- (batch files, results folders, ...) are not read.
+
+    :param root: folder to watch (or file, e.g. the DiskQ store)
+    :return: list of folders (the file if root is a file)
+    """
+    if os.path.isfile(root):
+        return [root]
+    dirs = list()
+    if not os.path.isdir(root):
+        return dirs
+    dirs.append(root)
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if LABEL_SEP not in name and os.path.isdir(path):
+            dirs.extend(list_watched_dirs(path))
+    return dirs
+
+
+class PollWatcher(object):
+    """ Check the modification time of the folders every few seconds """
+    def __init__(self, roots, interval=5):
+        """
+        Entry point for the PollWatcher class
+
+        :param roots: folders (with their sub-folders) or files to watch
+        :param interval: seconds between two checks
+        :return: None
+        """
+        self.roots = roots
+        self.interval = interval
+        self.mtimes = self.get_mtimes()
+
+    def get_mtimes(self):
+        """
+        Get the modification time of the watched folders
+
+        :return: dictionary folder: modification time
+        """
+        mtimes = dict()
+        for root in self.roots:
+            for dir_path in list_watched_dirs(root):
+                try:
+                    mtimes[dir_path] = os.stat(dir_path).st_mtime
+                except OSError:
+                    pass
+        return mtimes
+
+    def has_changed(self):
+        """
+        Check if a folder changed since the last check
+
+        :return: True if a folder was changed, added or removed
+        """
+        mtimes = self.get_mtimes()
+        changed = mtimes != self.mtimes
+        self.mtimes = mtimes
+        return changed
+
+    def wait(self, timeout):
+        """
+        Wait for a change of the folders
+
+        :param timeout: maximum number of seconds to wait
+        :return: True if a folder changed, False after timeout seconds
+        """
+        end = time.time() + timeout
+        while time.time() < end:
+            time.sleep(max(0, min(self.interval, end - time.time())))
+            if self.has_changed():
+                return True
+        return False
+
+    def close(self):
+        """ Stop watching the folders """
+        pass
+
+
+class InotifyWatcher(object):
+    """ Wait for the inotify events of the folders """
+    def __init__(self, roots, interval=5):
+        """
+        Entry point for the InotifyWatcher class
+
+        :param roots: folders (with their sub-folders) or files to watch
+        :param interval: not used (see PollWatcher)
+        :raises: OSError if inotify is not available or a folder can not be
+                 watched (too many watches, ...)
+        :return: None
+        """
+        self.roots = roots
+        self.interval = interval
+        self.watches = dict()
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'),
+                                use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        try:
+            for root in self.roots:
+                self.add_watches(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_watches(self, root):
+        """
+        Watch a folder and its sub-folders
+
+        :param root: folder to watch
+        :raises: OSError if a folder can not be watched
+        :return: None
+        """
+        for dir_path in list_watched_dirs(root):
+            wdesc = self.libc.inotify_add_watch(
+                self.fd, dir_path.encode(sys.getfilesystemencoding()),
+                WATCH_MASK)
+            if wdesc < 0:
+                err = ctypes.get_errno()
+                if err == errno.ENOENT:
+                    continue
+                raise OSError(err, 'cannot watch %s: %s'
+                              % (dir_path, os.strerror(err)))
+            self.watches[wdesc] = dir_path
+
+    def read_events(self):
+        """
+        Read the pending events and watch the new folders
+
+        :return: True if an event was read
+        """
+        try:
+            data = os.read(self.fd, 65536)
+        except OSError as err:
+            if err.errno == errno.EAGAIN:
+                return False
+            raise
+
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wdesc, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                LOGGER.debug('inotify queue overflow')
+            elif mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO) and \
+                    wdesc in self.watches:
+                # New project or bucket of the sharded layout
+                name = name.decode(sys.getfilesystemencoding())
+                if LABEL_SEP not in name:
+                    try:
+                        self.add_watches(os.path.join(self.watches[wdesc],
+                                                      name))
+                    except OSError as err:
+                        LOGGER.warn(str(err))
+        return len(data) > 0
+
+    def wait(self, timeout):
+        """
+        Wait for a change of the folders
+
+        :param timeout: maximum number of seconds to wait
+        :return: True if a folder changed, False after timeout seconds
+        """
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable or not self.read_events():
+            return False
+
+        # The other files of the same build
+        end = time.time() + SETTLE_MAX_SECONDS
+        while time.time() < end and \
+                select.select([self.fd], [], [], SETTLE_SECONDS)[0]:
+            if not self.read_events():
+                break
+        return True
+
+    def close(self):
+        """ Stop watching the folders """
+        if getattr(self, 'fd', -1) >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def get_watcher(roots, interval=5, poll=False):
+    """
+    Get the watcher of the DiskQ folders
+
+    :param roots: folders to watch (with their sub-folders)
+    :param interval: seconds between two checks when polling
+    :param poll: poll the folders instead of using inotify
+    :return: InotifyWatcher object, PollWatcher object if inotify is not
+             available or poll is True
+    """
+    if not poll:
+        try:
+            return InotifyWatcher(roots, interval)
+        except (OSError, AttributeError, TypeError) as err:
+            LOGGER.warn('cannot use inotify (%s), polling every %s seconds.'
+                        % (err, str(interval)))
+    return PollWatcher(roots, interval)
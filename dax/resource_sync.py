@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" resource_sync.py
+
+Upload only the files of a resource folder that are not already on XNAT.
+
+upload_resource used to delete the resource on XNAT and upload the whole
+ folder again, even when most of the files did not change (assessor
+ reprocessed, upload retried after a failure, ...). Here, the files of the
+ folder (the manifest) are compared with the files in the catalog of the
+ resource on XNAT. Only the files on XNAT with the same size are read to
+ compare their md5 with the digest on XNAT: the new and changed files
+ are uploaded in one zip streamed to XNAT (see zip_stream.py), the files
+ that are not in the folder anymore are deleted and the others are left
+ as they are.
+
+XNAT only lists a digest for the files when the checksums are enabled in
+ its site settings. When the resource has files but no digest, it is
+ replaced like before, unless an interrupted upload of the folder is
+ resumed (see XnatUtils.upload_folder_parts).
+
+The bytes uploaded and skipped are logged for each resource and summed for
+ the whole upload (see SyncReport). The time saved is estimated from the
+ rate of the bytes uploaded.
+"""
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+from builtins import str
+
+import collections
+import hashlib
+import logging
+import os
+import threading
+import time
+from urllib.parse import quote, unquote
+
+from . import XnatUtils
+from . import zip_stream
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['get_manifest', 'get_remote_manifest', 'get_sync_plan',
+           'sync_folder', 'SyncReport', 'SYNC_REPORT']
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Size of the chunks read to compute the md5 of a file
+READ_SIZE = 1024 * 1024
+FILES_SEP = '/files/'
+
+
+def get_file_digest(fpath):
+    """
+    Get the md5 of a file
+
+    :param fpath: path of the file
+    :return: md5 hexadecimal digest
+    """
+    md5 = hashlib.md5()
+    with open(fpath, 'rb') as fobj:
+        for data in iter(lambda: fobj.read(READ_SIZE), b''):
+            md5.update(data)
+    return md5.hexdigest()
+
+
+def get_manifest(directory, remote=None):
+    """
+    Get the manifest of a resource folder
+
+    The files are the ones zipped by zip_stream.list_zip_files. The md5 is
+     only computed for the files that can be unchanged: on XNAT with a
+     digest and the same size (all the files if remote is None).
+
+    :param directory: resource folder
+    :param remote: files on XNAT (see get_remote_manifest)
+    :return: ordered dictionary path in the resource: (path, size, md5 or
+             None if not computed)
+    """
+    manifest = collections.OrderedDict()
+    for fpath, name in zip_stream.list_zip_files(directory):
+        size = os.path.getsize(fpath)
+        digest = None
+        if remote is None or \
+           (name in remote and remote[name][1] and
+                remote[name][0] in (None, size)):
+            digest = get_file_digest(fpath)
+        manifest[name] = (fpath, size, digest)
+    return manifest
+
+
+def get_remote_manifest(intf, resource_uri):
+    """
+    Get the size and digest of the files of a resource on XNAT
+
+    :param intf: pyxnat.Interface object
+    :param resource_uri: uri of the resource
+    :return: dictionary path in the resource: (size, md5 or None if XNAT
+             does not compute the checksums)
+    """
+    remote = dict()
+    for xfile in intf._get_json('%s/files' % resource_uri):
+        uri = xfile.get('URI', '')
+        if FILES_SEP in uri:
+            name = unquote(uri.split(FILES_SEP, 1)[1])
+        else:
+            name = xfile.get('Name')
+        size = xfile.get('Size')
+        remote[name] = (int(size) if size else None,
+                        xfile.get('digest') or None)
+    return remote
+
+
+def get_sync_plan(manifest, remote):
+    """
+    Compare the manifest of a folder with the files on XNAT
+
+    :param manifest: manifest of the folder (see get_manifest)
+    :param remote: files on XNAT (see get_remote_manifest)
+    :return: tuple of sorted lists (files to upload, files unchanged, files
+             to delete on XNAT)
+    """
+    upload = list()
+    unchanged = list()
+    for name, (_, size, digest) in manifest.items():
+        if digest and name in remote and remote[name][1] == digest and \
+           remote[name][0] in (None, size):
+            unchanged.append(name)
+        else:
+            upload.append(name)
+    stale = [name for name in remote if name not in manifest]
+    return sorted(upload), sorted(unchanged), sorted(stale)
+
+
+class SyncReport(object):
+    """ Bytes uploaded and skipped by sync_folder, for all the threads """
+    def __init__(self):
+        """
+        Entry point for the SyncReport class
+
+        :return: None
+        """
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Set the counts back to zero """
+        self.resources = 0
+        self.files_sent = 0
+        self.files_skipped = 0
+        self.files_deleted = 0
+        self.bytes_sent = 0
+        self.bytes_skipped = 0
+        self.seconds = 0.0
+
+    def add(self, stats):
+        """
+        Add the counts of a resource
+
+        :param stats: dictionary returned by sync_folder
+        :return: None
+        """
+        with self.lock:
+            self.resources += 1
+            self.files_sent += stats['files_sent']
+            self.files_skipped += stats['files_skipped']
+            self.files_deleted += stats['files_deleted']
+            self.bytes_sent += stats['bytes_sent']
+            self.bytes_skipped += stats['bytes_skipped']
+            self.seconds += stats['seconds']
+
+    def get_saved_seconds(self):
+        """
+        Estimate the time saved by not uploading the files unchanged
+
+        :return: seconds (None if nothing was uploaded to measure the rate)
+        """
+        return estimate_saved_seconds(self.bytes_sent, self.bytes_skipped,
+                                      self.seconds)
+
+    def report(self):
+        """
+        Log the counts of all the resources synced
+
+        :return: None
+        """
+        if not self.resources:
+            return
+        msg = 'Resources synced: %s, files uploaded: %s (%s), unchanged: %s \
+(%s), deleted: %s'
+        LOGGER.info(msg % (str(self.resources), str(self.files_sent),
+                           format_size(self.bytes_sent),
+                           str(self.files_skipped),
+                           format_size(self.bytes_skipped),
+                           str(self.files_deleted)))
+        saved = self.get_saved_seconds()
+        if saved is not None:
+            LOGGER.info('Upload time saved: about %.1f seconds' % saved)
+
+
+# Counts of the current upload (see dax_tools_utils.upload_results)
+SYNC_REPORT = SyncReport()
+
+
+def format_size(nbytes):
+    """ Format a number of bytes for the logs """
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if nbytes < 1024.0:
+            return '%.1f %s' % (nbytes, unit)
+        nbytes /= 1024.0
+    return '%.1f TB' % nbytes
+
+
+def estimate_saved_seconds(bytes_sent, bytes_skipped, seconds):
+    """
+    Estimate the time saved from the rate of the bytes uploaded
+
+    :param bytes_sent: bytes uploaded
+    :param bytes_skipped: bytes not uploaded
+    :param seconds: time spent uploading bytes_sent
+    :return: seconds (None if nothing was uploaded to measure the rate)
+    """
+    if not bytes_sent or not seconds:
+        return None
+    return bytes_skipped * seconds / bytes_sent
+
+
+def sync_folder(intf, resource_obj, directory, resource_label):
+    """
+    Upload the files of a folder that are not already on a resource
+
+    :param intf: pyxnat.Interface object
+    :param resource_obj: pyxnat EObject of the resource
+    :param directory: resource folder
+    :param resource_label: label of the resource
+    :return: dictionary with the counts (files/bytes sent, skipped, deleted)
+             and the seconds spent uploading
+    """
+    resource_uri = resource_obj._uri
+    remote = dict()
+    if resource_obj.exists():
+        remote = get_remote_manifest(intf, resource_uri)
+        if remote and not any(digest for _, digest in remote.values()) and \
+           not XnatUtils.is_upload_resumed(directory):
+            LOGGER.debug('    no digests on XNAT for %s, replacing it.'
+                         % resource_label)
+            resource_obj.delete()
+            remote = dict()
+    if not resource_obj.exists():
+        resource_obj.create()
+
+    # Only the files that can be unchanged are read for their md5
+    manifest = get_manifest(directory, remote)
+    upload, unchanged, stale = get_sync_plan(manifest, remote)
+    start = time.time()
+    bytes_sent = 0
+    if upload:
+        # Same order as the folder so the parts of a resumed upload match
+        upload_set = set(upload)
+        files = [(fpath, name) for name, (fpath, _, _) in manifest.items()
+                 if name in upload_set]
+        XnatUtils.upload_folder_parts(intf, resource_uri, directory,
+                                      resource_label, files=files)
+        bytes_sent = sum(manifest[name][1] for name in upload)
+    for name in stale:
+        intf._exec('%s%s%s' % (resource_uri, FILES_SEP, quote(name)),
+                   'DELETE')
+
+    stats = {'files_sent': len(upload),
+             'files_skipped': len(unchanged),
+             'files_deleted': len(stale),
+             'bytes_sent': bytes_sent,
+             'bytes_skipped': sum(manifest[name][1] for name in unchanged),
+             'seconds': time.time() - start}
+    LOGGER.debug('    %s: %s files uploaded (%s), %s unchanged (%s), %s \
+deleted' % (resource_label, str(stats['files_sent']),
+            format_size(stats['bytes_sent']), str(stats['files_skipped']),
+            format_size(stats['bytes_skipped']), str(stats['files_deleted'])))
+    SYNC_REPORT.add(stats)
+    return stats
@@ -2,6 +2,7 @@
 
 from builtins import str
 from builtins import object
+from builtins import zip
 
 from datetime import date
 import errno
@@ -9,16 +10,19 @@ import logging
 import os
 import shutil
 import time
+from xml.sax.saxutils import escape, quoteattr
 
 from . import cluster
-from .cluster import PBS
+from . import diskq_store
+from . import queue_layout
+from .cluster import PBS, PBSArray
 from .errors import (NeedInputsException, NoDataException,
                      ClusterLaunchException)
 from .dax_settings import DAX_Settings, DEFAULT_DATATYPE, DEFAULT_FS_DATATYPE
 
 
 __copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
-__all__ = ['Task', 'ClusterTask', 'XnatTask']
+__all__ = ['Task', 'ClusterTask', 'XnatTask', 'ListedTask']
 DAX_SETTINGS = DAX_Settings()
 # Logger to print logs
 LOGGER = logging.getLogger('dax')
@@ -88,6 +92,18 @@ INPUTS_DIRNAME = 'INPUTS'
 BATCH_DIRNAME = 'BATCH'
 OUTLOG_DIRNAME = 'OUTLOG'
 PBS_DIRNAME = 'PBS'
+# DiskQ status index: STATUS/<procstatus>/<project>/<assessor_label>
+STATUS_DIRNAME = 'STATUS'
+# Flag set once all the tasks of the DiskQ are in the status index
+STATUS_INDEX_FLAG = 'INDEXED.txt'
+# XML document to create an assessor in one request (PUT with inbody=true)
+ASSESSOR_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<{xsitype} xmlns:xnat="http://nrg.wustl.edu/xnat" \
+xmlns:proc="http://nrg.wustl.edu/proc" xmlns:fs="http://nrg.wustl.edu/fs"\
+{attrs}>
+{fields}
+</{xsitype}>
+'''
 
 # Status and QC status supported by DAX
 SUPPORTED_STATUS = [NO_DATA, NEED_TO_RUN, NEED_INPUTS, JOB_RUNNING, JOB_FAILED,
@@ -112,6 +128,150 @@ def create_flag(flag_path):
     open(flag_path, 'w').close()
 
 
+def get_initial_status(has_inputs, qcstatus):
+    """
+    Get the statuses of a new assessor from the processor has_inputs
+
+    :param has_inputs: status returned by has_inputs (1, 0 or -1)
+    :param qcstatus: qcstatus returned by has_inputs
+    :return: procstatus, qcstatus
+    """
+    if has_inputs == 1:
+        return NEED_TO_RUN, JOB_PENDING
+    elif has_inputs == -1:
+        return NO_DATA, qcstatus
+    return NEED_INPUTS, qcstatus
+
+
+def create_assessor(assessor, processor, procstatus=NEED_INPUTS,
+                    qcstatus=JOB_PENDING):
+    """
+    Create the assessor on XNAT with all its initial fields
+
+    The genProcData and FreeSurfer assessors are created from an XML
+     document in one request. Other datatypes are created field by field.
+
+    :param assessor: pyxnat assessor object (not existing yet)
+    :param processor: processor of the assessor
+    :param procstatus: procstatus to set
+    :param qcstatus: qcstatus to set
+    :return: None
+    """
+    atype = processor.xsitype.lower()
+    if atype == DEFAULT_DATATYPE.lower():
+        xsitype = DEFAULT_DATATYPE
+        fields = [('proc:procstatus', procstatus),
+                  ('proc:proctype', processor.name),
+                  ('proc:procversion', processor.version)]
+    elif atype == DEFAULT_FS_DATATYPE.lower():
+        xsitype = DEFAULT_FS_DATATYPE
+        fields = [('fs:fsversion', '0'),
+                  ('fs:procstatus', procstatus)]
+    else:
+        assessor.create(assessors=atype)
+        assessor.attrs.mset({'%s/date' % atype: str(date.today()),
+                             '%s/procstatus' % atype: procstatus,
+                             '%s/validation/status' % atype: qcstatus})
+        return
+
+    # label and project from the uri of the assessor
+    uri_parts = assessor._uri.split('/')
+    attrs = ' label=%s' % quoteattr(uri_parts[-1])
+    if 'projects' in uri_parts:
+        project = uri_parts[uri_parts.index('projects') + 1]
+        attrs += ' project=%s' % quoteattr(project)
+
+    # elements in the order of the XNAT schema
+    xml_fields = ['<xnat:date>%s</xnat:date>' % str(date.today()),
+                  '<xnat:validation status=%s/>' % quoteattr(qcstatus or '')]
+    for tag, value in fields:
+        if value is not None:
+            xml_fields.append('<%s>%s</%s>' % (tag, escape(str(value)), tag))
+
+    xml_str = ASSESSOR_XML.format(xsitype=xsitype, attrs=attrs,
+                                  fields='\n'.join(xml_fields))
+    assessor._intf._exec('%s?inbody=true' % assessor._uri, 'PUT', xml_str,
+                         {'content-type': 'text/xml'})
+
+
+def launch_array(task_list, jobdir, job_email=None,
+                 job_email_options=DAX_SETTINGS.get_email_opts(),
+                 xnat_host=None):
+    """
+    Launch tasks with the same array key (see Task.get_array_key) as one
+     job array
+
+    The PBS file of each task is written as usual. The job array runs the
+     PBS file of the line matching its index in the command table.
+
+    :param task_list: list of Task to launch
+    :param jobdir: absolute path where the data will be stored on the node
+    :param job_email: who to email if the job fails
+    :param job_email_options: grid-specific job email options (e.g.,
+     fails, starts, exits etc)
+    :param xnat_host: set the XNAT_HOST in the PBS job
+    :raises: ClusterLaunchException if the job array was not submitted
+    :return: True
+
+    """
+    pbs_array = write_array(task_list, jobdir, job_email, job_email_options,
+                            xnat_host)
+    return finish_array(task_list, pbs_array.submit())
+
+
+def write_array(task_list, jobdir, job_email=None,
+                job_email_options=DAX_SETTINGS.get_email_opts(),
+                xnat_host=None):
+    """
+    Write the PBS files of the tasks and the file of their job array
+
+    :param task_list: list of Task to launch
+    :param jobdir: absolute path where the data will be stored on the node
+    :param job_email: who to email if the job fails
+    :param job_email_options: grid-specific job email options (e.g.,
+     fails, starts, exits etc)
+    :param xnat_host: set the XNAT_HOST in the PBS job
+    :return: PBSArray object written
+
+    """
+    pbs_list = [cur_task.write_pbs(jobdir, job_email, job_email_options,
+                                   xnat_host)
+                for cur_task in task_list]
+    first_pbs = pbs_list[0]
+    array_name = '%s_array' % task_list[0].assessor_label
+    array_file = os.path.join(os.path.dirname(first_pbs.filename),
+                              '%s%s' % (array_name, JOB_EXTENSION_FILE))
+    array_outlog = os.path.join(os.path.dirname(first_pbs.outfile),
+                                '%s.output' % array_name)
+    processor = task_list[0].processor
+    pbs_array = PBSArray(array_file, array_outlog,
+                         [(pbs.filename, pbs.outfile) for pbs in pbs_list],
+                         processor.walltime_str, processor.memreq_mb,
+                         processor.ppn, job_email, job_email_options,
+                         xnat_host)
+    pbs_array.write()
+    return pbs_array
+
+
+def finish_array(task_list, jobids):
+    """
+    Set the jobs of a submitted job array on the tasks
+
+    :param task_list: list of Task launched in the job array
+    :param jobids: job ids of the array elements (see PBSArray.submit)
+    :raises: ClusterLaunchException if the job array was not submitted
+    :return: True
+
+    """
+    if not jobids:
+        LOGGER.error('failed to launch job array on cluster')
+        raise ClusterLaunchException
+
+    for cur_task, jobid in zip(task_list, jobids):
+        cur_task.set_launch(jobid)
+    return True
+
+
 class Task(object):
     """ Class Task to generate/manage the assessor with the cluster """
     def __init__(self, processor, assessor, upload_dir):
@@ -131,25 +291,13 @@ class Task(object):
 
         # Create assessor if needed
         if not assessor.exists():
-            if self.atype == DEFAULT_FS_DATATYPE.lower():
-                kwargs = {'%s/fsversion' % DEFAULT_FS_DATATYPE.lower(): '0'}
-                assessor.create(assessors=DEFAULT_FS_DATATYPE.lower(),
-                                **kwargs)
-            else:
-                assessor.create(assessors=self.atype)
-
-            self.set_createdate_today()
-            atype = self.atype.lower()
-            if atype == DEFAULT_DATATYPE.lower():
-                assessor.attrs.mset(
-                    {'%s/proctype' % atype: self.get_processor_name(),
-                     '%s/procversion' % atype: self.get_processor_version()})
-
-            self.set_proc_and_qc_status(NEED_INPUTS, JOB_PENDING)
+            create_assessor(assessor, processor, NEED_INPUTS, JOB_PENDING)
 
         # Cache for convenience
         self.assessor_id = assessor.id()
         self.assessor_label = assessor.label()
+        # Jobs of the input assessors to wait for (label: jobid)
+        self.depends = dict()
 
     def get_processor_name(self):
         """
@@ -219,33 +367,21 @@ class Task(object):
             if memused and jobnode:
                 LOGGER.debug('memused and walltime already set, skipping')
             else:
-                if memused == '':
-                    self.set_memused('NotFound')
-                if jobnode == '':
-                    self.set_jobnode('NotFound')
+                self.set_job_usage(
+                    memused=None if memused else 'NotFound',
+                    jobnode=None if jobnode else 'NotFound')
             return
 
         # We can't get info from cluster if job too old
         if not cluster.is_traceable_date(jobstrdate):
-            self.set_walltime('NotFound')
-            self.set_memused('NotFound')
-            self.set_jobnode('NotFound')
+            self.set_job_usage('NotFound', 'NotFound', 'NotFound')
             return
 
-        # Get usage with tracejob
+        # Get usage with tracejob (prefetched by cluster.prefetch_jobs_usage)
         jobinfo = cluster.tracejob_info(jobid, jobstrdate)
-        if jobinfo['mem_used'].strip():
-            self.set_memused(jobinfo['mem_used'])
-        else:
-            self.set_memused('NotFound')
-        if jobinfo['walltime_used'].strip():
-            self.set_walltime(jobinfo['walltime_used'])
-        else:
-            self.set_walltime('NotFound')
-        if jobinfo['jobnode'].strip():
-            self.set_jobnode(jobinfo['jobnode'])
-        else:
-            self.set_jobnode('NotFound')
+        self.set_job_usage(jobinfo['mem_used'].strip() or 'NotFound',
+                           jobinfo['walltime_used'].strip() or 'NotFound',
+                           jobinfo['jobnode'].strip() or 'NotFound')
 
     def get_memused(self):
         """
@@ -310,6 +446,27 @@ class Task(object):
         """
         self.assessor.attrs.set('%s/jobnode' % self.atype, jobnode)
 
+    def set_job_usage(self, memused=None, walltime=None, jobnode=None):
+        """
+        Set the usage of the job on XNAT with a single request
+
+        :param memused: String denoting the amount of memory used
+        :param walltime: String denoting how much time was used running
+         the process.
+        :param jobnode: String identifying the node the job ran on
+        :return: None
+
+        """
+        usage = dict()
+        if memused is not None:
+            usage['%s/memused' % self.atype] = memused
+        if walltime is not None:
+            usage['%s/walltimeused' % self.atype] = walltime
+        if jobnode is not None:
+            usage['%s/jobnode' % self.atype] = jobnode
+        if usage:
+            self.assessor.attrs.mset(usage)
+
     def undo_processing(self):
         """
         Unset the job ID, memory used, walltime, and jobnode information
@@ -495,6 +652,61 @@ undo_processing...')
          as returned by pbs.submit() method
         :return: True if the job failed
 
+        """
+        pbs = self.write_pbs(jobdir, job_email, job_email_options, xnat_host,
+                             writeonly, pbsdir)
+        if writeonly:
+            mes_format = """   filepath: {path}"""
+            LOGGER.info(mes_format.format(path=pbs.filename))
+            return True
+        else:
+            jobid, job_failed = pbs.submit(outlog=pbs.outfile,
+                                           force_no_qsub=force_no_qsub)
+            return self.finish_launch(jobid, job_failed, force_no_qsub)
+
+    def finish_launch(self, jobid, job_failed=False, force_no_qsub=False):
+        """
+        Set the job submitted for the task on XNAT
+
+        :param jobid: job id returned by the submission
+        :param job_failed: the job failed when running locally
+        :param force_no_qsub: the job ran locally on the computer
+        :raises: cluster.ClusterLaunchException if the jobid is 0 or empty
+        :return: True
+
+        """
+        if jobid == '' or jobid == '0':
+            LOGGER.error('failed to launch job on cluster')
+            raise ClusterLaunchException
+        else:
+            self.set_launch(jobid)
+            if force_no_qsub or \
+               not cluster.command_found(DAX_SETTINGS.get_cmd_submit()):
+                if job_failed:
+                    LOGGER.info('             * changing status to %s'
+                                % JOB_FAILED)
+                    self.set_status(JOB_FAILED)
+                else:
+                    LOGGER.info('             * changing status to %s'
+                                % READY_TO_UPLOAD)
+                    # Status already set in the spider
+            return True
+
+    def write_pbs(self, jobdir, job_email=None,
+                  job_email_options=DAX_SETTINGS.get_email_opts(),
+                  xnat_host=None, writeonly=False, pbsdir=None):
+        """
+        Write the PBS file of the job
+
+        :param jobdir: absolute path where the data will be stored on the node
+        :param job_email: who to email if the job fails
+        :param job_email_options: grid-specific job email options (e.g.,
+         fails, starts, exits etc)
+        :param xnat_host: set the XNAT_HOST in the PBS job
+        :param writeonly: write the job files without submitting them
+        :param pbsdir: folder to store the pbs file
+        :return: PBS object written
+
         """
         cmds = self.commands(jobdir)
         pbsfile = self.pbs_path(writeonly, pbsdir)
@@ -506,30 +718,16 @@ undo_processing...')
                   self.processor.env, job_email,
                   job_email_options, xnat_host)
         pbs.write()
-        if writeonly:
-            mes_format = """   filepath: {path}"""
-            LOGGER.info(mes_format.format(path=pbsfile))
-            return True
-        else:
-            jobid, job_failed = pbs.submit(outlog=outlog,
-                                           force_no_qsub=force_no_qsub)
+        return pbs
 
-            if jobid == '' or jobid == '0':
-                LOGGER.error('failed to launch job on cluster')
-                raise ClusterLaunchException
-            else:
-                self.set_launch(jobid)
-                if force_no_qsub or \
-                   not cluster.command_found(DAX_SETTINGS.get_cmd_submit()):
-                    if job_failed:
-                        LOGGER.info('             * changing status to %s'
-                                    % JOB_FAILED)
-                        self.set_status(JOB_FAILED)
-                    else:
-                        LOGGER.info('             * changing status to %s'
-                                    % READY_TO_UPLOAD)
-                        # Status already set in the spider
-                return True
+    def get_array_key(self):
+        """
+        Get the key of the tasks that can be launched in the same job array
+
+        :return: tuple (processor name, walltime, memory, ppn)
+        """
+        return (self.processor.name, self.processor.walltime_str,
+                self.processor.memreq_mb, self.processor.ppn)
 
     def check_date(self):
         """
@@ -727,18 +925,22 @@ undo_processing...')
     def set_launch(self, jobid):
         """
         Set the date that the job started and its associated ID on XNAT.
-        Additionally, set the procstatus to JOB_RUNNING
+        Additionally, set the procstatus to JOB_RUNNING (and the qcstatus to
+        JOB_PENDING for a job waiting for the jobs of its inputs)
 
         :param jobid: The ID of the process assigned by the grid scheduler
         :return: None
 
         """
         today_str = str(date.today())
-        self.assessor.attrs.mset({
+        attrs = {
             '%s/jobstartdate' % self.atype.lower(): today_str,
             '%s/jobid' % self.atype.lower(): jobid,
             '%s/procstatus' % self.atype.lower(): JOB_RUNNING,
-        })
+        }
+        if self.depends:
+            attrs['%s/validation/status' % self.atype] = JOB_PENDING
+        self.assessor.attrs.mset(attrs)
 
     def commands(self, jobdir):
         """
@@ -751,6 +953,9 @@ undo_processing...')
 
         """
         assr_dir = os.path.join(jobdir, self.assessor_label)
+        if self.depends:
+            return self.processor.get_cmds(self.assessor, assr_dir,
+                                           pending=list(self.depends.keys()))
         return self.processor.get_cmds(self.assessor, assr_dir)
 
     def pbs_path(self, writeonly=False, pbsdir=None):
@@ -772,7 +977,8 @@ undo_processing...')
             else:
                 return os.path.join(os.path.join(res_dir, 'TRASH'), filename)
         else:
-            return os.path.join(os.path.join(res_dir, 'PBS'), filename)
+            return queue_layout.find_path(os.path.join(res_dir, 'PBS'),
+                                          self.assessor_label, filename)
 
     def outlog_path(self):
         """
@@ -781,7 +987,9 @@ undo_processing...')
         :return: A string that is the absolute path to the OUTLOG file.
         """
         assr_fout = '%s.output' % self.assessor_label
-        return os.path.join(self.upload_dir, OUTLOG_DIRNAME, assr_fout)
+        return queue_layout.find_path(
+            os.path.join(self.upload_dir, OUTLOG_DIRNAME),
+            self.assessor_label, assr_fout)
 
     def ready_flag_exists(self):
         """
@@ -791,7 +999,8 @@ undo_processing...')
         :return: True if the file exists. False if the file does not exist.
 
         """
-        flagfile = os.path.join(self.upload_dir, self.assessor_label,
+        flagfile = os.path.join(queue_layout.find_path(self.upload_dir,
+                                                       self.assessor_label),
                                 READY_TO_UPLOAD_FLAG_FILENAME)
         return os.path.isfile(flagfile)
 
@@ -805,19 +1014,118 @@ undo_processing...')
          in the assessor label folder in the upload directory.
 
         """
+        if self.ready_flag_exists():
+            # Job finished: let Upload Spider handle the upload, no need to
+            # ask the cluster (the job is not in the queue anymore)
+            return JOB_RUNNING
+
         # Check status on cluster
         jobstatus = self.get_job_status(jobid)
 
         if not jobstatus or jobstatus in ['R', 'Q']:
             # Still running
             return JOB_RUNNING
-        elif not self.ready_flag_exists():
-            # Check for a flag file created upon completion,
-            # if it's not there then the job failed
-            return JOB_FAILED
         else:
-            # Let Upload Spider handle the upload
-            return JOB_RUNNING
+            # No flag file created upon completion: the job failed
+            return JOB_FAILED
+
+
+class ListedTask(Task):
+    """ Class Task built from a row of the assessors listing
+
+    The statuses and the job information come from the row (see
+     XnatUtils.list_project_assessors). The pyxnat object of the assessor is
+     only selected when a method needs it (e.g. to write on XNAT).
+    """
+    def __init__(self, processor, xnat, assr_info, upload_dir):
+        """
+        Init of class ListedTask
+
+        :param processor: processor used
+        :param xnat: pyxnat.Interface object
+        :param assr_info: dictionary containing the assessor info
+                          (See XnatUtils.list_project_assessors)
+        :param upload_dir: upload directory to copy data after job finished.
+        :return: None
+
+        """
+        self.processor = processor
+        self.xnat = xnat
+        self.assr_info = assr_info
+        self.upload_dir = upload_dir
+        self.atype = processor.xsitype.lower()
+        self._assessor = None
+
+        # Cache for convenience
+        self.assessor_id = assr_info['assessor_id']
+        self.assessor_label = assr_info['assessor_label']
+        # Jobs of the input assessors to wait for (label: jobid)
+        self.depends = dict()
+
+    @property
+    def assessor(self):
+        """
+        pyxnat object of the assessor, selected on the first use
+
+        :return: pyxnat EObject
+        """
+        if self._assessor is None:
+            from . import XnatUtils
+            self._assessor = XnatUtils.get_full_object(self.xnat,
+                                                       self.assr_info)
+        return self._assessor
+
+    def get_info(self, key):
+        """
+        Get a value of the listing row
+
+        :param key: key of the row
+        :return: stripped string, '' if not set
+        """
+        return (self.assr_info.get(key) or '').strip()
+
+    def get_status(self):
+        """
+        Get the procstatus of the assessor from the listing
+
+        :return: The string of the procstatus of the assessor.
+        """
+        return self.get_info('procstatus')
+
+    def get_statuses(self):
+        """
+        Get the procstatus, qcstatus, and job id of the assessor from the
+         listing
+
+        :return: Serially ordered strings of the assessor procstatus,
+         qcstatus, then jobid.
+        """
+        return (self.get_info('procstatus'), self.get_info('qcstatus'),
+                self.get_info('jobid'))
+
+    def get_jobid(self):
+        """
+        Get the jobid of the assessor from the listing
+
+        :return: The jobid for the assessor as a string
+        """
+        return self.get_info('jobid')
+
+    def get_job_usage(self):
+        """
+        Get the amount of memory used, the amount of walltime used, the jobid
+         of the process, the node the process ran on, and when it started
+         from the listing.
+
+        :return: List of strings. Memory used, walltime used, jobid, node used,
+         and start date
+
+        """
+        return [self.get_info('memused'),
+                self.get_info('walltimeused'),
+                self.get_info('jobid'),
+                self.get_info('jobnode'),
+                self.get_info('jobstartdate')]
 
 
 class ClusterTask(Task):
@@ -898,33 +1206,21 @@ class ClusterTask(Task):
             if memused and jobnode:
                 LOGGER.debug('memused and walltime already set, skipping')
             else:
-                if memused == '':
-                    self.set_memused('NotFound')
-                if jobnode == '':
-                    self.set_jobnode('NotFound')
+                self.set_job_usage(
+                    memused=None if memused else 'NotFound',
+                    jobnode=None if jobnode else 'NotFound')
             return
 
         # We can't get info from cluster if job too old
         if not cluster.is_traceable_date(jobstrdate):
-            self.set_walltime('NotFound')
-            self.set_memused('NotFound')
-            self.set_jobnode('NotFound')
+            self.set_job_usage('NotFound', 'NotFound', 'NotFound')
             return
 
-        # Get usage with tracejob
+        # Get usage with tracejob (prefetched by cluster.prefetch_jobs_usage)
         jobinfo = cluster.tracejob_info(jobid, jobstrdate)
-        if jobinfo['mem_used'].strip():
-            self.set_memused(jobinfo['mem_used'])
-        else:
-            self.set_memused('NotFound')
-        if jobinfo['walltime_used'].strip():
-            self.set_walltime(jobinfo['walltime_used'])
-        else:
-            self.set_walltime('NotFound')
-        if jobinfo['jobnode'].strip():
-            self.set_jobnode(jobinfo['jobnode'])
-        else:
-            self.set_jobnode('NotFound')
+        self.set_job_usage(jobinfo['mem_used'].strip() or 'NotFound',
+                           jobinfo['walltime_used'].strip() or 'NotFound',
+                           jobinfo['jobnode'].strip() or 'NotFound')
 
     def get_memused(self):
         """
@@ -992,6 +1288,27 @@ class ClusterTask(Task):
         """
         self.set_attr('jobnode', jobnode)
 
+    def set_job_usage(self, memused=None, walltime=None, jobnode=None):
+        """
+        Set the usage of the job locally
+
+        :param memused: String denoting the amount of memory used
+        :param walltime: String denoting how much time was used running
+         the process.
+        :param jobnode: String identifying the node the job ran on
+        :return: None
+
+        """
+        attrs = dict()
+        if memused is not None:
+            attrs['memused'] = memused
+        if walltime is not None:
+            attrs['walltimeused'] = walltime
+        if jobnode is not None:
+            attrs['jobnode'] = jobnode
+        if attrs:
+            self.set_attrs(attrs)
+
     def undo_processing(self):
         raise NotImplementedError()
 
@@ -1071,11 +1388,31 @@ class ClusterTask(Task):
         :return: True if the job failed
 
         """
-        batch_path = self.batch_path()
-        outlog = self.outlog_path()
-        jobid, job_failed = cluster.submit_job(batch_path, outlog=outlog,
-                                               force_no_qsub=force_no_qsub)
+        jobid, job_failed = self.submit(force_no_qsub)
+        return self.finish_launch(jobid, job_failed, force_no_qsub)
 
+    def submit(self, force_no_qsub=False):
+        """
+        Submit the batch file of the task to the cluster
+
+        :param force_no_qsub: run the job locally on the computer (serial mode)
+        :return: jobid and error if the job failed when running locally
+        """
+        return cluster.submit_job(self.batch_path(),
+                                  outlog=self.outlog_path(),
+                                  force_no_qsub=force_no_qsub)
+
+    def finish_launch(self, jobid, job_failed=False, force_no_qsub=False):
+        """
+        Set the job submitted for the task locally
+
+        :param jobid: job id returned by the submission
+        :param job_failed: the job failed when running locally
+        :param force_no_qsub: the job ran locally on the computer
+        :raises: cluster.ClusterLaunchException if the jobid is 0 or empty
+        :return: True
+
+        """
         if jobid == '' or jobid == '0':
             LOGGER.error('failed to launch job on cluster')
             raise ClusterLaunchException
@@ -1217,9 +1554,9 @@ class ClusterTask(Task):
 
         """
         today_str = str(date.today())
-        self.set_attr('jobstartdate', today_str)
-        self.set_attr('jobid', jobid)
-        self.set_attr('procstatus', JOB_RUNNING)
+        self.set_attrs({'jobstartdate': today_str,
+                        'jobid': jobid,
+                        'procstatus': JOB_RUNNING})
 
     def commands(self, jobdir):
         """
@@ -1242,8 +1579,9 @@ class ClusterTask(Task):
 
         """
         label = self.assessor_label
-        return os.path.join(self.diskq, BATCH_DIRNAME,
-                            '%s%s' % (label, JOB_EXTENSION_FILE))
+        return queue_layout.find_path(os.path.join(self.diskq, BATCH_DIRNAME),
+                                      label, '%s%s' % (label,
+                                                       JOB_EXTENSION_FILE))
 
     def outlog_path(self):
         """
@@ -1252,7 +1590,8 @@ class ClusterTask(Task):
         :return: A string that is the absolute path to the OUTLOG file.
         """
         f_out = '%s.txt' % self.assessor_label
-        return os.path.join(self.diskq, OUTLOG_DIRNAME, f_out)
+        return queue_layout.find_path(os.path.join(self.diskq, OUTLOG_DIRNAME),
+                                      self.assessor_label, f_out)
 
     def upload_pbs_dir(self):
         """
@@ -1260,8 +1599,7 @@ class ClusterTask(Task):
 
         :return: A string that is the directory path for the PBS dir
         """
-        label = self.assessor_label
-        return os.path.join(self.upload_dir, label, PBS_DIRNAME)
+        return os.path.join(self.results_path(), PBS_DIRNAME)
 
     def upload_outlog_dir(self):
         """
@@ -1269,8 +1607,15 @@ class ClusterTask(Task):
 
         :return: A string that is the absolute path to the OUTLOG file.
         """
-        label = self.assessor_label
-        return os.path.join(self.upload_dir, label, OUTLOG_DIRNAME)
+        return os.path.join(self.results_path(), OUTLOG_DIRNAME)
+
+    def results_path(self):
+        """
+        Method to return the path of the results of the job
+
+        :return: A string that is the directory path for the results
+        """
+        return queue_layout.find_path(self.upload_dir, self.assessor_label)
 
     def check_running(self):
         """
@@ -1314,6 +1659,12 @@ class ClusterTask(Task):
         raise NotImplementedError()
 
     def get_attr(self, name):
+        store = diskq_store.get_diskq_store()
+        if store is not None:
+            attrs = store.get_attrs(self.assessor_label)
+            if attrs is not None:
+                return attrs[name]
+
         apath = self.attr_path(name)
 
         if not os.path.exists(apath):
@@ -1323,14 +1674,71 @@ class ClusterTask(Task):
             return f.read().strip()
 
     def set_attr(self, name, value):
-        attr_path = self.attr_path(name)
-        attr_dir = os.path.dirname(attr_path)
-        mkdirp(attr_dir)
-        with open(self.attr_path(name), 'w') as f:
-            f.write(str(value) + '\n')
+        self.set_attrs({name: value})
+
+    def set_attrs(self, attrs):
+        """
+        Set attributes of the task, in one transaction with the DiskQ store
+         (see diskq_store.py)
+
+        :param attrs: dictionary attribute: value
+        :return: None
+        """
+        store = diskq_store.get_diskq_store()
+        if store is not None:
+            if store.get_attrs(self.assessor_label) is None:
+                # Task written before the store: copy its files first
+                store.import_tasks([(self.assessor_label,
+                                     diskq_store.read_attr_files(
+                                         self.diskq, self.assessor_label))])
+            store.set_attrs(self.assessor_label, attrs)
+            return
+
+        old_status = None
+        if 'procstatus' in attrs:
+            old_status = self.get_status()
+
+        for name, value in list(attrs.items()):
+            attr_path = self.attr_path(name)
+            attr_dir = os.path.dirname(attr_path)
+            mkdirp(attr_dir)
+            with open(attr_path, 'w') as f:
+                f.write(str(value) + '\n')
+
+        if 'procstatus' in attrs:
+            self.set_status_index(old_status, str(attrs['procstatus']))
+
+    def status_index_path(self, status):
+        """
+        Method to return the path of the task in the DiskQ status index
+
+        :param status: procstatus of the task
+        :return: path STATUS/<procstatus>/<project>/<assessor_label>
+        """
+        return os.path.join(self.diskq, STATUS_DIRNAME, status,
+                            self.assessor_label.split('-x-')[0],
+                            self.assessor_label)
+
+    def set_status_index(self, old_status, new_status):
+        """
+        Move the task in the DiskQ status index
+
+        :param old_status: procstatus before the change (None if unknown)
+        :param new_status: procstatus set
+        :return: None
+        """
+        new_path = self.status_index_path(new_status)
+        mkdirp(os.path.dirname(new_path))
+        create_flag(new_path)
+        if old_status and old_status != new_status:
+            try:
+                os.remove(self.status_index_path(old_status))
+            except OSError:
+                pass
 
     def attr_path(self, attr):
-        return os.path.join(self.diskq, attr, self.assessor_label)
+        return queue_layout.find_path(os.path.join(self.diskq, attr),
+                                      self.assessor_label)
 
     def complete_task(self):
         self.check_job_usage()
@@ -1351,8 +1759,8 @@ class ClusterTask(Task):
         shutil.move(src, dst)
 
         # Touch file for dax_upload to check
-        create_flag(os.path.join(RESULTS_DIR, self.assessor_label,
-                    '%s.txt' % READY_TO_COMPLETE))
+        create_flag(os.path.join(self.results_path(),
+                                 '%s.txt' % READY_TO_COMPLETE))
 
         return COMPLETE
 
@@ -1375,12 +1783,12 @@ class ClusterTask(Task):
         shutil.move(src, dst)
 
         # Touch file for dax_upload that job failed
-        create_flag(os.path.join(RESULTS_DIR, self.assessor_label,
-                    '%s.txt' % JOB_FAILED))
+        create_flag(os.path.join(self.results_path(),
+                                 '%s.txt' % JOB_FAILED))
 
         # Touch file for dax_upload to check
-        create_flag(os.path.join(RESULTS_DIR, self.assessor_label,
-                    '%s.txt' % READY_TO_COMPLETE))
+        create_flag(os.path.join(self.results_path(),
+                                 '%s.txt' % READY_TO_COMPLETE))
 
         return JOB_FAILED
 
@@ -1399,6 +1807,14 @@ class ClusterTask(Task):
 
     def delete(self):
         # Delete attributes
+        store = diskq_store.get_diskq_store()
+        if store is not None:
+            store.delete(self.assessor_label)
+        else:
+            try:
+                os.remove(self.status_index_path(self.get_status()))
+            except OSError:
+                pass
         attr_list = ['jobid', 'jobnode', 'procstatus', 'walltimeused',
                      'memused', 'jobstartdate']
         for attr in attr_list:
@@ -1500,7 +1916,8 @@ undo_processing...')
 
         """
         f_pbs = '%s%s' % (self.assessor_label, JOB_EXTENSION_FILE)
-        return os.path.join(self.diskq, BATCH_DIRNAME, f_pbs)
+        return queue_layout.find_path(os.path.join(self.diskq, BATCH_DIRNAME),
+                                      self.assessor_label, f_pbs)
 
     def outlog_path(self):
         """
@@ -1509,7 +1926,8 @@ undo_processing...')
         :return: A string that is the absolute path to the OUTLOG file.
         """
         f_txt = '%s.txt' % self.assessor_label
-        return os.path.join(self.diskq, OUTLOG_DIRNAME, f_txt)
+        return queue_layout.find_path(os.path.join(self.diskq, OUTLOG_DIRNAME),
+                                      self.assessor_label, f_txt)
 
     def check_running(self):
         """
@@ -1547,6 +1965,9 @@ undo_processing...')
                         xnat_host)
             LOGGER.info('writing:' + batch_file)
             batch.write()
+            # New task in the queue for dax launch
+            ClusterTask(self.assessor_label, self.upload_dir,
+                        self.diskq).set_status(NEED_TO_RUN)
 
             new_proc_status = JOB_RUNNING
             new_qc_status = JOB_PENDING
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_cached_info.py
+
+Micro-benchmark of the memoized info() of the Cached classes of XnatUtils.
+
+A fake session is built with scans and assessors. The lookups done by
+ build_session for each processor (should_run, get_assessor_name,
+ has_inputs, ...) are replayed with the memoized info() and with a new
+ parsing of the XML on each call (behavior before the memoization).
+
+Usage: python -m dax.tests.bench_cached_info [nb_scans nb_assessors nb_proc]
+"""
+
+from __future__ import print_function
+
+from builtins import range
+from builtins import object
+
+import sys
+import time
+
+from dax import XnatUtils
+
+
+SESS_TMP = '''<xnat:MRSession xmlns:xnat="{xnat}" xmlns:proc="{proc}" \
+xmlns:xsi="{xsi}" ID="XNAT_E00001" label="Sess1" project="PROJ">
+<xnat:subject_ID>XNAT_S00001</xnat:subject_ID>
+<xnat:scans>{scans}</xnat:scans>
+<xnat:assessors>{assessors}</xnat:assessors>
+</xnat:MRSession>'''
+SCAN_TMP = '''<xnat:scan ID="{nb}" type="T1_{nb}" xsi:type="xnat:mrScanData">
+<xnat:quality>usable</xnat:quality><xnat:frames>176</xnat:frames>
+<xnat:series_description>T1 {nb}</xnat:series_description>
+<xnat:file label="NIFTI" format="NIFTI" file_count="1" \
+xsi:type="xnat:resourceCatalog"/>
+</xnat:scan>'''
+ASSR_TMP = '''<xnat:assessor ID="XNAT_E1{nb}" project="PROJ" \
+label="PROJ-x-Subj1-x-Sess1-x-{nb}-x-Proc_v1" xsi:type="proc:genProcData">
+<xnat:validation status="Passed"/>
+<xnat:out><xnat:file label="PDF" file_count="1" \
+xsi:type="xnat:resourceCatalog"/></xnat:out>
+<proc:procstatus>COMPLETE</proc:procstatus>
+<proc:proctype>Proc_v1</proc:proctype>
+</xnat:assessor>'''
+
+
+class FakeSelect(object):
+    """ Return the session XML like pyxnat select().get() """
+    def __init__(self, xml_str):
+        self.xml_str = xml_str
+
+    def select(self, _):
+        return self
+
+    def get(self):
+        return self.xml_str
+
+
+def get_fake_session(nb_scans, nb_assessors):
+    """
+    Create a CachedImageSession from a fake XML
+
+    :param nb_scans: number of scans in the session
+    :param nb_assessors: number of assessors in the session
+    :return: CachedImageSession object
+    """
+    scans = ''.join([SCAN_TMP.format(nb=i) for i in range(nb_scans)])
+    assessors = ''.join([ASSR_TMP.format(nb=i) for i in range(nb_assessors)])
+    xml_str = SESS_TMP.format(scans=scans, assessors=assessors,
+                              **XnatUtils.NS)
+    return XnatUtils.CachedImageSession(FakeSelect(xml_str), 'PROJ', 'Subj1',
+                                        'Sess1')
+
+
+def replay_build(csess, nb_proc, info):
+    """
+    Replay the info() lookups of build_session for nb_proc processors
+
+    :param csess: CachedImageSession object
+    :param nb_proc: number of scan processors
+    :param info: function returning the info dictionary of a cached object
+    :return: None
+    """
+    for _ in range(nb_proc):
+        for cscan in csess.scans():
+            # should_run / get_assessor_name / get_assessor / has_inputs
+            for _ in range(4):
+                scan_info = info(cscan)
+            scan_info['type'], scan_info['quality']
+            for cres in cscan.resources():
+                info(cres)['file_count']
+        # get_good_cassr
+        for cassr in csess.assessors():
+            assr_info = info(cassr)
+            assr_info['proctype'], assr_info['qcstatus']
+
+
+def get_cpu_time(csess, nb_proc, info, repeat=5):
+    """
+    Best CPU time of replay_build over a few runs
+
+    :return: CPU time in seconds
+    """
+    clock = getattr(time, 'process_time', None) or time.clock
+    best = None
+    for _ in range(repeat):
+        csess.reload()
+        start = clock()
+        replay_build(csess, nb_proc, info)
+        duration = clock() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def main(nb_scans=20, nb_assessors=150, nb_proc=30):
+    """
+    Print the CPU time per session with and without the memoized info()
+
+    :return: None
+    """
+    csess = get_fake_session(nb_scans, nb_assessors)
+    parsed = get_cpu_time(csess, nb_proc, lambda cobj: cobj._parse_info())
+    cached = get_cpu_time(csess, nb_proc, lambda cobj: cobj.info())
+    print('session with %d scans, %d assessors, %d processors'
+          % (nb_scans, nb_assessors, nb_proc))
+    print('  parsed on each call: %8.2f ms' % (parsed * 1000))
+    print('  memoized info():     %8.2f ms' % (cached * 1000))
+    print('  CPU saved:           %8.2f ms per session' %
+          ((parsed - cached) * 1000))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:4]])
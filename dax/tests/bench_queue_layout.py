@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" bench_queue_layout.py
+
+Micro-benchmark of the flat and sharded layouts of the queue folders.
+
+Queues of growing sizes are written in a temporary folder, spread over a
+ few projects, with one empty batch file per task in each layout. For each
+ size, the listing of the tasks of one project (load_task_queue with a
+ project filter, get_assessor_list for one project), the lookup of tasks
+ and the size of the largest folder are measured. With the sharded layout,
+ the listing cost only grows with the tasks of the project listed.
+
+Usage: python -m dax.tests.bench_queue_layout [nb_projects size1 size2 ...]
+"""
+
+from __future__ import print_function
+
+from builtins import range
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from dax import queue_layout
+
+
+JOB_EXTENSION_FILE = '.slurm'
+
+
+def get_labels(nb_tasks, nb_projects):
+    """
+    Get assessor labels spread over projects
+
+    :param nb_tasks: number of tasks
+    :param nb_projects: number of projects
+    :return: list of assessor labels
+    """
+    return ['PROJ%d-x-Subj%d-x-Sess%d-x-Proc_v1'
+            % (i % nb_projects, i, i) for i in range(nb_tasks)]
+
+
+def write_queue(base_dir, labels, layout):
+    """
+    Write one empty batch file per task in a layout
+
+    :return: None
+    """
+    for label in labels:
+        path = queue_layout.get_path(base_dir, label,
+                                     label + JOB_EXTENSION_FILE, layout)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        open(path, 'w').close()
+
+
+def get_largest_folder(base_dir):
+    """ Get the number of entries of the largest folder in base_dir """
+    return max(len(filenames) + len(dirnames)
+               for _, dirnames, filenames in os.walk(base_dir))
+
+
+def get_time(func, repeat=5):
+    """
+    Best wall time of func over a few runs
+
+    :return: time in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        if best is None or duration < best:
+            best = duration
+    return best
+
+
+def bench_layout(tmp_dir, labels, layout, nb_lookups=1000):
+    """
+    Measure the listing of one project and the lookups in a layout
+
+    :return: tuple (listing time, lookup time, largest folder)
+    """
+    base_dir = os.path.join(tmp_dir, layout)
+    write_queue(base_dir, labels, layout)
+    lookups = labels[::max(1, len(labels) // nb_lookups)]
+
+    listing = get_time(lambda: queue_layout.list_paths(base_dir, ['PROJ0']))
+    lookup = get_time(lambda: [os.path.exists(queue_layout.get_path(
+        base_dir, label, label + JOB_EXTENSION_FILE, layout))
+        for label in lookups]) / len(lookups)
+    largest = get_largest_folder(base_dir)
+    shutil.rmtree(base_dir)
+    return listing, lookup, largest
+
+
+def main(nb_projects=10, sizes=(1000, 10000, 50000)):
+    """
+    Print the listing and lookup times of both layouts for each queue size
+
+    :return: None
+    """
+    tmp_dir = tempfile.mkdtemp(prefix='bench_queue_layout_')
+    try:
+        print('%d projects, listing the tasks of one project' % nb_projects)
+        print('%8s %8s %14s %14s %10s' % ('tasks', 'layout', 'listing (ms)',
+                                          'lookup (us)', 'largest'))
+        for size in sizes:
+            labels = get_labels(size, nb_projects)
+            for layout in queue_layout.LAYOUTS:
+                listing, lookup, largest = bench_layout(tmp_dir, labels,
+                                                        layout)
+                print('%8d %8s %14.2f %14.2f %10d'
+                      % (size, layout, listing * 1000, lookup * 1000000,
+                         largest))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    ARGS = [int(arg) for arg in sys.argv[1:]]
+    if len(ARGS) > 1:
+        main(ARGS[0], ARGS[1:])
+    else:
+        main(*ARGS)
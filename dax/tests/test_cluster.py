@@ -0,0 +1,43 @@
+from unittest import TestCase
+
+from string import Template
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+from dax import cluster
+
+
+class FakeSettings(object):
+    def get_running_status(self):
+        return 'R'
+
+    def get_queue_status(self):
+        return 'PD'
+
+    def get_complete_status(self):
+        return 'CG'
+
+    def get_array_jobid(self):
+        return Template('${jobid}_${index}')
+
+
+@mock.patch.object(cluster, 'DAX_SETTINGS', FakeSettings())
+class TestJobsStatus(TestCase):
+    def test_expand_array_jobid(self):
+        self.assertEqual(cluster.expand_array_jobid('1234'), ['1234'])
+        self.assertEqual(cluster.expand_array_jobid('1234_7'), ['1234_7'])
+        self.assertEqual(cluster.expand_array_jobid('1234_[3-5,8]'),
+                         ['1234_3', '1234_4', '1234_5', '1234_8'])
+        # Limit of elements running at the same time
+        self.assertEqual(cluster.expand_array_jobid('1234_[1-3%2]'),
+                         ['1234_1', '1234_2', '1234_3'])
+        self.assertEqual(cluster.expand_array_jobid('1234_[9]'), ['1234_9'])
+
+    def test_parse_jobs_status(self):
+        output = b'100 R\n101 PD\n102 CG\n103 S\n\n104_[1-2] PD\n105\n'
+        self.assertEqual(cluster.parse_jobs_status(output),
+                         {'100': 'R', '101': 'Q', '102': 'C', '103': None,
+                          '104_1': 'Q', '104_2': 'Q', '105': None})
@@ -0,0 +1,60 @@
+from unittest import TestCase
+
+import collections
+import os
+import shutil
+import tempfile
+
+from dax import resource_sync
+
+
+class TestSyncPlan(TestCase):
+    def test_get_sync_plan(self):
+        manifest = collections.OrderedDict([
+            ('same.txt', ('/tmp/same.txt', 4, 'md5a')),
+            ('changed.txt', ('/tmp/changed.txt', 4, 'md5b')),
+            ('resized.txt', ('/tmp/resized.txt', 8, None)),
+            ('new.txt', ('/tmp/new.txt', 4, None)),
+            ('nosize.txt', ('/tmp/nosize.txt', 4, 'md5c')),
+        ])
+        remote = {'same.txt': (4, 'md5a'),
+                  'changed.txt': (4, 'md5x'),
+                  'resized.txt': (4, 'md5d'),
+                  'nosize.txt': (None, 'md5c'),
+                  'old.txt': (4, 'md5e')}
+        upload, unchanged, stale = resource_sync.get_sync_plan(manifest,
+                                                               remote)
+        self.assertEqual(upload, ['changed.txt', 'new.txt', 'resized.txt'])
+        self.assertEqual(unchanged, ['nosize.txt', 'same.txt'])
+        self.assertEqual(stale, ['old.txt'])
+
+    def test_no_remote_digest(self):
+        manifest = collections.OrderedDict([
+            ('a.txt', ('/tmp/a.txt', 4, None))])
+        upload, unchanged, stale = resource_sync.get_sync_plan(
+            manifest, {'a.txt': (4, None)})
+        self.assertEqual((upload, unchanged, stale), (['a.txt'], [], []))
+
+    def test_get_manifest(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            for name in ['same.txt', 'resized.txt', 'new.txt']:
+                with open(os.path.join(tmp_dir, name), 'wb') as f_obj:
+                    f_obj.write(b'data')
+            digest = resource_sync.get_file_digest(
+                os.path.join(tmp_dir, 'same.txt'))
+            remote = {'same.txt': (4, digest), 'resized.txt': (8, digest)}
+            manifest = resource_sync.get_manifest(tmp_dir, remote)
+            # Only the file with the same size on XNAT is read
+            self.assertEqual(manifest['same.txt'][2], digest)
+            self.assertIsNone(manifest['resized.txt'][2])
+            self.assertIsNone(manifest['new.txt'][2])
+            upload, unchanged, _ = resource_sync.get_sync_plan(manifest,
+                                                               remote)
+            self.assertEqual(upload, ['new.txt', 'resized.txt'])
+            self.assertEqual(unchanged, ['same.txt'])
+            # Without remote, every file is read
+            manifest = resource_sync.get_manifest(tmp_dir)
+            self.assertTrue(all(md5 for _, _, md5 in manifest.values()))
+        finally:
+            shutil.rmtree(tmp_dir)
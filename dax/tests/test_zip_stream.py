@@ -0,0 +1,71 @@
+from unittest import TestCase
+
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+
+from dax import zip_stream
+
+
+def zip_bytes(zip_obj, files):
+    """Zip the files with a ZipStream and return the whole zip."""
+    data = list()
+    for fpath, arcname in files:
+        data.extend(zip_obj.write_file(fpath, arcname))
+    data.extend(zip_obj.close())
+    return b''.join(data)
+
+
+class TestZipStream(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.contents = {
+            'report.txt': b'dax report\n' * 100,
+            'STATS/stats.csv': b'a,b\n1,2\n',
+            'NIFTI/seg.nii.gz': os.urandom(5000),
+            '.hidden': b'not zipped',
+        }
+        for name, content in self.contents.items():
+            fpath = os.path.join(self.tmp_dir, name)
+            if not os.path.isdir(os.path.dirname(fpath)):
+                os.makedirs(os.path.dirname(fpath))
+            with open(fpath, 'wb') as f_obj:
+                f_obj.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_zip(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as zip_file:
+            self.assertIsNone(zip_file.testzip())
+            self.assertEqual(sorted(zip_file.namelist()),
+                             ['NIFTI/seg.nii.gz', 'STATS/stats.csv',
+                              'report.txt'])
+            for name in zip_file.namelist():
+                self.assertEqual(zip_file.read(name), self.contents[name])
+            return dict((info.filename, info.compress_type)
+                        for info in zip_file.infolist())
+
+    def test_list_zip_files(self):
+        names = [name for _, name in
+                 zip_stream.list_zip_files(self.tmp_dir)]
+        self.assertEqual(names, ['report.txt', 'NIFTI/seg.nii.gz',
+                                 'STATS/stats.csv'])
+
+    def test_iter_zip(self):
+        data = b''.join(zip_stream.iter_zip(self.tmp_dir, chunk_size=1024))
+        methods = self.check_zip(data)
+        self.assertEqual(methods['report.txt'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(methods['NIFTI/seg.nii.gz'], zipfile.ZIP_STORED)
+
+    def test_zip64(self):
+        # The 5000 bytes file is zip64, the files after it and the central
+        # directory are over the limit
+        zip_obj = zip_stream.ZipStream(chunk_size=1024, zip64_limit=4096)
+        data = zip_bytes(zip_obj, zip_stream.list_zip_files(self.tmp_dir))
+        self.check_zip(data)
+        self.assertTrue(zip_obj.entries[1][-1])
+        self.assertGreater(zip_obj.entries[2][7], 4096)
+        self.assertIn(b'PK\x06\x06', data[-200:])
@@ -0,0 +1,402 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" zip_stream.py
+
+Zip a folder on the fly and stream the zip into the body of the request
+ uploading it to XNAT.
+
+upload_folder_to_obj used to run `zip -r` in the folder and upload the zip
+ written next to the data with put_zip: the data was read twice, the zip
+ needed as much free space as the results and the working directory of the
+ process was changed. Here, the files are read by chunks and compressed in
+ Python, each chunk is sent as soon as it is compressed (HTTP chunked
+ transfer encoding) and nothing is written on the disk. The files already
+ compressed (.nii.gz, .zip, images, ...) are stored without compressing
+ them again.
+
+The zip uses data descriptors (the sizes and CRC of a file are written
+ after its data) so it never has to seek back, and the zip64 extensions for
+ the files and archives over 4 GB.
+"""
+
+from future import standard_library
+standard_library.install_aliases()
+from builtins import object
+from builtins import str
+from past.builtins import basestring
+
+import base64
+import http.client
+import logging
+import os
+import socket
+import struct
+import time
+from urllib.parse import urlparse
+import zlib
+
+from .errors import XnatUtilsError, XnatUploadError
+
+
+__copyright__ = 'Copyright 2013 Vanderbilt University. All Rights Reserved'
+__all__ = ['ZipStream', 'iter_zip', 'put_folder_zip']
+# Logger to print logs
+LOGGER = logging.getLogger('dax')
+# Size of the chunks read from the files and sent to XNAT
+CHUNK_SIZE = 1024 * 1024
+# Extensions of the files stored without compression
+STORED_EXTENSIONS = ('.gz', '.tgz', '.bz2', '.xz', '.zip', '.mgz', '.png',
+                     '.jpg', '.jpeg', '.gif', '.pdf')
+COMPRESS_LEVEL = 6
+# Seconds without progress on the socket before an upload fails
+UPLOAD_TIMEOUT = 300
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_MAX_ENTRIES = 0xFFFF
+# General purpose flags: sizes in the data descriptor, utf-8 names
+ZIP_FLAGS = 0x0008 | 0x0800
+# Version made by: unix, 2.0
+VERSION_MADE_BY = (3 << 8) | 20
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+DATA_DESCRIPTOR = struct.Struct('<IIII')
+DATA_DESCRIPTOR64 = struct.Struct('<IIQQ')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR64 = struct.Struct('<IIQI')
+
+
+def is_stored(filename):
+    """
+    Check if a file is already compressed
+
+    :param filename: name of the file
+    :return: True if the file is stored without compression
+    """
+    return filename.lower().endswith(STORED_EXTENSIONS)
+
+
+def get_dos_time(mtime):
+    """
+    Get the date and time of a file in the MS-DOS format of the zip headers
+
+    :param mtime: modification time of the file
+    :return: tuple (dos time, dos date)
+    """
+    date_time = time.localtime(mtime)
+    if date_time.tm_year < 1980:
+        return 0, (0 << 9) | (1 << 5) | 1
+    dos_time = (date_time.tm_hour << 11) | (date_time.tm_min << 5) | \
+        (date_time.tm_sec // 2)
+    dos_date = ((date_time.tm_year - 1980) << 9) | \
+        (date_time.tm_mon << 5) | date_time.tm_mday
+    return dos_time, dos_date
+
+
+def list_zip_files(directory):
+    """
+    List the files zipped from a folder like `zip -r *` in the folder
+
+    The hidden files at the top of the folder are not zipped.
+
+    :param directory: folder to zip
+    :return: list of (path of the file, name in the zip)
+    """
+    files = list()
+    for root, dirnames, filenames in os.walk(directory, followlinks=True):
+        if root == directory:
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            filenames = [name for name in filenames
+                         if not name.startswith('.')]
+        dirnames.sort()
+        for filename in sorted(filenames):
+            fpath = os.path.join(root, filename)
+            arcname = os.path.relpath(fpath, directory)
+            files.append((fpath, arcname.replace(os.sep, '/')))
+    return files
+
+
+class ZipStream(object):
+    """ Write a zip as a stream of bytes, without seeking back """
+    def __init__(self, chunk_size=CHUNK_SIZE, zip64_limit=ZIP64_LIMIT):
+        """
+        Entry point for the ZipStream class
+
+        :param chunk_size: size of the chunks read from the files
+        :param zip64_limit: size or offset from which the zip64 extensions
+         are used (lower than 4 GB only to test them)
+        :return: None
+        """
+        self.chunk_size = chunk_size
+        self.zip64_limit = min(zip64_limit, ZIP64_LIMIT)
+        self.offset = 0
+        self.entries = list()
+
+    def _data(self, data):
+        """ Count the bytes written """
+        self.offset += len(data)
+        return data
+
+    def write_file(self, fpath, arcname):
+        """
+        Zip a file
+
+        :param fpath: path of the file
+        :param arcname: name of the file in the zip
+        :return: generator of the bytes of the zip
+        """
+        fstat = os.stat(fpath)
+        name = arcname.encode('utf-8')
+        method = ZIP_STORED if is_stored(arcname) else ZIP_DEFLATED
+        dos_time, dos_date = get_dos_time(fstat.st_mtime)
+        # Compressed data can be a bit larger than the file
+        zip64 = fstat.st_size * 1.05 > self.zip64_limit
+        extra = b''
+        if zip64:
+            extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0)
+        header_offset = self.offset
+        yield self._data(LOCAL_HEADER.pack(
+            0x04034b50, 45 if zip64 else 20, ZIP_FLAGS, method, dos_time,
+            dos_date, 0, ZIP64_LIMIT if zip64 else 0,
+            ZIP64_LIMIT if zip64 else 0, len(name), len(extra)) + name + extra)
+
+        crc = 0
+        file_size = 0
+        compress_size = 0
+        compressor = None
+        if method == ZIP_DEFLATED:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        with open(fpath, 'rb') as fobj:
+            while True:
+                data = fobj.read(self.chunk_size)
+                if not data:
+                    break
+                crc = zlib.crc32(data, crc)
+                file_size += len(data)
+                if compressor:
+                    data = compressor.compress(data)
+                if data:
+                    compress_size += len(data)
+                    yield self._data(data)
+        if compressor:
+            data = compressor.flush()
+            compress_size += len(data)
+            yield self._data(data)
+
+        crc &= 0xFFFFFFFF
+        if not zip64 and max(file_size, compress_size) >= self.zip64_limit:
+            raise XnatUtilsError('%s: file grew over 4 GB while zipped.'
+                                 % fpath)
+        if zip64:
+            yield self._data(DATA_DESCRIPTOR64.pack(
+                0x08074b50, crc, compress_size, file_size))
+        else:
+            yield self._data(DATA_DESCRIPTOR.pack(
+                0x08074b50, crc, compress_size, file_size))
+        self.entries.append((name, method, dos_time, dos_date, crc,
+                             compress_size, file_size, header_offset,
+                             fstat.st_mode, zip64))
+
+    def close(self):
+        """
+        Write the central directory at the end of the zip
+
+        :return: generator of the bytes of the zip
+        """
+        central_offset = self.offset
+        for (name, method, dos_time, dos_date, crc, compress_size, file_size,
+             header_offset, mode, zip64) in self.entries:
+            fields = list()
+            if zip64 or file_size >= self.zip64_limit:
+                fields.append(file_size)
+                file_size = ZIP64_LIMIT
+            if zip64 or compress_size >= self.zip64_limit:
+                fields.append(compress_size)
+                compress_size = ZIP64_LIMIT
+            if header_offset >= self.zip64_limit:
+                fields.append(header_offset)
+                header_offset = ZIP64_LIMIT
+            extra = b''
+            if fields:
+                extra = struct.pack('<HH%dQ' % len(fields), 0x0001,
+                                    8 * len(fields), *fields)
+            yield self._data(CENTRAL_HEADER.pack(
+                0x02014b50, VERSION_MADE_BY, 45 if extra else 20, ZIP_FLAGS,
+                method, dos_time, dos_date, crc, compress_size, file_size,
+                len(name), len(extra), 0, 0, 0, (mode & 0xFFFF) << 16,
+                header_offset) + name + extra)
+
+        central_size = self.offset - central_offset
+        count = len(self.entries)
+        end_size, end_offset = central_size, central_offset
+        if count >= ZIP_MAX_ENTRIES or central_offset >= self.zip64_limit or \
+           central_size >= self.zip64_limit:
+            end64_offset = self.offset
+            yield self._data(END_RECORD64.pack(
+                0x06064b50, END_RECORD64.size - 12, VERSION_MADE_BY, 45, 0, 0,
+                count, count, central_size, central_offset))
+            yield self._data(END_LOCATOR64.pack(0x07064b50, 0, end64_offset,
+                                                1))
+            if central_size >= self.zip64_limit:
+                end_size = ZIP64_LIMIT
+            if central_offset >= self.zip64_limit:
+                end_offset = ZIP64_LIMIT
+        yield self._data(END_RECORD.pack(
+            0x06054b50, 0, 0, min(count, ZIP_MAX_ENTRIES),
+            min(count, ZIP_MAX_ENTRIES), end_size, end_offset, 0))
+
+
+def iter_zip(directory, chunk_size=CHUNK_SIZE, files=None):
+    """
+    Zip a folder on the fly
+
+    The small pieces of the zip (headers, ...) are joined so each chunk is
+     at least chunk_size bytes (except the last one).
+
+    :param directory: folder to zip
+    :param chunk_size: size of the chunks
+    :param files: list of (path of the file, name in the zip) to zip (all
+     the files of the folder if None, see list_zip_files)
+    :return: generator of the chunks of the zip
+    """
+    if files is None:
+        files = list_zip_files(directory)
+    zip_stream = ZipStream(chunk_size)
+    buf = list()
+    buf_size = 0
+    for fpath, arcname in files:
+        for data in zip_stream.write_file(fpath, arcname):
+            buf.append(data)
+            buf_size += len(data)
+            if buf_size >= chunk_size:
+                yield b''.join(buf)
+                buf = list()
+                buf_size = 0
+    for data in zip_stream.close():
+        buf.append(data)
+    yield b''.join(buf)
+
+
+def get_connection(host, timeout=UPLOAD_TIMEOUT):
+    """
+    Open a connection to XNAT
+
+    A send or a read blocked for timeout seconds raises socket.timeout, so
+     a stalled upload fails instead of waiting forever.
+
+    :param host: XNAT host url (e.g. https://xnat.org)
+    :param timeout: socket timeout in seconds
+    :return: tuple (HTTPConnection or HTTPSConnection, path of the host)
+    """
+    url = urlparse(host)
+    if url.scheme == 'https':
+        conn = http.client.HTTPSConnection(url.hostname, url.port,
+                                           timeout=timeout)
+    else:
+        conn = http.client.HTTPConnection(url.hostname, url.port,
+                                          timeout=timeout)
+    return conn, url.path.rstrip('/')
+
+
+def get_auth_headers(intf):
+    """
+    Get the headers authenticating a request with the session of intf
+
+    :param intf: pyxnat.Interface object
+    :return: dictionary of headers
+    """
+    headers = dict()
+    user = getattr(intf, 'user', None) or getattr(intf, '_user', None)
+    pwd = getattr(intf, 'pwd', None) or getattr(intf, '_pwd', None)
+    if user:
+        auth = ('%s:%s' % (user, pwd or '')).encode('utf-8')
+        headers['Authorization'] = \
+            'Basic %s' % base64.b64encode(auth).decode('ascii')
+    jsession = getattr(intf, '_jsession', None)
+    if isinstance(jsession, basestring) and \
+       jsession.startswith('JSESSIONID='):
+        headers['Cookie'] = jsession
+    return headers
+
+
+def put_folder_zip(intf, resource_uri, directory, zip_name, extract=True,
+                   chunk_size=CHUNK_SIZE, files=None,
+                   timeout=UPLOAD_TIMEOUT):
+    """
+    Upload a folder to a resource as a zip streamed in the request body
+
+    :param intf: pyxnat.Interface object
+    :param resource_uri: uri of the resource (e.g. /data/projects/.../
+     resources/LABEL)
+    :param directory: folder to upload
+    :param zip_name: name of the zip on XNAT
+    :param extract: extract the files of the zip in the resource
+    :param chunk_size: size of the chunks sent
+    :param files: list of (path of the file, name in the zip) to upload (all
+     the files of the folder if None)
+    :param timeout: socket timeout in seconds (see get_connection)
+    :raises: XnatUploadError if the connection failed or stalled or XNAT
+             refused the upload
+    :return: number of bytes sent
+    """
+    host = getattr(intf, 'host', None) or intf._server
+    conn, base_path = get_connection(host, timeout)
+    uri = '%s/files/%s?inbody=true&overwrite=true' % (resource_uri, zip_name)
+    if extract:
+        uri += '&extract=true'
+    headers = get_auth_headers(intf)
+    headers['Content-Type'] = 'application/zip'
+    headers['Transfer-Encoding'] = 'chunked'
+    try:
+        status, content, sent = send_chunks(
+            conn, base_path + uri, headers,
+            iter_zip(directory, chunk_size, files))
+    except (socket.error, http.client.HTTPException) as err:
+        # The errors reading the files have a filename: not a network error
+        if getattr(err, 'filename', None):
+            raise
+        err_msg = '%s: upload of %s failed: %s'
+        raise XnatUploadError(err_msg % ('put_folder_zip', directory,
+                                         str(err)))
+    finally:
+        conn.close()
+
+    if hasattr(intf, 'invalidate_cache'):
+        intf.invalidate_cache(resource_uri)
+    if status >= 300:
+        err = '%s: upload of %s failed (HTTP %s): %s'
+        raise XnatUploadError(err % ('put_folder_zip', directory, str(status),
+                                     content[:200].decode('utf-8', 'replace')),
+                              status)
+    LOGGER.debug('%s uploaded as a %s bytes zip' % (directory, str(sent)))
+    return sent
+
+
+def send_chunks(conn, uri, headers, chunks):
+    """
+    Send a PUT request with a body in chunks (chunked transfer encoding)
+
+    :param conn: HTTPConnection object
+    :param uri: uri of the request
+    :param headers: dictionary of headers
+    :param chunks: generator of the chunks of the body
+    :return: tuple (HTTP status, content of the response, bytes sent)
+    """
+    sent = 0
+    conn.putrequest('PUT', uri)
+    for key, value in headers.items():
+        conn.putheader(key, value)
+    conn.endheaders()
+    for chunk in chunks:
+        if not chunk:
+            continue
+        conn.send(('%x\r\n' % len(chunk)).encode('ascii'))
+        conn.send(chunk)
+        conn.send(b'\r\n')
+        sent += len(chunk)
+    conn.send(b'0\r\n\r\n')
+    response = conn.getresponse()
+    return response.status, response.read(), sent